@@ -0,0 +1,509 @@
+import json
+import os
+import random
+import re
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from time import sleep
+from typing import Dict, Iterator, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+from requests.adapters import HTTPAdapter
+
+from itassets import graph, utils
+from organisation.microsoft_products import MS_PRODUCTS
+
+GRAPH_URL = "https://graph.microsoft.com"
+FAKE_TOKEN = {"token_type": "Bearer", "access_token": "fake-graph-access-token", "expires_in": 3600}
+# Client credentials set in the environment (if absent) while a fake Graph backend is in use.
+FAKE_CREDENTIALS = {"AZURE_TENANT_ID": "fake-tenant-id", "AZURE_CLIENT_ID": "fake-client-id", "AZURE_CLIENT_SECRET": "fake-secret"}
+
+
+class FakeGraphTenant:
+    """A generated Entra ID tenant, served by FakeGraphServer: user accounts (with managers, licences and
+    group membership), subscribed licence SKUs and interactive sign-in events. Changes made to user
+    accounts (via the API, or the `modify_users` method) are versioned, to be returned by delta queries.
+    Generation is deterministic for a given `seed`.
+    """
+
+    DOMAIN = "dbca.wa.gov.au"
+
+    def __init__(
+        self,
+        users: int = 1000,
+        groups: int = 100,
+        groups_per_user: int = 5,
+        signins: int = 5000,
+        signin_hours: int = 24,
+        licensed_ratio: float = 0.9,
+        seed: int = 0,
+    ):
+        self.rng = random.Random(seed)
+        self.lock = Lock()
+        self.version = 1
+        self.changes = {}  # {user ID: version in which the user was last changed}
+        self.removed = {}  # {user ID: version in which the user was deleted}
+        self.min_delta_version = 0  # Delta tokens for earlier versions have expired.
+        self.skus = {sku_id: name for name, sku_id in MS_PRODUCTS.items()}
+        self.group_ids = [self.new_id() for _ in range(groups)]
+        self.users = {}
+        self.managers = {}  # {user ID: manager user ID}
+        self.member_groups = {}  # {user ID: [group IDs]}
+
+        user_ids = []
+        for n in range(users):
+            user = self.generate_user(n, licensed_ratio)
+            self.users[user["id"]] = user
+            self.member_groups[user["id"]] = self.rng.sample(self.group_ids, min(groups_per_user, groups))
+            # Each user (except the first) is managed by a previously-generated user.
+            if user_ids:
+                self.managers[user["id"]] = self.rng.choice(user_ids)
+            user_ids.append(user["id"])
+
+        self.signins = []
+        self.add_signins(signins, hours=signin_hours)
+
+    def new_id(self) -> str:
+        return str(uuid.UUID(int=self.rng.getrandbits(128), version=4))
+
+    def generate_user(self, n: int, licensed_ratio: float = 0.9) -> Dict:
+        given_name, surname = f"Given{n}", f"Surname{n}"
+        email = f"{given_name}.{surname}@{self.DOMAIN}".lower()
+        if self.rng.random() < licensed_ratio:
+            licences = [MS_PRODUCTS["MICROSOFT 365 E5"] if self.rng.random() < 0.8 else MS_PRODUCTS["MICROSOFT 365 F3"]]
+        else:
+            licences = []
+        return {
+            "id": self.new_id(),
+            "mail": email,
+            "userPrincipalName": email,
+            "displayName": f"{given_name} {surname}",
+            "givenName": given_name,
+            "surname": surname,
+            "employeeId": f"{100000 + n:06}",
+            "employeeType": "Employee",
+            "jobTitle": "Officer",
+            "businessPhones": [f"08 9{n % 1000000:06}"],
+            "mobilePhone": None,
+            "department": None,
+            "companyName": None,
+            "officeLocation": None,
+            "proxyAddresses": [f"SMTP:{email}"],
+            "accountEnabled": True,
+            "onPremisesSyncEnabled": False,
+            "onPremisesSamAccountName": None,
+            "usageLocation": "AU",
+            "lastPasswordChangeDateTime": "2024-01-01T00:00:00Z",
+            "createdDateTime": "2020-01-01T00:00:00Z",
+            "assignedLicenses": [{"disabledPlans": [], "skuId": sku_id} for sku_id in licences],
+        }
+
+    def touch(self, user_id: str):
+        """Record a change to a user account, for delta queries. Call while holding the lock."""
+        self.version += 1
+        self.changes[user_id] = self.version
+
+    def modify_users(self, count: int) -> List[str]:
+        """Change the job title of `count` random user accounts, returning their IDs."""
+        with self.lock:
+            user_ids = self.rng.sample(list(self.users.keys()), min(count, len(self.users)))
+            for user_id in user_ids:
+                self.users[user_id]["jobTitle"] = f"Officer {self.version}"
+                self.touch(user_id)
+        return user_ids
+
+    def expire_delta_tokens(self):
+        """Expire all issued delta tokens, so that the next delta query requires a full synchronisation."""
+        with self.lock:
+            self.version += 1
+            self.min_delta_version = self.version
+
+    def add_signins(self, count: int, hours: float = 1):
+        """Generate `count` successful interactive sign-in events for random users over the previous `hours`."""
+        now = datetime.now(timezone.utc)
+        with self.lock:
+            user_ids = list(self.users.keys())
+            for _ in range(count):
+                user_id = self.rng.choice(user_ids)
+                created = now - timedelta(seconds=self.rng.uniform(0, hours * 3600))
+                self.signins.append(
+                    {
+                        "id": self.new_id(),
+                        "userId": user_id,
+                        "userPrincipalName": self.users[user_id]["userPrincipalName"],
+                        "createdDateTime": created.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                        "isInteractive": True,
+                        "status": {"errorCode": 0},
+                    }
+                )
+            # Sign-in events are returned most recent first.
+            self.signins.sort(key=lambda i: i["createdDateTime"], reverse=True)
+
+
+def error(status: int, code: str, message: str = "") -> Tuple[int, Dict, Dict]:
+    return status, {}, {"error": {"code": code, "message": message}}
+
+
+class FakeGraphServer:
+    """A local HTTP server which serves a subset of the Microsoft Graph API from a FakeGraphTenant:
+    users (list, get, create, update, delete, manager, getMemberGroups, assignLicense,
+    revokeSignInSessions, delta), subscribedSkus, auditLogs/signIns and $batch requests.
+    Each request (and each request in a batch) is delayed by `latency` seconds, and is throttled
+    (a 429 response with a Retry-After header of `retry_after` seconds) with probability `throttle_rate`.
+    """
+
+    PAGE_SIZE = 100
+    MAX_PAGE_SIZE = 999
+    ROUTES = (
+        ("POST", r"/\$batch", "batch"),
+        ("GET", r"/users/delta", "users_delta"),
+        ("POST", r"/users/validatePassword", "validate_password"),
+        ("GET", r"/users", "list_users"),
+        ("POST", r"/users", "create_user"),
+        ("GET", r"/users/(?P<id>[^/]+)", "get_user"),
+        ("PATCH", r"/users/(?P<id>[^/]+)", "update_user"),
+        ("DELETE", r"/users/(?P<id>[^/]+)", "delete_user"),
+        ("PUT", r"/users/(?P<id>[^/]+)/manager/\$ref", "set_manager"),
+        ("POST", r"/users/(?P<id>[^/]+)/getMemberGroups", "get_member_groups"),
+        ("POST", r"/users/(?P<id>[^/]+)/assignLicense", "assign_licence"),
+        ("POST", r"/users/(?P<id>[^/]+)/revokeSignInSessions", "revoke_sessions"),
+        ("GET", r"/subscribedSkus", "list_skus"),
+        ("GET", r"/subscribedSkus/(?P<id>[^/]+)", "get_sku"),
+        ("GET", r"/auditLogs/signIns", "list_signins"),
+    )
+
+    def __init__(
+        self,
+        tenant: Optional[FakeGraphTenant] = None,
+        latency: float = 0.0,
+        throttle_rate: float = 0.0,
+        retry_after: int = 1,
+        seed: int = 0,
+    ):
+        self.tenant = tenant or FakeGraphTenant()
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.stats_lock = Lock()
+        self.requests = Counter()  # {route name: count}
+        self.throttled = 0
+        self.httpd = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """Start serving requests from a background thread, on a free local port."""
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), FakeGraphRequestHandler)
+        self.httpd.fake_graph = self
+        Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def stop(self):
+        if self.httpd:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
+
+    def throttle(self) -> bool:
+        with self.stats_lock:
+            if self.throttle_rate and self.rng.random() < self.throttle_rate:
+                self.throttled += 1
+                return True
+        return False
+
+    def handle(self, method: str, url: str, body: Optional[Dict]) -> Tuple[int, Dict, Optional[Dict]]:
+        """Handle a single request, returning a tuple of (status, headers, JSON body)."""
+        if self.latency:
+            sleep(self.latency)
+        if self.throttle():
+            status, headers, data = error(429, "TooManyRequests", "Application is over its request quota")
+            return status, {"Retry-After": str(self.retry_after)}, data
+        return self.dispatch(method, url, body)
+
+    def dispatch(self, method: str, url: str, body: Optional[Dict]) -> Tuple[int, Dict, Optional[Dict]]:
+        parts = urlsplit(url)
+        path = re.sub(r"^/(v1\.0|beta)", "", parts.path)
+        # Query parameter names are case-insensitive.
+        query = {k.lower(): v for k, v in parse_qsl(parts.query)}
+
+        for route_method, pattern, name in self.ROUTES:
+            match = re.fullmatch(pattern, path)
+            if match and route_method == method:
+                with self.stats_lock:
+                    self.requests[name] += 1
+                return getattr(self, name)(parts.path, query, body, **match.groupdict())
+
+        return error(404, "BadRequest", f"Resource not found for the segment in {method} {parts.path}")
+
+    def page(self, path: str, query: Dict, items: List[Dict], final: Optional[Dict] = None) -> Tuple[int, Dict, Dict]:
+        """Return a page of `items` (per the $top and $skiptoken parameters), linking to the next page.
+        `final` is merged into the final page (e.g. a delta link).
+        """
+        top = min(int(query.get("$top", self.PAGE_SIZE)), self.MAX_PAGE_SIZE)
+        skip = int(query.get("$skiptoken", 0))
+        data = {"value": items[skip : skip + top]}
+        if skip + top < len(items):
+            data["@odata.nextLink"] = f"{GRAPH_URL}{path}?{urlencode(dict(query, **{'$skiptoken': skip + top}))}"
+        elif final:
+            data.update(final)
+        return 200, {}, data
+
+    def project(self, user: Dict, query: Dict, delta: bool = False) -> Dict:
+        """Return the user's properties as selected, expanding the manager if requested."""
+        select = [i for i in query["$select"].split(",") if i != "manager"] if "$select" in query else list(user.keys())
+        data = {key: user.get(key) for key in ["id"] + select}
+        manager_id = self.tenant.managers.get(user["id"])
+        if manager_id and manager_id in self.tenant.users:
+            if "manager" in query.get("$expand", ""):
+                data["manager"] = {"id": manager_id, "mail": self.tenant.users[manager_id]["mail"]}
+            elif delta and "manager" in query.get("$select", ""):
+                data["manager@delta"] = [{"@odata.type": "#microsoft.graph.user", "id": manager_id}]
+        return data
+
+    def get_user_or_404(self, user_id: str) -> Tuple[Optional[Dict], Optional[Tuple]]:
+        user = self.tenant.users.get(user_id)
+        if not user:
+            return None, error(404, "Request_ResourceNotFound", f"Resource '{user_id}' does not exist")
+        return user, None
+
+    def batch(self, path, query, body):
+        if not body or len(body.get("requests", [])) > graph.GraphBatch.MAX_REQUESTS:
+            return error(400, "BadRequest", "A batch must contain between 1 and 20 requests")
+        responses = []
+        statuses = {}
+        for request in body["requests"]:
+            depends_on = request.get("dependsOn", [])
+            if any(statuses.get(i, 424) >= 400 for i in depends_on):
+                status, headers, data = error(424, "FailedDependency", "A request this request depends on failed")
+            else:
+                status, headers, data = self.handle(request["method"], f"/v1.0{request['url']}", request.get("body"))
+            statuses[request["id"]] = status
+            response = {"id": request["id"], "status": status, "headers": headers}
+            if data is not None:
+                response["body"] = data
+            responses.append(response)
+        return 200, {}, {"responses": responses}
+
+    def users_delta(self, path, query, body):
+        tenant = self.tenant
+        with tenant.lock:
+            version = tenant.version
+            token = query.get("$deltatoken")
+            if token == "latest":
+                items = []
+            elif token is None:
+                items = [self.project(user, query, delta=True) for user in tenant.users.values()]
+            else:
+                since = int(token) if token.isdigit() else -1
+                if since < tenant.min_delta_version:
+                    return error(410, "syncStateNotFound", "The delta token has expired")
+                changed = [i for i, v in tenant.changes.items() if v > since and i in tenant.users]
+                items = [self.project(tenant.users[i], query, delta=True) for i in changed]
+                items += [{"id": i, "@removed": {"reason": "deleted"}} for i, v in tenant.removed.items() if v > since]
+
+        delta_query = {k: v for k, v in query.items() if k not in ("$deltatoken", "$skiptoken")}
+        delta_link = f"{GRAPH_URL}{path}?{urlencode(dict(delta_query, **{'$deltatoken': version}))}"
+        return self.page(path, query, items, final={"@odata.deltaLink": delta_link})
+
+    def validate_password(self, path, query, body):
+        return 200, {}, {"isValid": True, "validationResults": []}
+
+    def list_users(self, path, query, body):
+        with self.tenant.lock:
+            items = [self.project(user, query) for user in self.tenant.users.values()]
+        return self.page(path, query, items)
+
+    def create_user(self, path, query, body):
+        tenant = self.tenant
+        with tenant.lock:
+            upn = body["userPrincipalName"].lower()
+            if any(user["userPrincipalName"] == upn for user in tenant.users.values()):
+                return error(400, "Request_BadRequest", "Another object with the same value for property userPrincipalName already exists")
+            user = tenant.generate_user(len(tenant.users), licensed_ratio=0)
+            user.update({k: v for k, v in body.items() if k in user}, userPrincipalName=upn, mail=upn, proxyAddresses=[f"SMTP:{upn}"])
+            user["usageLocation"] = None
+            tenant.users[user["id"]] = user
+            tenant.member_groups[user["id"]] = []
+            tenant.touch(user["id"])
+        return 201, {}, user
+
+    def get_user(self, path, query, body, id):
+        with self.tenant.lock:
+            user, not_found = self.get_user_or_404(id)
+            return not_found or (200, {}, self.project(user, query))
+
+    def update_user(self, path, query, body, id):
+        with self.tenant.lock:
+            user, not_found = self.get_user_or_404(id)
+            if not_found:
+                return not_found
+            user.update(body or {})
+            self.tenant.touch(id)
+        return 204, {}, None
+
+    def delete_user(self, path, query, body, id):
+        tenant = self.tenant
+        with tenant.lock:
+            user, not_found = self.get_user_or_404(id)
+            if not_found:
+                return not_found
+            del tenant.users[id]
+            tenant.changes.pop(id, None)
+            tenant.version += 1
+            tenant.removed[id] = tenant.version
+        return 204, {}, None
+
+    def set_manager(self, path, query, body, id):
+        with self.tenant.lock:
+            user, not_found = self.get_user_or_404(id)
+            if not_found:
+                return not_found
+            self.tenant.managers[id] = body["@odata.id"].rstrip("/").split("/")[-1]
+            self.tenant.touch(id)
+        return 204, {}, None
+
+    def get_member_groups(self, path, query, body, id):
+        with self.tenant.lock:
+            user, not_found = self.get_user_or_404(id)
+            return not_found or (200, {}, {"value": list(self.tenant.member_groups.get(id, []))})
+
+    def assign_licence(self, path, query, body, id):
+        with self.tenant.lock:
+            user, not_found = self.get_user_or_404(id)
+            if not_found:
+                return not_found
+            if not user["usageLocation"]:
+                return error(400, "Request_BadRequest", "License assignment cannot be done for user with invalid usage location")
+            removed = set(body.get("removeLicenses", []))
+            licences = [i for i in user["assignedLicenses"] if i["skuId"] not in removed]
+            licences += [{"disabledPlans": i.get("disabledPlans", []), "skuId": i["skuId"]} for i in body.get("addLicenses", [])]
+            user["assignedLicenses"] = licences
+            self.tenant.touch(id)
+            return 200, {}, self.project(user, query)
+
+    def revoke_sessions(self, path, query, body, id):
+        with self.tenant.lock:
+            user, not_found = self.get_user_or_404(id)
+            return not_found or (200, {}, {"value": True})
+
+    def sku(self, sku_id: str) -> Dict:
+        consumed = sum(1 for user in self.tenant.users.values() if any(i["skuId"] == sku_id for i in user["assignedLicenses"]))
+        return {
+            "id": f"{os.environ.get('AZURE_TENANT_ID', FAKE_CREDENTIALS['AZURE_TENANT_ID'])}_{sku_id}",
+            "skuId": sku_id,
+            "skuPartNumber": self.tenant.skus[sku_id],
+            "capabilityStatus": "Enabled",
+            "consumedUnits": consumed,
+            "prepaidUnits": {"enabled": consumed + 1000, "suspended": 0, "warning": 0, "lockedOut": 0},
+        }
+
+    def list_skus(self, path, query, body):
+        with self.tenant.lock:
+            return 200, {}, {"value": [self.sku(sku_id) for sku_id in self.tenant.skus]}
+
+    def get_sku(self, path, query, body, id):
+        sku_id = id.split("_")[-1]
+        with self.tenant.lock:
+            if sku_id not in self.tenant.skus:
+                return error(404, "Request_ResourceNotFound", f"Resource '{id}' does not exist")
+            return 200, {}, self.sku(sku_id)
+
+    def list_signins(self, path, query, body):
+        since = re.search(r"createdDateTime ge ([0-9TZ:.\-]+)", query.get("$filter", ""))
+        with self.tenant.lock:
+            signins = [i for i in self.tenant.signins if not since or i["createdDateTime"] >= since.group(1)]
+        if "$select" in query:
+            fields = query["$select"].split(",")
+            signins = [{k: v for k, v in i.items() if k in fields} for i in signins]
+        return self.page(path, query, signins)
+
+
+class FakeGraphRequestHandler(BaseHTTPRequestHandler):
+    # Use persistent connections, so that connection pooling by the client is exercised.
+    protocol_version = "HTTP/1.1"
+
+    def handle_request(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            body = json.loads(self.rfile.read(length)) if length else None
+        except ValueError:
+            status, headers, data = error(400, "BadRequest", "Invalid JSON body")
+        else:
+            status, headers, data = self.server.fake_graph.handle(self.command, self.path, body)
+
+        content = json.dumps(data).encode() if data is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    do_GET = do_POST = do_PATCH = do_PUT = do_DELETE = handle_request
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeClientApplication:
+    """Stands in for the cached MSAL client application, returning a fake Graph API access token."""
+
+    def acquire_token_for_client(self, scopes: List[str]) -> Dict:
+        return dict(FAKE_TOKEN)
+
+
+class FakeGraphAdapter(HTTPAdapter):
+    """Transport adapter which sends requests for the Microsoft Graph API to a FakeGraphServer
+    instead (at `base_url`). Retries, connection pooling and timeouts behave as for the real API.
+    """
+
+    def __init__(self, base_url: str, **kwargs):
+        self.base_url = base_url
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        if request.url.startswith(GRAPH_URL):
+            request.url = self.base_url + request.url[len(GRAPH_URL) :]
+            # Proxies were selected for the Graph API URL, not the local server.
+            kwargs["proxies"] = {}
+        return super().send(request, **kwargs)
+
+
+@contextmanager
+def fake_graph(tenant: Optional[FakeGraphTenant] = None, **kwargs) -> Iterator[FakeGraphServer]:
+    """Context manager which runs a FakeGraphServer (passing in `kwargs`), and routes all requests made
+    via the shared Graph API session to it. Graph API access tokens are replaced with a fake token,
+    so that no network access is required. Yields the server (its tenant is `server.tenant`).
+    """
+    server = FakeGraphServer(tenant, **kwargs)
+    server.start()
+    environ = {key: os.environ.get(key) for key in FAKE_CREDENTIALS}
+    for key, value in FAKE_CREDENTIALS.items():
+        os.environ.setdefault(key, value)
+    credentials = utils._ms_client_credentials()
+    with utils.MS_CLIENT_APP_LOCK:
+        cached_app = utils.MS_CLIENT_APPS.get(credentials)
+        utils.MS_CLIENT_APPS[credentials] = FakeClientApplication()
+    previous_session = graph.set_graph_session(graph.build_graph_session(FakeGraphAdapter, base_url=server.url))
+
+    try:
+        yield server
+    finally:
+        graph.set_graph_session(previous_session).close()
+        with utils.MS_CLIENT_APP_LOCK:
+            if cached_app:
+                utils.MS_CLIENT_APPS[credentials] = cached_app
+            else:
+                utils.MS_CLIENT_APPS.pop(credentials, None)
+        for key, value in environ.items():
+            if value is None:
+                os.environ.pop(key, None)
+        server.stop()
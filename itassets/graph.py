@@ -0,0 +1,228 @@
+import logging
+from threading import Lock
+from time import sleep
+from typing import Callable, Dict, Iterator, List, Optional
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter, Retry
+
+from itassets.utils import TimeoutSession
+
+LOGGER = logging.getLogger("itassets")
+# A single HTTP session is shared by all calls to the Microsoft Graph API, so that connections
+# to the API are pooled and kept alive between requests.
+GRAPH_SESSION = None
+GRAPH_SESSION_LOCK = Lock()
+
+
+class GraphRetry(Retry):
+    """Retry policy for Graph API requests. Idempotent requests are retried on server errors, and
+    requests using any method are retried when throttled (429 and 503 responses are not processed
+    by the API), waiting for the interval given in the Retry-After response header if present.
+    """
+
+    THROTTLED_STATUS_CODES = frozenset([429, 503])
+
+    def is_retry(self, method: str, status_code: int, has_retry_after: bool = False) -> bool:
+        if status_code in self.THROTTLED_STATUS_CODES:
+            return True
+        return super().is_retry(method, status_code, has_retry_after)
+
+
+class GraphSession(TimeoutSession):
+    """A requests Session for Graph API requests, which applies a default timeout to each request."""
+
+
+def graph_retry() -> GraphRetry:
+    """Returns the retry policy for Graph API requests, configured from settings."""
+    return GraphRetry(
+        total=settings.MS_GRAPH_MAX_RETRIES,
+        backoff_factor=settings.MS_GRAPH_RETRY_BACKOFF,
+        backoff_max=settings.MS_GRAPH_RETRY_BACKOFF_MAX,
+        status_forcelist=[500, 502, 504],
+        allowed_methods=Retry.DEFAULT_ALLOWED_METHODS | {"PATCH"},
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+
+
+def build_graph_session(adapter_class=HTTPAdapter, **kwargs) -> GraphSession:
+    """Returns a new Graph API session, using a pooled connection adapter with the Graph retry policy.
+    Additional `kwargs` are passed to `adapter_class` (e.g. for a test adapter).
+    """
+    adapter = adapter_class(
+        max_retries=graph_retry(), pool_connections=settings.MS_GRAPH_POOL_SIZE, pool_maxsize=settings.MS_GRAPH_POOL_SIZE, **kwargs
+    )
+    session = GraphSession(timeout=settings.MS_GRAPH_TIMEOUT)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_graph_session() -> requests.Session:
+    """Returns the shared Graph API session, creating it on first use."""
+    global GRAPH_SESSION
+    with GRAPH_SESSION_LOCK:
+        if GRAPH_SESSION is None:
+            GRAPH_SESSION = build_graph_session()
+        return GRAPH_SESSION
+
+
+def set_graph_session(session: Optional[requests.Session]) -> Optional[requests.Session]:
+    """Replace the shared Graph API session (e.g. with a session using a fake Graph backend),
+    returning the previous session. Pass None to create a new session on next use.
+    """
+    global GRAPH_SESSION
+    with GRAPH_SESSION_LOCK:
+        previous, GRAPH_SESSION = GRAPH_SESSION, session
+        return previous
+
+
+def close_graph_session():
+    """Close the shared Graph API session (if open), e.g. at the end of a management command."""
+    global GRAPH_SESSION
+    with GRAPH_SESSION_LOCK:
+        if GRAPH_SESSION is not None:
+            GRAPH_SESSION.close()
+            GRAPH_SESSION = None
+
+
+def request(method: str, url: str, **kwargs) -> requests.Response:
+    """Make a request to the Graph API using the shared session. Accepts the same arguments as requests.request."""
+    return get_graph_session().request(method, url, **kwargs)
+
+
+def get(url: str, **kwargs) -> requests.Response:
+    return request("GET", url, **kwargs)
+
+
+def post(url: str, **kwargs) -> requests.Response:
+    return request("POST", url, **kwargs)
+
+
+def patch(url: str, **kwargs) -> requests.Response:
+    return request("PATCH", url, **kwargs)
+
+
+def put(url: str, **kwargs) -> requests.Response:
+    return request("PUT", url, **kwargs)
+
+
+def delete(url: str, **kwargs) -> requests.Response:
+    return request("DELETE", url, **kwargs)
+
+
+def paginate(url: str, headers: Dict, params: Optional[Dict] = None, first_page: Optional[Dict] = None) -> Iterator[Dict]:
+    """Yields each object in a (paginated) Graph API collection, following @odata.nextLink values
+    until the final page. Raises HTTPError on an unsuccessful response.
+    Optionally pass in the parsed `first_page` of the response (e.g. from a POST request) to
+    continue paging from it.
+    Reference: https://learn.microsoft.com/en-us/graph/paging
+    """
+    if first_page is None:
+        resp = get(url, headers=headers, params=params)
+        resp.raise_for_status()
+        first_page = resp.json()
+    j = first_page
+    yield from j["value"]
+
+    while "@odata.nextLink" in j:
+        # The next link already includes the original query parameters.
+        resp = get(j["@odata.nextLink"], headers=headers)
+        resp.raise_for_status()
+        j = resp.json()
+        yield from j["value"]
+
+
+class GraphBatch:
+    """Queues Graph API requests, and sends them in JSON batch envelopes of up to 20 requests.
+    Requests are added in groups (e.g. all the requests for one user), and a group is always sent
+    in a single envelope so that its requests may depend on each other (using `dependsOn`).
+    Individual requests which are throttled are retried, waiting for the Retry-After interval.
+    Reference: https://learn.microsoft.com/en-us/graph/json-batching
+    """
+
+    BATCH_URL = "https://graph.microsoft.com/v1.0/$batch"
+    MAX_REQUESTS = 20
+
+    def __init__(self, token: Dict):
+        self.headers = {
+            "Authorization": f"Bearer {token['access_token']}",
+            "Content-Type": "application/json",
+        }
+        self.pending = []  # [(request, callback, local id)]
+        self.group_count = 0
+        self.request_count = 0
+
+    def add(self, group: List[Dict], callback: Optional[Callable[[str, Optional[Dict]], None]] = None):
+        """Queue a group of batch request objects (having id, method, url, and optionally headers,
+        body and dependsOn, with URLs relative to the API version). Request IDs need only be unique
+        within the group. After the group is sent, `callback` is called for each request with the
+        request ID and its response object (status, headers, body), or None if the batch failed.
+        """
+        if len(group) > self.MAX_REQUESTS:
+            raise ValueError(f"A group may contain at most {self.MAX_REQUESTS} requests")
+        if len(self.pending) + len(group) > self.MAX_REQUESTS:
+            self.flush()
+
+        self.group_count += 1
+        prefix = f"{self.group_count}-"
+        for request in group:
+            request = dict(request, id=f"{prefix}{request['id']}")
+            if "dependsOn" in request:
+                request["dependsOn"] = [f"{prefix}{i}" for i in request["dependsOn"]]
+            self.pending.append((request, callback, request["id"][len(prefix) :]))
+
+    def flush(self):
+        """Send all queued requests, in a single batch envelope."""
+        pending = {request["id"]: (request, callback, local_id) for request, callback, local_id in self.pending}
+        self.pending = []
+        retries = settings.MS_GRAPH_MAX_RETRIES
+
+        while pending:
+            self.request_count += 1
+            try:
+                resp = post(self.BATCH_URL, headers=self.headers, json={"requests": [i[0] for i in pending.values()]})
+                resp.raise_for_status()
+                responses = resp.json()["responses"]
+            except Exception as exc:
+                LOGGER.warning(f"Call to {self.BATCH_URL} raised exception", exc_info=exc)
+                for request, callback, local_id in pending.values():
+                    if callback:
+                        callback(local_id, None)
+                return
+
+            retried = set()
+            failed_dependency = set()
+            retry_after = 0
+            for response in responses:
+                if response["status"] in GraphRetry.THROTTLED_STATUS_CODES and retries > 0:
+                    retried.add(response["id"])
+                    retry_after = max(retry_after, int(response.get("headers", {}).get("Retry-After", 1)))
+                elif response["status"] == 424:
+                    failed_dependency.add(response["id"])
+
+            # A request which depends on a throttled request fails with 424 Failed Dependency: retry
+            # it alongside the request(s) it depends on (which may themselves have failed with 424).
+            dependents = {i for i in failed_dependency if retried.intersection(pending[i][0].get("dependsOn", []))}
+            while dependents:
+                retried |= dependents
+                failed_dependency -= dependents
+                dependents = {i for i in failed_dependency if retried.intersection(pending[i][0].get("dependsOn", []))}
+
+            for response in responses:
+                if response["id"] in retried:
+                    continue
+                request, callback, local_id = pending[response["id"]]
+                if callback:
+                    callback(local_id, response)
+
+            pending = {i: value for i, value in pending.items() if i in retried}
+            for request, callback, local_id in pending.values():
+                # Requests which this request depended on have already completed, unless they are also retried.
+                depends_on = [i for i in request.pop("dependsOn", []) if i in retried]
+                if depends_on:
+                    request["dependsOn"] = depends_on
+            if pending:
+                retries -= 1
+                sleep(min(retry_after, settings.MS_GRAPH_RETRY_BACKOFF_MAX))
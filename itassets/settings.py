@@ -148,6 +148,39 @@ VERSION_NO = project["project"]["version"]
 
 # Threshold value below which to warn Service Desk about available Microsoft licenses.
 LICENCE_NOTIFY_THRESHOLD = env("LICENCE_NOTIFY_THRESHOLD", 5)
+# Cached Microsoft 365 Defender API access tokens are refreshed this many seconds before they expire.
+MS_TOKEN_REFRESH_SECONDS = env("MS_TOKEN_REFRESH_SECONDS", 300)
+# Microsoft Graph API client: request timeout (seconds), connection pool size, and the number of
+# retries (with exponential backoff, in seconds) for throttled or failed requests.
+MS_GRAPH_TIMEOUT = env("MS_GRAPH_TIMEOUT", 60)
+MS_GRAPH_POOL_SIZE = env("MS_GRAPH_POOL_SIZE", 10)
+MS_GRAPH_MAX_RETRIES = env("MS_GRAPH_MAX_RETRIES", 5)
+MS_GRAPH_RETRY_BACKOFF = env("MS_GRAPH_RETRY_BACKOFF", 1)
+MS_GRAPH_RETRY_BACKOFF_MAX = env("MS_GRAPH_RETRY_BACKOFF_MAX", 60)
+# Maximum number of concurrent Graph API requests made by bulk queries (e.g. user group membership).
+MS_GRAPH_MAX_WORKERS = env("MS_GRAPH_MAX_WORKERS", 8)
+# Default page size ($top) requested from Graph API list endpoints that support it.
+MS_GRAPH_PAGE_SIZE = env("MS_GRAPH_PAGE_SIZE", 999)
+# check_azure_accounts queries only changed Entra ID accounts between full checks, carried out this many hours apart.
+ENTRA_ID_FULL_SYNC_HOURS = env("ENTRA_ID_FULL_SYNC_HOURS", 24)
+# check_azure_accounts skips linked users whose Entra ID data is unchanged, unless their cached data is older than this.
+ENTRA_ID_DATA_MAX_AGE_HOURS = env("ENTRA_ID_DATA_MAX_AGE_HOURS", 168)
+# department_users_signins overlaps its query with the previous run by this many minutes, as sign-in
+# events may be recorded after a delay.
+SIGNIN_LOOKBACK_MINUTES = env("SIGNIN_LOOKBACK_MINUTES", 5)
+# Number of changed users to write per query during the on-prem AD account check.
+ONPREM_AD_WRITE_BATCH_SIZE = env("ONPREM_AD_WRITE_BATCH_SIZE", 1000)
+# Number of onprem AD changes from sync_ad_data to upload per change manifest blob.
+ONPREM_CHANGE_MANIFEST_SIZE = env("ONPREM_CHANGE_MANIFEST_SIZE", 5000)
+# Upload each onprem AD change as its own blob (onprem_changes/{ad_guid}_{property}.json), as read by the
+# onprem sync process. Set False to upload per-run change manifests instead, once that process reads them.
+ONPREM_CHANGES_PER_PROPERTY = env("ONPREM_CHANGES_PER_PROPERTY", True)
+# Maximum number of concurrent block transfers for a single Azure blob upload or download.
+AZURE_BLOB_MAX_CONCURRENCY = env("AZURE_BLOB_MAX_CONCURRENCY", 4)
+# Maximum number of concurrent blob uploads made by batch uploads.
+AZURE_BLOB_MAX_WORKERS = env("AZURE_BLOB_MAX_WORKERS", 8)
+# Number of seconds for which the list of subscribed Microsoft licence SKUs is cached.
+M365_SKU_CACHE_SECONDS = env("M365_SKU_CACHE_SECONDS", 300)
 
 # Flag to control whether Entra ID accounts should be deactivated during sync
 # processes if their associated job in Ascender has a termination date in the past.
@@ -157,6 +190,15 @@ ASCENDER_CREATE_AZURE_AD = env("ASCENDER_CREATE_AZURE_AD", False)
 # Flag to set how many days ahead of their start date a new AD account should be created.
 # False == no limit. Value should be a positive integer value.
 ASCENDER_CREATE_AZURE_AD_LIMIT_DAYS = env("ASCENDER_CREATE_AZURE_AD_LIMIT_DAYS", -1)
+# Number of hours after which cached Ascender data is refreshed for a user, even if unchanged.
+ASCENDER_DATA_MAX_AGE_HOURS = env("ASCENDER_DATA_MAX_AGE_HOURS", 24)
+# Number of changed users to write per transaction during the Ascender sync.
+ASCENDER_SYNC_WRITE_BATCH_SIZE = env("ASCENDER_SYNC_WRITE_BATCH_SIZE", 500)
+# Seconds to wait between the steps of provisioning a new Entra ID account, to allow for propagation.
+ENTRA_ID_PROVISIONING_STEP_DELAY = env("ENTRA_ID_PROVISIONING_STEP_DELAY", 3)
+# Maximum attempts at a retryable provisioning step, and the maximum delay (seconds) between attempts.
+ENTRA_ID_PROVISIONING_MAX_ATTEMPTS = env("ENTRA_ID_PROVISIONING_MAX_ATTEMPTS", 9)
+ENTRA_ID_PROVISIONING_MAX_RETRY_DELAY = env("ENTRA_ID_PROVISIONING_MAX_RETRY_DELAY", 300)
 # Number of days after which an Entra ID account may be considered "dormant":
 DORMANT_ACCOUNT_DAYS = env("DORMANT_ACCOUNT_DAYS", 90)
 # Flag to control whether dormant accounts are deactivated.
@@ -174,10 +216,16 @@ FOREIGN_DB_PORT = env("FOREIGN_DB_PORT", default=5432)
 FOREIGN_DB_NAME = env("FOREIGN_DB_NAME", None)
 FOREIGN_DB_USERNAME = env("FOREIGN_DB_USERNAME", None)
 FOREIGN_DB_PASSWORD = env("FOREIGN_DB_PASSWORD", None)
+# Connection pool settings for the Ascender database (max_idle is in seconds).
+FOREIGN_DB_POOL_MIN_SIZE = env("FOREIGN_DB_POOL_MIN_SIZE", 1)
+FOREIGN_DB_POOL_MAX_SIZE = env("FOREIGN_DB_POOL_MAX_SIZE", 4)
+FOREIGN_DB_POOL_MAX_IDLE = env("FOREIGN_DB_POOL_MAX_IDLE", 600)
 FOREIGN_SERVER = env("FOREIGN_SERVER", None)
 FOREIGN_SCHEMA = env("FOREIGN_SCHEMA", default="public")
 FOREIGN_TABLE = env("FOREIGN_TABLE", None)
 FOREIGN_TABLE_CC_MANAGER = env("FOREIGN_TABLE_CC_MANAGER", None)
+# Number of rows to fetch from the Ascender database per round trip, when querying the full table.
+ASCENDER_DB_FETCH_BATCH_SIZE = env("ASCENDER_DB_FETCH_BATCH_SIZE", 2000)
 
 # Database configuration
 DATABASES = {
@@ -329,8 +377,19 @@ if SENTRY_DSN and SENTRY_ENVIRONMENT:
 SENTRY_CRON_CHECK_ASCENDER = env("SENTRY_CRON_CHECK_ASCENDER", None)
 SENTRY_CRON_CHECK_AZURE = env("SENTRY_CRON_CHECK_AZURE", None)
 SENTRY_CRON_CHECK_ONPREM = env("SENTRY_CRON_CHECK_ONPREM", None)
+SENTRY_CRON_PROVISION_ENTRA_ID = env("SENTRY_CRON_PROVISION_ENTRA_ID", None)
 
 
 # FreshService settings
 FRESHSERVICE_ENDPOINT = env("FRESHSERVICE_ENDPOINT", None)
 FRESHSERVICE_API_KEY = env("FRESHSERVICE_API_KEY", None)
+# Freshservice API client: request timeout (seconds), and the number of retries (with exponential
+# backoff, in seconds) for rate-limited or failed requests.
+FRESHSERVICE_TIMEOUT = env("FRESHSERVICE_TIMEOUT", 60)
+FRESHSERVICE_MAX_RETRIES = env("FRESHSERVICE_MAX_RETRIES", 5)
+FRESHSERVICE_RETRY_BACKOFF = env("FRESHSERVICE_RETRY_BACKOFF", 1)
+FRESHSERVICE_RETRY_BACKOFF_MAX = env("FRESHSERVICE_RETRY_BACKOFF_MAX", 60)
+# Number of concurrent page requests when listing Freshservice objects.
+FRESHSERVICE_MAX_WORKERS = env("FRESHSERVICE_MAX_WORKERS", 4)
+# Number of seconds before the local mirror of Freshservice objects is refreshed on lookup.
+FRESHSERVICE_MIRROR_SECONDS = env("FRESHSERVICE_MIRROR_SECONDS", 300)
@@ -0,0 +1,75 @@
+from django.test import TestCase, override_settings
+
+from itassets import graph
+from itassets.fake_graph import FakeGraphTenant, fake_graph
+from itassets.utils import ms_graph_client_token
+from organisation.utils import DeltaLinkExpired, ms_graph_iter_users, ms_graph_list_member_groups, ms_graph_users_delta
+
+
+class FakeGraphTestCase(TestCase):
+    def setUp(self):
+        self.tenant = FakeGraphTenant(users=25, groups=10, signins=50, seed=1)
+
+    def test_fake_token(self):
+        with fake_graph(self.tenant):
+            self.assertEqual(ms_graph_client_token()["access_token"], "fake-graph-access-token")
+
+    def test_list_users_paged(self):
+        with fake_graph(self.tenant) as server:
+            users = list(ms_graph_iter_users(top=10))
+
+        self.assertEqual(len(users), 25)
+        self.assertEqual(server.requests["list_users"], 3)
+        # Every user except the first has a manager.
+        self.assertEqual(len([i for i in users if i["manager"]]), 24)
+
+    def test_member_groups(self):
+        user_id = next(iter(self.tenant.users))
+        with fake_graph(self.tenant):
+            groups = ms_graph_list_member_groups(user_id)
+
+        self.assertEqual(groups, self.tenant.member_groups[user_id])
+
+    @override_settings(MS_GRAPH_MAX_RETRIES=10)
+    def test_throttled_requests_retried(self):
+        with fake_graph(self.tenant, throttle_rate=0.3, retry_after=0) as server:
+            users = list(ms_graph_iter_users(top=5))
+
+        self.assertEqual(len(users), 25)
+        self.assertGreater(server.throttled, 0)
+
+    def test_users_delta(self):
+        with fake_graph(self.tenant):
+            users, delta_link = ms_graph_users_delta(latest=True)
+            self.assertEqual(users, [])
+
+            changed = self.tenant.modify_users(3)
+            users, delta_link = ms_graph_users_delta(delta_link)
+            self.assertEqual(sorted(i["objectId"] for i in users), sorted(changed))
+
+            self.tenant.expire_delta_tokens()
+            with self.assertRaises(DeltaLinkExpired):
+                ms_graph_users_delta(delta_link)
+
+    def test_batch(self):
+        user_id = next(iter(self.tenant.users))
+        results = {}
+        with fake_graph(self.tenant):
+            batch = graph.GraphBatch(ms_graph_client_token())
+            batch.add(
+                [
+                    {"id": "patch", "method": "PATCH", "url": f"/users/{user_id}", "body": {"jobTitle": "Ranger"}},
+                    {"id": "revoke", "method": "POST", "url": f"/users/{user_id}/revokeSignInSessions", "dependsOn": ["patch"]},
+                ],
+                callback=lambda request_id, response: results.update({request_id: response["status"]}),
+            )
+            batch.flush()
+
+        self.assertEqual(results, {"patch": 204, "revoke": 200})
+        self.assertEqual(self.tenant.users[user_id]["jobTitle"], "Ranger")
+
+    def test_session_restored(self):
+        session = graph.get_graph_session()
+        with fake_graph(self.tenant):
+            self.assertIsNot(graph.get_graph_session(), session)
+        self.assertIs(graph.get_graph_session(), session)
@@ -0,0 +1,175 @@
+from unittest.mock import MagicMock, patch
+
+from django.test import TestCase, override_settings
+
+from itassets import graph
+
+
+def mock_response(data):
+    """Return a mock requests.Response-like object."""
+    resp = MagicMock()
+    resp.status_code = 200
+    resp.json.return_value = data
+    resp.raise_for_status.return_value = None
+    return resp
+
+
+class GraphRetryTestCase(TestCase):
+    def setUp(self):
+        self.retry = graph.GraphRetry(
+            total=3,
+            status_forcelist=[500, 502, 504],
+            allowed_methods=graph.Retry.DEFAULT_ALLOWED_METHODS | {"PATCH"},
+        )
+
+    def test_throttled_requests_retried_for_any_method(self):
+        self.assertTrue(self.retry.is_retry("GET", 429))
+        self.assertTrue(self.retry.is_retry("POST", 429, has_retry_after=True))
+        self.assertTrue(self.retry.is_retry("POST", 503))
+
+    def test_server_errors_retried_for_idempotent_methods_only(self):
+        self.assertTrue(self.retry.is_retry("GET", 500))
+        self.assertTrue(self.retry.is_retry("PATCH", 502))
+        self.assertFalse(self.retry.is_retry("POST", 500))
+
+    def test_client_errors_not_retried(self):
+        self.assertFalse(self.retry.is_retry("GET", 404))
+
+
+class GraphSessionTestCase(TestCase):
+    def tearDown(self):
+        graph.close_graph_session()
+
+    @override_settings(MS_GRAPH_TIMEOUT=15)
+    def test_shared_session(self):
+        graph.close_graph_session()
+        session = graph.get_graph_session()
+        self.assertIs(graph.get_graph_session(), session)
+        self.assertEqual(session.timeout, 15)
+        self.assertIsInstance(session.get_adapter("https://graph.microsoft.com").max_retries, graph.GraphRetry)
+
+    @patch("requests.Session.request")
+    def test_default_timeout(self, mock_request):
+        session = graph.GraphSession(timeout=15)
+        session.get("https://graph.microsoft.com/v1.0/users")
+        self.assertEqual(mock_request.call_args[1]["timeout"], 15)
+        session.get("https://graph.microsoft.com/v1.0/users", timeout=5)
+        self.assertEqual(mock_request.call_args[1]["timeout"], 5)
+
+
+class GraphPaginateTestCase(TestCase):
+    @patch("itassets.graph.get")
+    def test_paginate(self, mock_get):
+        page1 = {"value": [{"id": 1}, {"id": 2}], "@odata.nextLink": "https://graph.microsoft.com/next"}
+        page2 = {"value": [{"id": 3}]}
+        mock_get.side_effect = [mock_response(page1), mock_response(page2)]
+
+        result = list(graph.paginate("https://graph.microsoft.com/v1.0/users", headers={}, params={"$top": 2}))
+
+        self.assertEqual([i["id"] for i in result], [1, 2, 3])
+        self.assertEqual(mock_get.call_args_list[1][0][0], "https://graph.microsoft.com/next")
+
+    @patch("itassets.graph.get")
+    def test_paginate_first_page(self, mock_get):
+        first_page = {"value": [{"id": 1}], "@odata.nextLink": "https://graph.microsoft.com/next"}
+        mock_get.return_value = mock_response({"value": [{"id": 2}]})
+
+        result = list(graph.paginate("https://graph.microsoft.com/v1.0/users", headers={}, first_page=first_page))
+
+        self.assertEqual([i["id"] for i in result], [1, 2])
+        mock_get.assert_called_once()
+
+
+class GraphBatchTestCase(TestCase):
+    def setUp(self):
+        self.batch = graph.GraphBatch({"access_token": "dummy"})
+        self.results = {}
+
+    def callback(self, request_id, response):
+        self.results[request_id] = response["status"] if response else None
+
+    def group(self, n):
+        return [{"id": str(i), "method": "PATCH", "url": f"/users/{i}", "body": {}} for i in range(n)]
+
+    @patch("itassets.graph.post")
+    def test_groups_packed_into_envelopes(self, mock_post):
+        mock_post.return_value = mock_response({"responses": []})
+        for _ in range(7):
+            self.batch.add(self.group(3))
+        # Six groups of three requests fit in the first envelope.
+        mock_post.assert_called_once()
+        self.assertEqual(len(mock_post.call_args[1]["json"]["requests"]), 18)
+        self.batch.flush()
+        self.assertEqual(mock_post.call_count, 2)
+        self.assertEqual(len(mock_post.call_args[1]["json"]["requests"]), 3)
+
+    @patch("itassets.graph.post")
+    def test_request_ids_and_dependencies(self, mock_post):
+        mock_post.return_value = mock_response({"responses": [{"id": "1-a", "status": 204}, {"id": "1-b", "status": 400}]})
+        self.batch.add(
+            [{"id": "a", "method": "PATCH", "url": "/users/1"}, {"id": "b", "method": "POST", "url": "/users/1/x", "dependsOn": ["a"]}],
+            callback=self.callback,
+        )
+        self.batch.flush()
+        requests = mock_post.call_args[1]["json"]["requests"]
+        self.assertEqual([r["id"] for r in requests], ["1-a", "1-b"])
+        self.assertEqual(requests[1]["dependsOn"], ["1-a"])
+        self.assertEqual(self.results, {"a": 204, "b": 400})
+
+    @patch("itassets.graph.sleep")
+    @patch("itassets.graph.post")
+    def test_throttled_requests_retried(self, mock_post, mock_sleep):
+        mock_post.side_effect = [
+            mock_response({"responses": [{"id": "1-0", "status": 204}, {"id": "1-1", "status": 429, "headers": {"Retry-After": "7"}}]}),
+            mock_response({"responses": [{"id": "1-1", "status": 204}]}),
+        ]
+        self.batch.add(self.group(2), callback=self.callback)
+        self.batch.flush()
+        self.assertEqual(mock_post.call_count, 2)
+        mock_sleep.assert_called_once_with(7)
+        self.assertEqual(self.results, {"0": 204, "1": 204})
+
+    @patch("itassets.graph.sleep")
+    @patch("itassets.graph.post")
+    def test_failed_dependencies_retried(self, mock_post, mock_sleep):
+        envelopes = []
+        responses = [
+            {
+                "responses": [
+                    {"id": "1-a", "status": 429, "headers": {"Retry-After": "1"}},
+                    {"id": "1-b", "status": 424},
+                    {"id": "1-c", "status": 424},
+                    {"id": "1-d", "status": 400},
+                    {"id": "1-e", "status": 424},
+                ]
+            },
+            {"responses": [{"id": "1-a", "status": 204}, {"id": "1-b", "status": 204}, {"id": "1-c", "status": 204}]},
+        ]
+
+        def post(url, headers, json):
+            envelopes.append([{k: v for k, v in r.items() if k in ("id", "dependsOn")} for r in json["requests"]])
+            return mock_response(responses[len(envelopes) - 1])
+
+        mock_post.side_effect = post
+        self.batch.add(
+            [
+                {"id": "a", "method": "PATCH", "url": "/users/1"},
+                {"id": "b", "method": "PUT", "url": "/users/1/manager/$ref", "dependsOn": ["a"]},
+                {"id": "c", "method": "POST", "url": "/users/1/assignLicense", "dependsOn": ["b"]},
+                {"id": "d", "method": "PATCH", "url": "/users/2"},
+                {"id": "e", "method": "PUT", "url": "/users/2/manager/$ref", "dependsOn": ["d"]},
+            ],
+            callback=self.callback,
+        )
+        self.batch.flush()
+        # Requests which failed because a throttled request (or another failed dependency) failed are
+        # retried with it; a request which depends on a failed (not throttled) request is not.
+        self.assertEqual(envelopes[1], [{"id": "1-a"}, {"id": "1-b", "dependsOn": ["1-a"]}, {"id": "1-c", "dependsOn": ["1-b"]}])
+        self.assertEqual(self.results, {"a": 204, "b": 204, "c": 204, "d": 400, "e": 424})
+
+    @patch("itassets.graph.post")
+    def test_failed_envelope(self, mock_post):
+        mock_post.side_effect = graph.requests.exceptions.ConnectionError()
+        self.batch.add(self.group(2), callback=self.callback)
+        self.batch.flush()
+        self.assertEqual(self.results, {"0": None, "1": None})
@@ -7,18 +7,24 @@ from django.test import TestCase
 
 from itassets.utils import (
     ModelDescMixin,
+    blob_client_cache_clear,
     breadcrumbs_list,
     download_blob,
+    download_blob_chunks,
     get_blob_json,
     get_next_pages,
     get_previous_pages,
     get_query,
     human_time_duration,
     humanise_bytes,
+    iter_blob_json,
+    iter_json_objects,
+    ms_client_token_cache_clear,
     ms_graph_client_token,
     ms_security_api_client_token,
     smart_truncate,
     upload_blob,
+    upload_blobs,
 )
 
 
@@ -45,6 +51,9 @@ def make_page(page_number, num_pages):
 
 
 class MsGraphClientTokenTestCase(TestCase):
+    def setUp(self):
+        ms_client_token_cache_clear()
+
     @patch.dict(os.environ, ENV_VARS)
     @patch("itassets.utils.ConfidentialClientApplication")
     def test_returns_token(self, mock_msal_cls):
@@ -73,8 +82,28 @@ class MsGraphClientTokenTestCase(TestCase):
 
         self.assertIn("error", token)
 
+    @patch.dict(os.environ, ENV_VARS)
+    @patch("itassets.utils.ConfidentialClientApplication")
+    def test_client_app_cached(self, mock_msal_cls):
+        mock_app = MagicMock()
+        mock_app.acquire_token_for_client.return_value = FAKE_TOKEN
+        mock_msal_cls.return_value = mock_app
+
+        ms_graph_client_token()
+        ms_graph_client_token()
+        # The client application is reused, and caches its own tokens.
+        mock_msal_cls.assert_called_once()
+        self.assertEqual(mock_app.acquire_token_for_client.call_count, 2)
+
+        ms_client_token_cache_clear()
+        ms_graph_client_token()
+        self.assertEqual(mock_msal_cls.call_count, 2)
+
 
 class MsSecurityApiClientTokenTestCase(TestCase):
+    def setUp(self):
+        ms_client_token_cache_clear()
+
     @patch.dict(os.environ, ENV_VARS)
     @patch("itassets.utils.requests.post")
     def test_returns_access_token(self, mock_post):
@@ -90,38 +119,82 @@ class MsSecurityApiClientTokenTestCase(TestCase):
         self.assertEqual(kwargs["data"]["client_id"], "test-client-id")
         self.assertEqual(kwargs["data"]["grant_type"], "client_credentials")
 
+    @patch.dict(os.environ, ENV_VARS)
+    @patch("itassets.utils.requests.post")
+    def test_token_cached(self, mock_post):
+        mock_post.return_value.json.return_value = {"access_token": "security-token", "expires_in": "3599"}
+
+        self.assertEqual(ms_security_api_client_token(), "security-token")
+        self.assertEqual(ms_security_api_client_token(), "security-token")
+        mock_post.assert_called_once()
+
+    @patch.dict(os.environ, ENV_VARS)
+    @patch("itassets.utils.requests.post")
+    def test_token_refreshed_near_expiry(self, mock_post):
+        # A token expiring within MS_TOKEN_REFRESH_SECONDS is requested again.
+        mock_post.return_value.json.return_value = {"access_token": "security-token", "expires_in": "60"}
+
+        ms_security_api_client_token()
+        ms_security_api_client_token()
+        self.assertEqual(mock_post.call_count, 2)
+
 
 class UploadBlobTestCase(TestCase):
+    def setUp(self):
+        blob_client_cache_clear()
+
     @patch.dict(os.environ, ENV_VARS)
     @patch("itassets.utils.BlobServiceClient")
     def test_upload_calls_blob_client(self, mock_bsc_cls):
         mock_service = MagicMock()
-        mock_blob_client = MagicMock()
+        mock_container_client = MagicMock()
         mock_bsc_cls.from_connection_string.return_value = mock_service
-        mock_service.get_blob_client.return_value = mock_blob_client
+        mock_service.get_container_client.return_value = mock_container_client
 
         in_file = BytesIO(b"test data")
-        upload_blob(in_file, container="mycontainer", blob="myblob")
+        upload_blob(in_file, container="mycontainer", blob="myblob", max_concurrency=2)
 
         mock_bsc_cls.from_connection_string.assert_called_once_with(ENV_VARS["AZURE_CONNECTION_STRING"])
-        mock_service.get_blob_client.assert_called_once_with(container="mycontainer", blob="myblob")
-        mock_blob_client.upload_blob.assert_called_once_with(in_file, overwrite=True)
+        mock_service.get_container_client.assert_called_once_with(container="mycontainer")
+        mock_container_client.get_blob_client.assert_called_once_with("myblob")
+        mock_container_client.get_blob_client.return_value.upload_blob.assert_called_once_with(in_file, overwrite=True, max_concurrency=2)
 
     @patch.dict(os.environ, ENV_VARS)
     @patch("itassets.utils.BlobServiceClient")
     def test_upload_overwrite_false(self, mock_bsc_cls):
-        mock_service = MagicMock()
-        mock_blob_client = MagicMock()
-        mock_bsc_cls.from_connection_string.return_value = mock_service
-        mock_service.get_blob_client.return_value = mock_blob_client
+        mock_blob_client = mock_bsc_cls.from_connection_string.return_value.get_container_client.return_value.get_blob_client.return_value
 
         in_file = BytesIO(b"data")
         upload_blob(in_file, container="c", blob="b", overwrite=False)
 
-        mock_blob_client.upload_blob.assert_called_once_with(in_file, overwrite=False)
+        self.assertFalse(mock_blob_client.upload_blob.call_args[1]["overwrite"])
+
+    @patch.dict(os.environ, ENV_VARS)
+    @patch("itassets.utils.BlobServiceClient")
+    def test_client_cached(self, mock_bsc_cls):
+        upload_blob(BytesIO(b"data"), container="c", blob="a")
+        upload_blob(BytesIO(b"data"), container="c", blob="b")
+
+        mock_bsc_cls.from_connection_string.assert_called_once()
+
+    @patch.dict(os.environ, ENV_VARS)
+    @patch("itassets.utils.BlobServiceClient")
+    def test_upload_blobs(self, mock_bsc_cls):
+        mock_container_client = mock_bsc_cls.from_connection_string.return_value.get_container_client.return_value
+        blob_clients = {"a": MagicMock(), "b": MagicMock()}
+        blob_clients["b"].upload_blob.side_effect = Exception("Upload failed")
+        mock_container_client.get_blob_client.side_effect = lambda blob: blob_clients[blob]
+
+        failed = upload_blobs([("a", b"data a"), ("b", b"data b")], container="c")
+
+        blob_clients["a"].upload_blob.assert_called_once_with(b"data a", overwrite=True)
+        self.assertEqual(list(failed.keys()), ["b"])
 
 
 class DownloadBlobTestCase(TestCase):
+    def setUp(self):
+        blob_client_cache_clear()
+
     @patch.dict(os.environ, ENV_VARS)
     @patch("itassets.utils.BlobServiceClient")
     def test_download_writes_and_seeks(self, mock_bsc_cls):
@@ -129,29 +202,24 @@ class DownloadBlobTestCase(TestCase):
         mock_container_client = MagicMock()
         mock_bsc_cls.from_connection_string.return_value = mock_service
         mock_service.get_container_client.return_value = mock_container_client
-        mock_container_client.download_blob.return_value.readall.return_value = b"blob content"
+        mock_container_client.download_blob.return_value.readinto.side_effect = lambda f: f.write(b"blob content")
 
         out_file = BytesIO()
-        result = download_blob(out_file, container="mycontainer", blob="myblob")
+        result = download_blob(out_file, container="mycontainer", blob="myblob", max_concurrency=2)
 
         mock_service.get_container_client.assert_called_once_with(container="mycontainer")
-        mock_container_client.download_blob.assert_called_once_with("myblob")
+        mock_container_client.download_blob.assert_called_once_with("myblob", max_concurrency=2)
+        # Verify the file position was reset to 0 after writing.
+        self.assertEqual(result.tell(), 0)
         self.assertEqual(result.read(), b"blob content")
 
     @patch.dict(os.environ, ENV_VARS)
     @patch("itassets.utils.BlobServiceClient")
-    def test_download_returns_seeked_file(self, mock_bsc_cls):
-        mock_service = MagicMock()
-        mock_container_client = MagicMock()
-        mock_bsc_cls.from_connection_string.return_value = mock_service
-        mock_service.get_container_client.return_value = mock_container_client
-        mock_container_client.download_blob.return_value.readall.return_value = b"hello"
+    def test_download_chunks(self, mock_bsc_cls):
+        mock_container_client = mock_bsc_cls.from_connection_string.return_value.get_container_client.return_value
+        mock_container_client.download_blob.return_value.chunks.return_value = iter([b"blob ", b"content"])
 
-        out_file = BytesIO()
-        result = download_blob(out_file, container="c", blob="b")
-
-        # Verify the file position was reset to 0 after writing.
-        self.assertEqual(result.tell(), 0)
+        self.assertEqual(list(download_blob_chunks("c", "b")), [b"blob ", b"content"])
 
 
 class GetBlobJsonTestCase(TestCase):
@@ -172,6 +240,36 @@ class GetBlobJsonTestCase(TestCase):
         mock_download.assert_called_once()
 
 
+class IterJsonObjectsTestCase(TestCase):
+    def setUp(self):
+        self.objects = [{"ObjectGUID": str(i), "Name": f"User [{i}], \u00e9"} for i in range(20)]
+
+    def chunks(self, content, size):
+        return [content[i : i + size] for i in range(0, len(content), size)]
+
+    def test_json_array(self):
+        content = "\ufeff".encode("utf-8") + json.dumps(self.objects, indent=2).encode("utf-8")
+        for size in (1, 7, 4096):
+            self.assertEqual(list(iter_json_objects(self.chunks(content, size))), self.objects)
+
+    def test_ndjson(self):
+        content = "\n".join(json.dumps(i) for i in self.objects).encode("utf-8")
+        self.assertEqual(list(iter_json_objects(self.chunks(content, 5))), self.objects)
+
+    def test_empty_array(self):
+        self.assertEqual(list(iter_json_objects([b"[", b"]"])), [])
+
+    def test_truncated_content_raises(self):
+        with self.assertRaises(json.JSONDecodeError):
+            list(iter_json_objects([b'[{"a": 1}, {"b": ']))
+
+    @patch("itassets.utils.download_blob_chunks")
+    def test_iter_blob_json(self, mock_chunks):
+        mock_chunks.return_value = iter([b'[{"a": 1},', b' {"b": 2}]'])
+        self.assertEqual(list(iter_blob_json("mycontainer", "myblob")), [{"a": 1}, {"b": 2}])
+        mock_chunks.assert_called_once_with("mycontainer", "myblob")
+
+
 class BreadcrumbsListTestCase(TestCase):
     def test_single_item_renders_active(self):
         result = breadcrumbs_list([("/", "Home")])
@@ -1,40 +1,99 @@
+import codecs
 import json
 import os
 import re
-from io import BytesIO
-from typing import BinaryIO, Dict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+from tempfile import TemporaryFile
+from threading import Lock
+from time import monotonic
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, Optional
 
 import requests
-from azure.storage.blob import BlobServiceClient
+from azure.storage.blob import BlobServiceClient, ContainerClient
+from django.conf import settings
 from django.db.models import Q
 from django.utils.encoding import smart_str
 from msal import ConfidentialClientApplication
 
 
+# Process-wide cache of MSAL client applications (keyed by the client credentials used). Each
+# application keeps an in-memory cache of its access tokens, so that each API call doesn't require a
+# new authentication round trip.
+MS_CLIENT_APPS = {}
+MS_CLIENT_APP_LOCK = Lock()
+# Process-wide cache of Microsoft 365 Defender API access tokens, which aren't requested using MSAL
+# (keyed by the client credentials used): {credentials: (token, expires_at)}.
+MS_SECURITY_API_TOKENS = {}
+MS_SECURITY_API_TOKEN_LOCK = Lock()
+# Process-wide cache of Azure blob storage container clients (keyed by connection string and container
+# name), so that each blob transfer reuses the same client configuration and HTTP connection pool.
+BLOB_CONTAINER_CLIENTS = {}
+BLOB_CLIENT_LOCK = Lock()
+
+
+class TimeoutSession(requests.Session):
+    """A requests Session which applies a default timeout to each request."""
+
+    def __init__(self, timeout: Optional[float] = None):
+        super().__init__()
+        self.timeout = timeout
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return super().request(method, url, **kwargs)
+
+
+def _ms_client_credentials() -> tuple:
+    return (os.environ["AZURE_TENANT_ID"], os.environ["AZURE_CLIENT_ID"], os.environ["AZURE_CLIENT_SECRET"])
+
+
+def _ms_client_app(credentials: tuple) -> ConfidentialClientApplication:
+    """Returns the cached MSAL client application for the passed-in client credentials."""
+    with MS_CLIENT_APP_LOCK:
+        if credentials not in MS_CLIENT_APPS:
+            azure_tenant_id, client_id, client_secret = credentials
+            MS_CLIENT_APPS[credentials] = ConfidentialClientApplication(
+                client_id=client_id,
+                client_credential=client_secret,
+                authority=f"https://login.microsoftonline.com/{azure_tenant_id}",
+            )
+        return MS_CLIENT_APPS[credentials]
+
+
+def ms_client_token_cache_clear():
+    """Discard all cached MSAL client applications (and their tokens) and Defender API access tokens."""
+    with MS_CLIENT_APP_LOCK:
+        MS_CLIENT_APPS.clear()
+    with MS_SECURITY_API_TOKEN_LOCK:
+        MS_SECURITY_API_TOKENS.clear()
+
+
 def ms_graph_client_token() -> Dict:
     """Uses the Microsoft msal library to obtain an access token for the Graph API.
+    The client application is cached for the process. MSAL returns its cached token until shortly
+    before the token expires, and only then requests a new one.
     Ref: https://docs.microsoft.com/en-us/python/api/msal/msal.application.confidentialclientapplication
     """
-    azure_tenant_id = os.environ["AZURE_TENANT_ID"]
-    client_id = os.environ["AZURE_CLIENT_ID"]
-    client_secret = os.environ["AZURE_CLIENT_SECRET"]
-    context = ConfidentialClientApplication(
-        client_id=client_id,
-        client_credential=client_secret,
-        authority=f"https://login.microsoftonline.com/{azure_tenant_id}",
-    )
-    token = context.acquire_token_for_client(scopes=["https://graph.microsoft.com/.default"])
-
-    return token
+    app = _ms_client_app(_ms_client_credentials())
+    return app.acquire_token_for_client(scopes=["https://graph.microsoft.com/.default"])
 
 
 def ms_security_api_client_token() -> str:
     """Calls the Microsoft 365 Defender API endpoint to obtain an access token.
+    The token is cached for the process, and a new token is requested when the cached token expires
+    within MS_TOKEN_REFRESH_SECONDS.
     Ref: https://docs.microsoft.com/en-us/microsoft-365/security/defender/api-hello-world
     """
-    azure_tenant_id = os.environ["AZURE_TENANT_ID"]
-    client_id = os.environ["AZURE_CLIENT_ID"]
-    client_secret = os.environ["AZURE_CLIENT_SECRET"]
+    credentials = _ms_client_credentials()
+    azure_tenant_id, client_id, client_secret = credentials
+    with MS_SECURITY_API_TOKEN_LOCK:
+        if credentials in MS_SECURITY_API_TOKENS:
+            token, expires_at = MS_SECURITY_API_TOKENS[credentials]
+            if monotonic() < expires_at - settings.MS_TOKEN_REFRESH_SECONDS:
+                return token
+
+    # The lock isn't held while requesting a token, so concurrent callers may each request one.
     data = {
         "resource": "https://api.security.microsoft.com",
         "client_id": client_id,
@@ -43,29 +102,77 @@ def ms_security_api_client_token() -> str:
     }
     url = f"https://login.windows.net/{azure_tenant_id}/oauth2/token"
     resp = requests.post(url, data=data)
-    return resp.json()["access_token"]
+    j = resp.json()
+    token = j["access_token"]
+    # This endpoint returns expires_in as a string value.
+    expires_in = int(j.get("expires_in", 0))
+    if expires_in:
+        with MS_SECURITY_API_TOKEN_LOCK:
+            MS_SECURITY_API_TOKENS[credentials] = (token, monotonic() + expires_in)
+    return token
 
 
-def upload_blob(in_file: BinaryIO, container: str, blob: str, overwrite=True):
-    """For the passed-in file, upload to blob storage."""
+def get_blob_container_client(container: str) -> ContainerClient:
+    """Returns a client for the nominated blob storage container. Clients are cached for the process
+    (per connection string), rather than being created for every blob transfer.
+    """
     connect_string = os.environ.get("AZURE_CONNECTION_STRING")
-    service_client = BlobServiceClient.from_connection_string(connect_string)
-    blob_client = service_client.get_blob_client(container=container, blob=blob)
-    blob_client.upload_blob(in_file, overwrite=overwrite)
+    with BLOB_CLIENT_LOCK:
+        key = (connect_string, container)
+        if key not in BLOB_CONTAINER_CLIENTS:
+            service_client = BlobServiceClient.from_connection_string(connect_string)
+            BLOB_CONTAINER_CLIENTS[key] = service_client.get_container_client(container=container)
+        return BLOB_CONTAINER_CLIENTS[key]
 
 
-def download_blob(out_file: BinaryIO, container: str, blob: str) -> BinaryIO:
-    """For the passed-in file stream object, download the nominated blob into it."""
-    connect_string = os.environ.get("AZURE_CONNECTION_STRING")
-    service_client = BlobServiceClient.from_connection_string(connect_string)
-    container_client = service_client.get_container_client(container=container)
-    out_file.write(container_client.download_blob(blob).readall())
+def blob_client_cache_clear():
+    """Discard all cached blob storage container clients."""
+    with BLOB_CLIENT_LOCK:
+        BLOB_CONTAINER_CLIENTS.clear()
+
+
+def upload_blob(in_file: BinaryIO, container: str, blob: str, overwrite=True, max_concurrency: Optional[int] = None):
+    """For the passed-in file, upload to blob storage. Large files are uploaded as blocks, up to
+    `max_concurrency` (default AZURE_BLOB_MAX_CONCURRENCY) at a time.
+    """
+    blob_client = get_blob_container_client(container).get_blob_client(blob)
+    blob_client.upload_blob(in_file, overwrite=overwrite, max_concurrency=max_concurrency or settings.AZURE_BLOB_MAX_CONCURRENCY)
+
+
+def upload_blobs(files: Iterable[tuple], container: str, overwrite=True, max_workers: Optional[int] = None) -> Dict:
+    """Upload the passed-in iterable of (blob name, file or bytes) tuples to blob storage, up to
+    `max_workers` (default AZURE_BLOB_MAX_WORKERS) concurrently.
+    Returns a dict of {blob name: exception} for any uploads which failed.
+    """
+    container_client = get_blob_container_client(container)
+
+    def upload(blob, data):
+        container_client.get_blob_client(blob).upload_blob(data, overwrite=overwrite)
+
+    with ThreadPoolExecutor(max_workers=max_workers or settings.AZURE_BLOB_MAX_WORKERS) as executor:
+        futures = {blob: executor.submit(upload, blob, data) for blob, data in files}
+
+    return {blob: future.exception() for blob, future in futures.items() if future.exception()}
+
+
+def download_blob(out_file: BinaryIO, container: str, blob: str, max_concurrency: Optional[int] = None) -> BinaryIO:
+    """For the passed-in file stream object, download the nominated blob into it. The blob is written
+    to the file in chunks, up to `max_concurrency` (default AZURE_BLOB_MAX_CONCURRENCY) downloaded at
+    a time, rather than being read into memory.
+    """
+    container_client = get_blob_container_client(container)
+    container_client.download_blob(blob, max_concurrency=max_concurrency or settings.AZURE_BLOB_MAX_CONCURRENCY).readinto(out_file)
     out_file.flush()  # Required for file stream objects.
     out_file.seek(0)
 
     return out_file
 
 
+def download_blob_chunks(container: str, blob: str) -> Iterator[bytes]:
+    """Download the nominated blob, yielding its content in chunks (rather than reading the whole blob into memory)."""
+    yield from get_blob_container_client(container).download_blob(blob).chunks()
+
+
 class ModelDescMixin(object):
     """A small mixin for the ModelAdmin class to add a description of the model to the
     admin changelist view context.
@@ -167,9 +274,46 @@ def get_blob_json(container: str, blob: str) -> Dict:
     """Convenience function to download an Azure blob which contains JSON data,
     parse it, and return the data. Pass in the container and blob names.
     """
-    tf = BytesIO()
-    download_blob(tf, container, blob)
-    return json.loads(tf.read())
+    with TemporaryFile() as tf:
+        download_blob(tf, container, blob)
+        return json.load(tf)
+
+
+def iter_json_objects(chunks: Iterable[bytes]) -> Iterator[Any]:
+    """Incrementally parse a stream of UTF-8 encoded JSON content, which may be either a single JSON
+    array of objects or newline-delimited JSON objects, yielding each object as soon as it is complete.
+    Only the current (incomplete) object is held in memory.
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    buf = ""
+    pos = 0
+
+    for chunk in chain(chunks, [None]):
+        final = chunk is None
+        buf = buf[pos:] + text_decoder.decode(chunk or b"", final=final)
+        pos = 0
+        while True:
+            # Skip whitespace, and the array brackets and commas between objects.
+            while pos < len(buf) and (buf[pos].isspace() or buf[pos] in "[,]"):
+                pos += 1
+            if pos == len(buf):
+                break
+            try:
+                obj, pos = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                # The object is incomplete: wait for the next chunk (unless there are no more).
+                if final:
+                    raise
+                break
+            yield obj
+
+
+def iter_blob_json(container: str, blob: str) -> Iterator[Any]:
+    """Convenience function to download an Azure blob which contains a JSON array of objects
+    (or newline-delimited JSON objects) as a stream, yielding each object as it is parsed.
+    """
+    return iter_json_objects(download_blob_chunks(container, blob))
 
 
 def get_previous_pages(page_num, count=3):
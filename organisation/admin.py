@@ -11,7 +11,7 @@ from itassets.utils import ModelDescMixin
 from itsystems.admin import ITSystemRecordAdmin
 from itsystems.models import ITSystemRecord
 
-from .models import AscenderActionLog, CostCentre, DepartmentUser, Location
+from .models import AscenderActionLog, CostCentre, DepartmentUser, EntraIdProvisioningTask, Location, SyncCheckpoint
 from .views import DepartmentUserExport
 
 
@@ -414,6 +414,57 @@ class AscenderActionLogAdmin(ModelAdmin):
         return False
 
 
+@register(EntraIdProvisioningTask)
+class EntraIdProvisioningTaskAdmin(ModelAdmin):
+    date_hierarchy = "created"
+    fields = (
+        "created",
+        "updated",
+        "state",
+        "employee_id",
+        "email",
+        "display_name",
+        "azure_guid",
+        "department_user",
+        "attempts",
+        "next_attempt_at",
+        "last_error",
+    )
+    list_display = ("created", "employee_id", "email", "state", "attempts", "next_attempt_at")
+    list_filter = ("state",)
+    search_fields = ("employee_id", "email", "display_name")
+    readonly_fields = fields
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@register(SyncCheckpoint)
+class SyncCheckpointAdmin(ModelAdmin):
+    fields = ("name", "updated", "state_pprint")
+    list_display = ("name", "updated")
+    readonly_fields = fields
+
+    def state_pprint(self, obj=None):
+        result = ""
+        if obj and obj.state:
+            result = json.dumps(obj.state, indent=4, sort_keys=True)
+            result_str = f"<pre>{result}</pre>"
+            result = mark_safe(result_str)
+        return result
+
+    state_pprint.short_description = "state"
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
 class ServiceDeskAdminSite(AdminSite):
     """Define a customised admin site for Service Desk staff."""
 
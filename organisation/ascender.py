@@ -1,26 +1,38 @@
+import hashlib
+import json
 import logging
 import re
+from collections import Counter
 from collections.abc import Iterator
-from datetime import date, datetime
-from time import sleep
-from typing import List, Literal, Optional
+from contextlib import AbstractContextManager
+from datetime import date, datetime, timedelta
+from itertools import groupby
+from operator import itemgetter
+from threading import Lock
+from time import monotonic, sleep
+from typing import Iterable, List, Literal, Optional
 
 import requests
 from django.conf import settings
 from django.contrib.admin.models import ADDITION, LogEntry
 from django.contrib.auth import get_user_model
 from django.core.mail import EmailMultiAlternatives
+from django.db import transaction
+from django.db.models import Min
 from django.utils import timezone
-from psycopg import Connection, connect, sql
+from psycopg import Connection, sql
+from psycopg_pool import ConnectionPool
 
+from itassets import graph
 from itassets.utils import ms_graph_client_token
 from organisation.microsoft_products import MS_PRODUCTS
-from organisation.models import AscenderActionLog, CostCentre, DepartmentUser, DepartmentUserLog, Location
-from organisation.utils import generate_password, ms_graph_get_subscribed_sku, ms_graph_validate_password, title_except
+from organisation.models import AscenderActionLog, CostCentre, DepartmentUser, DepartmentUserLog, EntraIdProvisioningTask, Location
+from organisation.utils import SUBSCRIBED_SKU_CACHE, generate_password, ms_graph_validate_password, title_except
 
 User = get_user_model()
 LOGGER = logging.getLogger("organisation")
 DATE_MAX = date(2049, 12, 31)
+DATE_MAX_SCORE = int(DATE_MAX.strftime("%Y%m%d")) * 10
 # The list below defines which columns to SELECT from the Ascender view, what to name the object
 # dict key after querying, plus how to parse the returned value of each column (if required).
 FOREIGN_TABLE_FIELDS = (
@@ -173,42 +185,109 @@ TERM_REASON_MAP = {
 }
 
 
-def get_ascender_db_connection() -> Connection:
-    """Returns a database connection to the Ascender database."""
-    return connect(
-        host=settings.FOREIGN_DB_HOST,
-        port=settings.FOREIGN_DB_PORT,
-        dbname=settings.FOREIGN_DB_NAME,
-        user=settings.FOREIGN_DB_USERNAME,
-        password=settings.FOREIGN_DB_PASSWORD,
-    )
+# Process-wide connection pool for the Ascender database, created on first use.
+ASCENDER_DB_POOL = None
+ASCENDER_DB_POOL_LOCK = Lock()
 
 
-def row_to_python(row):
-    """A convenience function to convert a row from the Ascender database to a
-    Python dict, applying optional transforms to each column.
-    Transforms can be to convert strings to datetime, or to rename column in
-    the returned dict.
+def get_ascender_db_pool() -> ConnectionPool:
+    """Returns the process-wide connection pool for the Ascender database, creating it on first use."""
+    global ASCENDER_DB_POOL
+
+    with ASCENDER_DB_POOL_LOCK:
+        if ASCENDER_DB_POOL is None:
+            ASCENDER_DB_POOL = ConnectionPool(
+                kwargs={
+                    "host": settings.FOREIGN_DB_HOST,
+                    "port": settings.FOREIGN_DB_PORT,
+                    "dbname": settings.FOREIGN_DB_NAME,
+                    "user": settings.FOREIGN_DB_USERNAME,
+                    "password": settings.FOREIGN_DB_PASSWORD,
+                },
+                min_size=settings.FOREIGN_DB_POOL_MIN_SIZE,
+                max_size=settings.FOREIGN_DB_POOL_MAX_SIZE,
+                max_idle=settings.FOREIGN_DB_POOL_MAX_IDLE,
+                # Check that connections are still usable before handing them out.
+                check=ConnectionPool.check_connection,
+                name="ascender",
+                open=True,
+            )
+
+    return ASCENDER_DB_POOL
+
+
+def close_ascender_db_pool():
+    """Close the Ascender database connection pool (if open), and all of its connections."""
+    global ASCENDER_DB_POOL
+
+    with ASCENDER_DB_POOL_LOCK:
+        if ASCENDER_DB_POOL is not None:
+            ASCENDER_DB_POOL.close()
+            ASCENDER_DB_POOL = None
+
+
+def get_ascender_db_connection() -> AbstractContextManager[Connection]:
+    """Returns a context manager which checks out a connection to the Ascender database from
+    the connection pool, and returns it to the pool on exit. Usage:
+
+        with get_ascender_db_connection() as conn:
+            ...
+    """
+    return get_ascender_db_pool().connection()
+
+
+def ascender_db_health_check() -> bool:
+    """Run a trivial query against the Ascender database, returning True if it succeeds."""
+    try:
+        with get_ascender_db_connection() as conn:
+            row = conn.execute("SELECT 1").fetchone()
+        return row is not None
+    except Exception:
+        LOGGER.exception("Ascender database health check failed")
+        return False
+
+
+def build_row_transform_plan(fields: tuple = FOREIGN_TABLE_FIELDS) -> tuple:
+    """Convert the field definitions from FOREIGN_TABLE_FIELDS into a tuple of (key, transform) pairs,
+    one per column, where `transform` is a callable to parse the column value (or None).
+    Building the plan once means that the field definitions don't need to be inspected again
+    for every column of every row returned from the Ascender database.
     """
-    record = {}
+    plan = []
 
-    for k, field in enumerate(FOREIGN_TABLE_FIELDS):
+    for field in fields:
         # If the field in a list or tuple, use the first element as the record key
         # and the second element (a callable function) as a transformer.
+        # If the second element is not callable, it is used to rename the column.
         if isinstance(field, (list, tuple)):
             if callable(field[1]):
-                record[field[0]] = field[1](row[k])
+                plan.append((field[0], field[1]))
             else:
-                record[field[1]] = row[k]
+                plan.append((field[1], None))
         else:
-            record[field] = row[k]
+            plan.append((field, None))
+
+    return tuple(plan)
+
 
-    return record
+FOREIGN_TABLE_TRANSFORM_PLAN = build_row_transform_plan()
 
 
-def ascender_db_fetch(employee_id: Optional[str] = None) -> Iterator:
+def row_to_python(row, plan: tuple = FOREIGN_TABLE_TRANSFORM_PLAN) -> dict:
+    """A convenience function to convert a row from the Ascender database to a
+    Python dict, applying the pre-built transform plan to each column.
+    Transforms can be to convert strings to datetime, or to rename column in
+    the returned dict.
+    """
+    return {key: transform(value) if transform else value for (key, transform), value in zip(plan, row)}
+
+
+def ascender_db_fetch(employee_id: Optional[str] = None, batch_size: Optional[int] = None) -> Iterator:
     """Returns an iterator which yields all rows from the Ascender database query.
     Optionally pass employee_id to filter on a single employee.
+    Querying the full table uses a named (server-side) cursor, so that rows are streamed from
+    the database in batches of `batch_size` (default: settings.ASCENDER_DB_FETCH_BATCH_SIZE)
+    rather than being buffered in memory all at once.
     """
     if employee_id:
         # Validate `employee_id`: this value needs be castable as an integer, even though we use it as a string.
@@ -217,54 +296,78 @@ def ascender_db_fetch(employee_id: Optional[str] = None) -> Iterator:
         except ValueError:
             raise ValueError("Invalid employee ID value")
 
-    conn = get_ascender_db_connection()
-    cur = conn.cursor()
+    if not batch_size:
+        batch_size = settings.ASCENDER_DB_FETCH_BATCH_SIZE
+
     columns = sql.SQL(",").join(sql.Identifier(f[0]) if isinstance(f, (list, tuple)) else sql.Identifier(f) for f in FOREIGN_TABLE_FIELDS)
     schema = sql.Identifier(settings.FOREIGN_SCHEMA)
     table = sql.Identifier(settings.FOREIGN_TABLE)
     employee_no = sql.Identifier("employee_no")
+    with get_ascender_db_connection() as conn:
+        if employee_id:
+            # A single employee only has a handful of rows, so a client-side cursor is fine.
+            cur = conn.cursor()
+            query = sql.SQL("SELECT {columns} FROM {schema}.{table} WHERE {employee_no} = %s").format(
+                columns=columns, schema=schema, table=table, employee_no=employee_no
+            )
+            cur.execute(query, (employee_id,))
+        else:
+            cur = conn.cursor(name="ascender_db_fetch")
+            cur.itersize = batch_size
+            # Order rows by employee number so that each employee's jobs are returned together.
+            query = sql.SQL("SELECT {columns} FROM {schema}.{table} ORDER BY {employee_no}, {job_no}").format(
+                columns=columns, schema=schema, table=table, employee_no=employee_no, job_no=sql.Identifier("job_no")
+            )
+            cur.execute(query)
 
-    if employee_id:
-        query = sql.SQL("SELECT {columns} FROM {schema}.{table} WHERE {employee_no} = %s").format(
-            columns=columns, schema=schema, table=table, employee_no=employee_no
-        )
-        cur.execute(query, (employee_id,))
-    else:
-        query = sql.SQL("SELECT {columns} FROM {schema}.{table}").format(columns=columns, schema=schema, table=table)
-        cur.execute(query)
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                yield row_to_python(row)
 
-    while True:
-        row = cur.fetchone()
-        if row is None:
-            break
-        record = row_to_python(row)
-        yield record
+        cur.close()
 
 
-def ascender_job_sort_key(record: dict) -> int:
+def ascender_job_sort_key(record: dict, today: Optional[str] = None) -> int:
     """
     Returns an integer value to "sort" a job, based on job end date.
     Jobs with an end date in the future will be preferenced over jobs with no end date, which will be
     preferenced over jobs that have already ended.
+    Optionally pass in `today` as a YYYY-MM-DD string, so that it only needs to be calculated once
+    when sorting many jobs.
 
     The score is based on the job's end date:
     - If the job has ended, the initial score is calculated using the job's end date.
     - If the job is not ended, the initial score is calculated using the end date times 100.
     - If the job has no end date recorded, the initial score is calculated using the DATE_MAX value times 10.
     """
-    today = datetime.now().date()
+    if not today:
+        today = date.today().strftime("%Y-%m-%d")
 
     # Initial score from job_end_date.
-    if record["job_end_date"] and record["job_end_date"] < today.strftime("%Y-%m-%d"):
+    if record["job_end_date"] and record["job_end_date"] < today:
         score = int(record["job_end_date"].replace("-", ""))
-    elif record["job_end_date"] and record["job_end_date"] >= today.strftime("%Y-%m-%d"):
+    elif record["job_end_date"] and record["job_end_date"] >= today:
         score = int(record["job_end_date"].replace("-", "")) * 100
     else:  # No job end date.
-        score = int(DATE_MAX.strftime("%Y%m%d")) * 10
+        score = DATE_MAX_SCORE
 
     return score
 
 
+def ascender_jobs_sort(jobs: Iterable, today: Optional[str] = None) -> List[dict]:
+    """For the passed-in iterable of jobs, return a list of the jobs sorted in descending
+    order of "score" from ascender_job_sort_key. Each job's score is only calculated once.
+    """
+    if not today:
+        today = date.today().strftime("%Y-%m-%d")
+    scored = [(ascender_job_sort_key(job, today), job) for job in jobs]
+    scored.sort(key=itemgetter(0), reverse=True)
+    return [job for score, job in scored]
+
+
 def ascender_employee_fetch(employee_id) -> tuple:
     """Returns a tuple: (employee_id, [sorted employee jobs])"""
     try:
@@ -272,43 +375,169 @@ def ascender_employee_fetch(employee_id) -> tuple:
     except ValueError:
         return (None, None)
 
-    jobs = []
+    return (employee_id, ascender_jobs_sort(ascender_records))
+
 
-    for row in ascender_records:
-        jobs.append(row)
+def ascender_employees_iter() -> Iterator:
+    """Returns an iterator which yields a tuple (employee_id, [sorted employee jobs]) for each
+    employee in the Ascender database, one employee at a time.
+    Rows are queried ordered by employee number, so each employee's jobs are contiguous.
+    """
+    # Fix the value of "today" once for the whole run.
+    today = date.today().strftime("%Y-%m-%d")
 
-    # Sort the list of jobs in descending order of "score" from ascender_job_sort_key.
-    jobs.sort(key=ascender_job_sort_key, reverse=True)
-    return (employee_id, jobs)
+    for employee_id, jobs in groupby(ascender_db_fetch(), key=itemgetter("employee_id")):
+        yield (employee_id, ascender_jobs_sort(jobs, today))
 
 
 def ascender_employees_fetch_all() -> dict:
     """Returns a dict: {'<employee_id>': [sorted employee jobs], ...}"""
-    ascender_records = ascender_db_fetch()
-    records = {}
-
-    for row in ascender_records:
-        employee_id = row["employee_id"]
-        if employee_id in records:
-            # Append the next job to the list of jobs, sort and replace the dict value.
-            jobs = records[employee_id]
-            jobs.append(row)
-            jobs.sort(key=ascender_job_sort_key, reverse=True)
-            records[employee_id] = jobs
-        else:
-            records[employee_id] = [row]
+    return dict(ascender_employees_iter())
 
-    return records
 
+class AscenderSyncIndex:
+    """A run-scoped index of the reference data used when syncing Ascender data: DepartmentUser
+    objects (by employee ID and email), CostCentre objects (by Ascender code) and Location
+    objects (by Ascender description).
+    Call load() to query each table once; lookups on an index which has not been loaded fall
+    back to querying the database. Objects created via the index are added to it.
+    """
 
-def validate_ascender_user_account_rules(
-    job: dict, ignore_job_start_date: bool = False, manager_override_email: Optional[str] = None, logging: bool = False
-) -> tuple | Literal[False]:
+    def __init__(self):
+        self.loaded = False
+        self.users = {}
+        self.users_by_email = {}
+        self.cost_centres = {}
+        self.locations = {}
+
+    def load(self):
+        """Query the reference tables and build the lookup dicts. Returns the index."""
+        self.users = {}
+        self.users_by_email = {}
+        # Defer the large cached AD data fields, which aren't used during the Ascender sync.
+        for user in DepartmentUser.objects.defer("ad_data", "azure_ad_data"):
+            self.add_user(user)
+        self.cost_centres = {cc.ascender_code: cc for cc in CostCentre.objects.filter(ascender_code__isnull=False)}
+        self.locations = {}
+        # Location ascender_desc values are not unique; keep the first object for each value.
+        for location in Location.objects.filter(ascender_desc__isnull=False).order_by("pk"):
+            self.locations.setdefault(location.ascender_desc, location)
+        self.loaded = True
+        return self
+
+    def load_for_jobs(self, jobs: Iterable[dict]):
+        """Query only the users, cost centres and locations referenced by the passed-in Ascender
+        jobs (employees and their managers), in one query per table. Returns the index.
+        Note that lookups by email will only find those users.
+        """
+        employee_ids = set()
+        paypoints = set()
+        location_descs = set()
+        for job in jobs:
+            employee_ids.update(i for i in (job["employee_id"], job["manager_emp_no"]) if i)
+            if job["paypoint"]:
+                paypoints.add(job["paypoint"])
+            if job["geo_location_desc"]:
+                location_descs.add(job["geo_location_desc"])
+
+        self.users = {}
+        self.users_by_email = {}
+        for user in DepartmentUser.objects.filter(employee_id__in=employee_ids).defer("ad_data", "azure_ad_data"):
+            self.add_user(user)
+        self.cost_centres = {cc.ascender_code: cc for cc in CostCentre.objects.filter(ascender_code__in=paypoints)}
+        self.locations = {}
+        for location in Location.objects.filter(ascender_desc__in=location_descs).order_by("pk"):
+            self.locations.setdefault(location.ascender_desc, location)
+        self.loaded = True
+        return self
+
+    def add_user(self, user: DepartmentUser):
+        if user.employee_id:
+            self.users[user.employee_id] = user
+        self.users_by_email[user.email] = user
+
+    def get_user(self, employee_id: Optional[str]) -> DepartmentUser | None:
+        if not employee_id:
+            return None
+        if self.loaded:
+            return self.users.get(employee_id)
+        return DepartmentUser.objects.filter(employee_id=employee_id).first()
+
+    def get_user_by_email(self, email: Optional[str]) -> DepartmentUser | None:
+        if not email:
+            return None
+        if self.loaded:
+            return self.users_by_email.get(email)
+        return DepartmentUser.objects.filter(email=email).first()
+
+    def get_cost_centre(self, ascender_code: Optional[str]) -> CostCentre | None:
+        if not ascender_code:
+            return None
+        if self.loaded:
+            return self.cost_centres.get(ascender_code)
+        return CostCentre.objects.filter(ascender_code=ascender_code).first()
+
+    def get_location(self, ascender_desc: Optional[str]) -> Location | None:
+        if not ascender_desc:
+            return None
+        if self.loaded:
+            return self.locations.get(ascender_desc)
+        return Location.objects.filter(ascender_desc=ascender_desc).order_by("pk").first()
+
+    def create_cost_centre(self, ascender_code: str) -> CostCentre:
+        """Create a new CostCentre from an Ascender paypoint value and add it to the index."""
+        cc = CostCentre.objects.create(code=ascender_code, ascender_code=ascender_code)
+        self.cost_centres[ascender_code] = cc
+        return cc
+
+    def create_location(self, ascender_desc: str) -> Location:
+        """Create a new Location from an Ascender location description and add it to the index."""
+        location = Location.objects.create(name=ascender_desc, ascender_desc=ascender_desc, address=ascender_desc)
+        self.locations[ascender_desc] = location
+        return location
+
+
+# Reason codes returned by check_ascender_user_account_rules when a new Entra ID account cannot be
+# provisioned for an Ascender record, mapped to a short description.
+ACCOUNT_RULE_REASONS = {
+    "fpc": "FPC employee",
+    "user_exists": "DepartmentUser already exists",
+    "job_ended": "Job end date is in the past",
+    "no_licence_type": "No M365 licence type recorded",
+    "invalid_licence_type": "Invalid M365 licence type recorded",
+    "manager_override_not_found": "Override manager not present in IT Assets",
+    "manager_missing": "No manager recorded",
+    "manager_not_found": "Manager not present in IT Assets",
+    "cost_centre_missing": "No cost centre recorded",
+    "cost_centre_error": "Exception during creation of new cost centre",
+    "start_date_missing": "No job start date recorded",
+    "start_date_past": "Job start date is in the past",
+    "start_date_limit": "Job start date exceeds the account creation limit",
+    "location_missing": "No physical location recorded",
+    "location_not_found": "Physical location not present in IT Assets",
+}
+
+
+def check_ascender_user_account_rules(
+    job: dict,
+    ignore_job_start_date: bool = False,
+    manager_override_email: Optional[str] = None,
+    logging: bool = False,
+    index: Optional[AscenderSyncIndex] = None,
+    create_cost_centre: bool = True,
+) -> tuple:
     """Given a passed-in Ascender record and any qualifiers, determine
     whether a new Entra ID account can be provisioned for that user.
     The 'job start date' rule can be optionally bypassed.
-    Returns either a tuple of values required to provision the new account, or False.
+    Optionally pass in a loaded AscenderSyncIndex to avoid querying the database for lookups.
+    If `create_cost_centre` is False, an unknown paypoint is not created (and does not fail
+    the rules), and the returned cost centre will be None.
+    Returns a tuple (reason, values): reason is None if all rules passed (otherwise a key of
+    ACCOUNT_RULE_REASONS), and values is the tuple of values required to provision the new
+    account (otherwise None).
     """
+    if index is None:
+        index = AscenderSyncIndex()
     ascender_record = f"{job['employee_id']}, {job['first_name']} {job['surname']}"
     if logging:
         LOGGER.info(f"Checking Ascender record {ascender_record}")
@@ -317,13 +546,13 @@ def validate_ascender_user_account_rules(
     if "clevel1_id" in job and job["clevel1_id"] == "FPC":
         if logging:
             LOGGER.warning("FPC Ascender record, aborting")
-        return False
+        return ("fpc", None)
 
     # If a matching DepartmentUser already exists, skip.
-    if DepartmentUser.objects.filter(employee_id=job["employee_id"]).exists():
+    if index.get_user(job["employee_id"]):
         if logging:
             LOGGER.warning("Matching DepartmentUser object already exists, aborting")
-        return False
+        return ("user_exists", None)
 
     # Parse job end date (if present). Ascender records "null" job end date using a date value
     # far into the future (DATE_MAX) rather than leaving the value empty.
@@ -334,7 +563,7 @@ def validate_ascender_user_account_rules(
         if job_end_date < date.today():
             if logging:
                 LOGGER.warning(f"Job end date {job_end_date.strftime('%d/%b/%Y')} is in the past, aborting")
-            return False
+            return ("job_ended", None)
 
     # Start parsing required information for new account creation.
     licence_type = None
@@ -349,43 +578,43 @@ def validate_ascender_user_account_rules(
     if not job["licence_type"] or job["licence_type"] == "NULL":
         if logging:
             LOGGER.warning("No M365 licence type recorded in Ascender, aborting")
-        return False
-    elif job["licence_type"] and job["licence_type"] in ["ONPUL", "CLDUL"]:
-        if job["licence_type"] == "ONPUL":
-            licence_type = "On-premise"
-        elif job["licence_type"] == "CLDUL":
-            licence_type = "Cloud"
+        return ("no_licence_type", None)
+    elif job["licence_type"] == "ONPUL":
+        licence_type = "On-premise"
+    elif job["licence_type"] == "CLDUL":
+        licence_type = "Cloud"
+    else:
+        if logging:
+            LOGGER.warning(f"Invalid M365 licence type {job['licence_type']} recorded in Ascender, aborting")
+        return ("invalid_licence_type", None)
 
     # Rule: user must have a manager recorded, and that manager must exist in our database.
     # Partial exception: if the email is specified, we can override the manager in Ascender.
     # That specifed manager must still exist in our database to proceed.
-    if manager_override_email and DepartmentUser.objects.filter(email=manager_override_email).exists():
-        manager = DepartmentUser.objects.get(email=manager_override_email)
-    elif manager_override_email and not DepartmentUser.objects.filter(email=manager_override_email).exists():
+    if manager_override_email and index.get_user_by_email(manager_override_email):
+        manager = index.get_user_by_email(manager_override_email)
+    elif manager_override_email:
         if logging:
             LOGGER.warning(f"Manager with email {manager_override_email} not present in IT Assets, aborting")
-        return False
-    elif job["manager_emp_no"] and DepartmentUser.objects.filter(employee_id=job["manager_emp_no"]).exists():
-        manager = DepartmentUser.objects.get(employee_id=job["manager_emp_no"])
-    elif job["manager_emp_no"] and not DepartmentUser.objects.filter(employee_id=job["manager_emp_no"]).exists():
+        return ("manager_override_not_found", None)
+    elif job["manager_emp_no"] and index.get_user(job["manager_emp_no"]):
+        manager = index.get_user(job["manager_emp_no"])
+    elif job["manager_emp_no"]:
         if logging:
             LOGGER.warning(f"Manager employee ID {job['manager_emp_no']} not present in IT Assets, aborting")
-        return False
-    elif not job["manager_emp_no"]:  # Short circuit: if there is no manager recorded, skip account creation.
+        return ("manager_not_found", None)
+    else:  # Short circuit: if there is no manager recorded, skip account creation.
         if logging:
             LOGGER.warning("No manager employee ID recorded in Ascender, aborting")
-        return False
+        return ("manager_missing", None)
 
     # Rule: user must have a Cost Centre recorded (paypoint in Ascender).
-    if job["paypoint"] and CostCentre.objects.filter(ascender_code=job["paypoint"]).exists():
-        cc = CostCentre.objects.get(ascender_code=job["paypoint"])
-    elif job["paypoint"] and not CostCentre.objects.filter(ascender_code=job["paypoint"]).exists():
+    if job["paypoint"] and index.get_cost_centre(job["paypoint"]):
+        cc = index.get_cost_centre(job["paypoint"])
+    elif job["paypoint"] and create_cost_centre:
         # Attempt to automatically create a new CC from Ascender data.
         try:
-            cc = CostCentre.objects.create(
-                code=job["paypoint"],
-                ascender_code=job["paypoint"],
-            )
+            cc = index.create_cost_centre(job["paypoint"])
             log = f"New Entra ID account process generated new cost centre, code {job['paypoint']}"
             AscenderActionLog.objects.create(level="INFO", log=log, ascender_data=job)
             LOGGER.info(log)
@@ -393,7 +622,11 @@ def validate_ascender_user_account_rules(
             # In the event of an error (probably due to a duplicate code), fail gracefully and log the error.
             log = f"Exception during creation of new cost centre in new Entra ID account process, code {job['paypoint']}"
             LOGGER.exception(log)
-            return False
+            return ("cost_centre_error", None)
+    elif not job["paypoint"]:
+        if logging:
+            LOGGER.warning("No cost centre recorded in Ascender, aborting")
+        return ("cost_centre_missing", None)
 
     # Rule: user must have a job start date recorded.
     if job["job_start_date"]:
@@ -401,7 +634,7 @@ def validate_ascender_user_account_rules(
     else:  # Short circuit.
         if logging:
             LOGGER.warning("No job start date recorded, aborting")
-        return False
+        return ("start_date_missing", None)
 
     # Skippable rule: if job_start_date is in the past, skip account creation.
     today = date.today()
@@ -412,7 +645,7 @@ def validate_ascender_user_account_rules(
         if job_start_date < today:
             if logging:
                 LOGGER.warning(f"Job start date {job_start_date.strftime('%d/%b/%Y')} is in the past, aborting")
-            return False
+            return ("start_date_past", None)
 
     # Rule: we set a limit for the number of days ahead of their starting date which we
     # allow to create an Entra ID account. If this value is not set (False/None), assume that there is
@@ -424,35 +657,155 @@ def validate_ascender_user_account_rules(
             log = f"Job future start date {job_start_date.strftime('%d/%b/%Y')} exceeds limit of {settings.ASCENDER_CREATE_AZURE_AD_LIMIT_DAYS} days, aborting"
             if logging:
                 LOGGER.warning(log)
-            return False
+            return ("start_date_limit", None)
 
     # Rule: user must have a physical location recorded, and that location must exist in our database.
-    if job["geo_location_desc"] and Location.objects.filter(ascender_desc=job["geo_location_desc"]).exists():
-        location = Location.objects.get(ascender_desc=job["geo_location_desc"])
+    if job["geo_location_desc"] and index.get_location(job["geo_location_desc"]):
+        location = index.get_location(job["geo_location_desc"])
+    elif job["geo_location_desc"]:
+        LOGGER.warning(f"Job physical location {job['geo_location_desc']} does not exist in IT Assets, aborting")
+        return ("location_not_found", None)
     else:
-        if job["geo_location_desc"]:
-            LOGGER.warning(f"Job physical location {job['geo_location_desc']} does not exist in IT Assets, aborting")
-        else:
-            LOGGER.warning("No job physical location recorded, aborting")
-        return False
+        LOGGER.warning("No job physical location recorded, aborting")
+        return ("location_missing", None)
 
-    # If all rules have passed, return a tuple containing required values.
-    if cc and job_start_date and licence_type and manager and location:
-        return (job, cc, job_start_date, licence_type, manager, location)
-    else:
+    # All rules have passed, return a tuple containing required values.
+    return (None, (job, cc, job_start_date, licence_type, manager, location))
+
+
+def validate_ascender_user_account_rules(
+    job: dict,
+    ignore_job_start_date: bool = False,
+    manager_override_email: Optional[str] = None,
+    logging: bool = False,
+    index: Optional[AscenderSyncIndex] = None,
+) -> tuple | Literal[False]:
+    """Given a passed-in Ascender record and any qualifiers, determine
+    whether a new Entra ID account can be provisioned for that user.
+    Returns either a tuple of values required to provision the new account, or False.
+    See check_ascender_user_account_rules for the reason that the rules did not pass.
+    """
+    reason, values = check_ascender_user_account_rules(job, ignore_job_start_date, manager_override_email, logging, index)
+    if reason:
         return False
+    return values
+
+
+def validate_ascender_user_accounts(
+    jobs: Iterable[dict],
+    ignore_job_start_date: bool = False,
+    index: Optional[AscenderSyncIndex] = None,
+    create_cost_centre: bool = False,
+) -> dict:
+    """Check the new account rules for many Ascender records (one job per employee) at once.
+    Unless a loaded AscenderSyncIndex is passed in, the users, cost centres and locations
+    referenced by the jobs are queried in bulk beforehand.
+    By default, no new cost centres are created (see check_ascender_user_account_rules).
+    Returns a dict: {'<employee_id>': (reason, values), ...}
+    """
+    jobs = list(jobs)
+    if index is None:
+        index = AscenderSyncIndex().load_for_jobs(jobs)
+    return {
+        job["employee_id"]: check_ascender_user_account_rules(
+            job, ignore_job_start_date, index=index, create_cost_centre=create_cost_centre
+        )
+        for job in jobs
+    }
+
+
+class AscenderSyncWriter:
+    """Collects DepartmentUser changes and log objects generated during the Ascender sync, and
+    writes them to the database in batches (using bulk_update and bulk_create), with each batch
+    written in a single transaction.
+    """
 
+    def __init__(self, batch_size: Optional[int] = None):
+        self.batch_size = batch_size or settings.ASCENDER_SYNC_WRITE_BATCH_SIZE
+        self.users = {}  # {pk: (DepartmentUser, {changed field names})}
+        self.action_logs = []
+        self.user_logs = []
 
-def ascender_user_import_all():
+    def add_user(self, user: DepartmentUser, fields: Iterable):
+        """Queue a DepartmentUser object to be updated, plus the names of its changed fields."""
+        if user.pk in self.users:
+            self.users[user.pk][1].update(fields)
+        else:
+            self.users[user.pk] = (user, set(fields))
+        self.flush_if_full()
+
+    def add_action_log(self, **kwargs):
+        """Queue a new AscenderActionLog object to be created."""
+        self.action_logs.append(AscenderActionLog(**kwargs))
+        self.flush_if_full()
+
+    def add_user_log(self, **kwargs):
+        """Queue a new DepartmentUserLog object to be created."""
+        self.user_logs.append(DepartmentUserLog(**kwargs))
+        self.flush_if_full()
+
+    def flush_if_full(self):
+        if max(len(self.users), len(self.action_logs), len(self.user_logs)) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Write all queued changes to the database in a single transaction."""
+        users = list(self.users.values())
+        if not users and not self.action_logs and not self.user_logs:
+            return
+
+        with transaction.atomic():
+            if users:
+                # bulk_update doesn't call save(), so apply the same derived values and timestamp here.
+                # Only each user's changed fields are written (so that edits made elsewhere during the
+                # sync aren't overwritten), and users are grouped by the set of fields they changed.
+                groups = {}  # {frozenset(field names): [DepartmentUser]}
+                now = timezone.now()
+                for user, changed in users:
+                    derived = {field: getattr(user, field) for field in DepartmentUser.DERIVED_FIELDS}
+                    user.set_derived_fields()
+                    user.date_updated = now
+                    fields = set(changed)
+                    fields.update(field for field, value in derived.items() if getattr(user, field) != value)
+                    fields.add("date_updated")
+                    groups.setdefault(frozenset(fields), []).append(user)
+                for fields, group in groups.items():
+                    DepartmentUser.objects.bulk_update(group, fields=sorted(fields))
+            if self.action_logs:
+                AscenderActionLog.objects.bulk_create(self.action_logs)
+            if self.user_logs:
+                DepartmentUserLog.objects.bulk_create(self.user_logs)
+
+        LOGGER.info(f"Wrote {len(users)} user update(s), {len(self.action_logs) + len(self.user_logs)} log(s)")
+        self.users = {}
+        self.action_logs = []
+        self.user_logs = []
+
+
+def ascender_data_digest(job: dict) -> str:
+    """Returns a SHA-256 hex digest of the passed-in Ascender job record, used to detect changes."""
+    return hashlib.sha256(json.dumps(job, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def ascender_user_import_all(force: bool = False):
     """A utility function to cache data from Ascender to matching DepartmentUser objects.
-    On no match, create a new Entra ID account and DepartmentUser based on Ascender data,
-    assuming it meets all the business rules for new account provisioning.
+    On no match, queue the creation of a new Entra ID account and DepartmentUser based on Ascender
+    data (see enqueue_entra_id_user), assuming it meets all the business rules for new account provisioning.
+    Matched users whose Ascender data is unchanged since the last import are skipped, unless
+    `force` is True or their cached data is older than settings.ASCENDER_DATA_MAX_AGE_HOURS.
     """
     LOGGER.info("Querying Ascender database for employee information")
-    token = ms_graph_client_token()
-    employee_records = ascender_employees_fetch_all()
-
-    for employee_id, jobs in employee_records.items():
+    # Load the reference data used for lookups once, for the whole run.
+    index = AscenderSyncIndex().load()
+    # Changes to existing users are queued and written in batches.
+    writer = AscenderSyncWriter()
+    # Cached Ascender data older than this is refreshed, even if unchanged.
+    refresh_before = timezone.now() - timedelta(hours=settings.ASCENDER_DATA_MAX_AGE_HOURS)
+    employee_records = ascender_employees_iter()
+    skipped = 0
+    new_jobs = []
+
+    for employee_id, jobs in employee_records:
         # If we have no jobs data from Ascender for this employee, skip them.
         if not jobs:
             continue
@@ -464,10 +817,10 @@ def ascender_user_import_all():
         # This override is only possible for existing user accounts, not for new ones.
         # By default, use the first job in the sorted list (ensures that we have a job record).
         job = jobs[0]
+        user = index.get_user(employee_id)
         # For an existing matched DepartmentUser record where a position_no value is recorded,
         # attempt to select that job from the list instead.
-        if DepartmentUser.objects.filter(employee_id=employee_id, position_no__isnull=False).exists():
-            user = DepartmentUser.objects.get(employee_id=employee_id)
+        if user and user.position_no is not None:
             position_no = user.position_no
             for j in jobs:
                 if j["position_no"] == position_no:
@@ -478,19 +831,25 @@ def ascender_user_import_all():
         if "clevel1_id" in job and job["clevel1_id"] == "FPC":
             continue
 
+        # Skip existing users whose Ascender job record is unchanged since the last import.
+        digest = ascender_data_digest(job)
+        if (
+            not force
+            and user
+            and user.ascender_data_hash == digest
+            and user.ascender_data_updated
+            and user.ascender_data_updated >= refresh_before
+        ):
+            skipped += 1
+            continue
+
         # Physical locations: if the Ascender physical location doesn't exist in our database, create it.
         # This is out of band to checks whether the user is new or otherwise, because sometimes new locations
         # are added to existing users.
-        if (
-            job["geo_location_desc"] and not Location.objects.filter(ascender_desc=job["geo_location_desc"]).exists()
-        ):  # geo_location_desc must have a value.
+        if job["geo_location_desc"] and not index.get_location(job["geo_location_desc"]):  # geo_location_desc must have a value.
             # Attempt to manually create a new location description from Ascender data.
             try:
-                Location.objects.create(
-                    name=job["geo_location_desc"],
-                    ascender_desc=job["geo_location_desc"],
-                    address=job["geo_location_desc"],
-                )
+                index.create_location(job["geo_location_desc"])
                 log = f"Creation of new Entra ID account process generated new location, description {job['geo_location_desc']}"
                 AscenderActionLog.objects.create(level="INFO", log=log, ascender_data=job)
                 LOGGER.info(log)
@@ -499,15 +858,13 @@ def ascender_user_import_all():
                 log = f"ASCENDER SYNC: exception during creation of new location in new Entra ID account process, description {job['geo_location_desc']}"
                 LOGGER.error(log)
 
-        if DepartmentUser.objects.filter(employee_id=employee_id).exists():
+        if user:
             # Ascender record does exist in our database; cache the current job record on the
             # DepartmentUser instance.
-            user = DepartmentUser.objects.get(employee_id=employee_id)
-
             # Check if the user already has Ascender data cached. If so, check if the position_no
             # value has changed. In that situation, create a DepartmentUserLog object.
             if user.ascender_data and "position_no" in user.ascender_data and user.ascender_data["position_no"] != job["position_no"]:
-                DepartmentUserLog.objects.create(
+                writer.add_user_log(
                     department_user=user,
                     log={
                         "ascender_field": "position_no",
@@ -520,23 +877,35 @@ def ascender_user_import_all():
             # Cache the job record.
             user.ascender_data = job
             user.ascender_data_updated = timezone.localtime()
-            user.update_from_ascender_data()  # This method calls save()
-        elif not DepartmentUser.objects.filter(employee_id=employee_id).exists():
-            # Ascender record does not exist in our database; conditionally create a new
-            # Entra ID account and DepartmentUser instance for them.
-            # In this bulk check/create function, we do not ignore any account creation rules.
-            rules_passed = validate_ascender_user_account_rules(job, logging=False)
-
-            if not rules_passed:
-                # This DepartmentUser does not exist but has not passed all rules to generate a new Entra ID user account.
-                continue
+            user.ascender_data_hash = digest
+            changed = user.update_from_ascender_data(index=index, writer=writer)
+            writer.add_user(user, changed | {"ascender_data", "ascender_data_updated", "ascender_data_hash"})
+        else:
+            # Ascender record does not exist in our database; the new account rules are checked
+            # for all such records together, below.
+            new_jobs.append(job)
+
+    writer.flush()
+    LOGGER.info(f"Skipped {skipped} employee(s) with unchanged Ascender data")
+
+    # Conditionally create a new Entra ID account and DepartmentUser instance for each new employee.
+    # In this bulk check/create function, we do not ignore any account creation rules.
+    results = validate_ascender_user_accounts(new_jobs, index=index, create_cost_centre=True)
+    reasons = Counter()
+    for employee_id, (reason, values) in results.items():
+        if reason:
+            # This DepartmentUser does not exist but has not passed all rules to generate a new Entra ID user account.
+            reasons[reason] += 1
+            continue
 
-            # Unpack the required values.
-            job, cc, job_start_date, licence_type, manager, location = rules_passed
+        # Unpack the required values.
+        job, cc, job_start_date, licence_type, manager, location = values
+        # New accounts are provisioned separately by advance_entra_id_provisioning_tasks.
+        LOGGER.info(f"Ascender employee ID {employee_id} does not exist and passed all rules; queuing new account")
+        enqueue_entra_id_user(job, cc, job_start_date, licence_type, manager, location)
 
-            if cc and job_start_date and licence_type and manager and location:
-                LOGGER.info(f"Ascender employee ID {employee_id} does not exist and passed all rules; provisioning new account")
-                _ = create_entra_id_user(job, cc, job_start_date, manager, location, token)
+    if reasons:
+        LOGGER.info(f"New account rules not passed: {', '.join(f'{reason} ({count})' for reason, count in reasons.most_common())}")
 
 
 def ascender_user_import(
@@ -575,6 +944,15 @@ def ascender_user_import(
 
     # Unpack the required values.
     job, cc, job_start_date, licence_type, manager, location = rules_passed
+    # Don't create a second account for an employee who already has one being provisioned.
+    task = EntraIdProvisioningTask.objects.filter(
+        employee_id=job["employee_id"], state__in=EntraIdProvisioningTask.IN_PROGRESS_STATES
+    ).first()
+    if task:
+        _log_and_abort(
+            f"Entra ID account for {job['employee_id']} is already being provisioned (task {task.pk}, {task.get_state_display()})", job
+        )
+        return None
     token = ms_graph_client_token()
     return create_entra_id_user(job, cc, job_start_date, manager, location, token, position_no)
 
@@ -635,17 +1013,48 @@ def _resolve_names(job: dict) -> tuple[str, str, str, str]:
     return sanitise_name_values(first_name, second_name, surname, preferred_name)
 
 
+# The Ascender licence type codes, and the licence type string for each.
+LICENCE_TYPES = {"ONPUL": "On-premise", "CLDUL": "Cloud"}
+# The subscribed SKUs required for each licence type: (skuId, SKU description, licence description).
+LICENCE_TYPE_SKUS = {
+    "On-premise": ((MS_PRODUCTS["MICROSOFT 365 E5"], "E5", "E5"),),
+    "Cloud": (
+        (MS_PRODUCTS["MICROSOFT 365 F3"], "F3", "Cloud F3"),
+        (MS_PRODUCTS["EXCHANGE ONLINE (PLAN 2)"], "Exchange Online (Plan 2)", "Cloud Exchange Online"),
+        (MS_PRODUCTS["MICROSOFT 365 F5 SECURITY + COMPLIANCE ADD-ON"], "F5 Security Addon", "Cloud Security & Compliance for FLW"),
+    ),
+}
+
+
+def _reserved_licences(licence_type: str) -> int:
+    """Returns the number of queued Entra ID accounts of the given licence type which have passed
+    the licence availability check (i.e. have been created) but haven't yet been assigned a licence.
+    """
+    return EntraIdProvisioningTask.objects.filter(
+        licence_type=licence_type,
+        state__in=[
+            EntraIdProvisioningTask.STATE_CREATED,
+            EntraIdProvisioningTask.STATE_UPDATED,
+            EntraIdProvisioningTask.STATE_MANAGER_SET,
+            EntraIdProvisioningTask.STATE_USAGE_LOCATION_CONFIRMED,
+        ],
+    ).count()
+
+
 def _check_licence_availability(licence_type_code: str, token: dict, ascender_record: str) -> str | None:
     """Check Microsoft 365 licence availability for the given Ascender licence type code.
 
-    Queries the MS Graph subscribedSku endpoint to verify that at least one licence
-    of each required SKU remains available for assignment. Returns the human-readable
+    Uses the cached list of subscribed SKUs (SUBSCRIBED_SKU_CACHE) to verify that at least one
+    licence of each required SKU remains available for assignment. Returns the human-readable
     licence type string ("On-premise" or "Cloud") if all required licences are available,
     or None if the check fails or no licences remain.
 
     Licence availability is calculated as prepaidUnits (enabled + warning) minus
-    consumedUnits. Only "enabled" and "warning" prepaid units can be assigned to new
-    users; suspended or locked-out units are excluded from the available count.
+    consumedUnits (see SubscribedSkuCache.available). Only "enabled" and "warning" prepaid units
+    can be assigned to new users; suspended or locked-out units are excluded from the available count.
+    Licences are assigned to new accounts some time after this check (see PROVISIONING_STEPS), so
+    licences for queued accounts which have already passed it are treated as reserved, and are
+    also excluded from the available count.
 
     ONPUL maps to "On-premise" and requires: Microsoft 365 E5.
     CLDUL maps to "Cloud" and requires: Microsoft 365 F3, Exchange Online (Plan 2),
@@ -656,51 +1065,24 @@ def _check_licence_availability(licence_type_code: str, token: dict, ascender_re
     - https://learn.microsoft.com/en-us/graph/api/resources/licenseunitsdetail?view=graph-rest-1.0
     - https://github.com/microsoftgraph/microsoft-graph-docs-contrib/issues/2337
     """
-    if licence_type_code == "ONPUL":
-        e5_sku = ms_graph_get_subscribed_sku(MS_PRODUCTS["MICROSOFT 365 E5"], token)
-        if not e5_sku:
-            LOGGER.warning(f"Graph API E5 SKU query returned no data ({ascender_record})")
-            return None
-        e5_assignable = e5_sku["prepaidUnits"]["enabled"] + e5_sku["prepaidUnits"]["warning"]
-        if e5_assignable - e5_sku["consumedUnits"] <= 0:
-            LOGGER.warning(f"Creation of new Entra ID account aborted, no E5 licences available ({ascender_record})")
-            return None
-        return "On-premise"
-
-    elif licence_type_code == "CLDUL":
-        f3_sku = ms_graph_get_subscribed_sku(MS_PRODUCTS["MICROSOFT 365 F3"], token)
-        if not f3_sku:
-            LOGGER.warning(f"Graph API F3 SKU query returned no data ({ascender_record})")
-            return None
-        f3_assignable = f3_sku["prepaidUnits"]["enabled"] + f3_sku["prepaidUnits"]["warning"]
-        if f3_assignable - f3_sku["consumedUnits"] <= 0:
-            LOGGER.warning(f"Creation of new Entra ID account aborted, no Cloud F3 licences available ({ascender_record})")
-            return None
-
-        eo_sku = ms_graph_get_subscribed_sku(MS_PRODUCTS["EXCHANGE ONLINE (PLAN 2)"], token)
-        if not eo_sku:
-            LOGGER.warning(f"Graph API Exchange Online (Plan 2) SKU query returned no data ({ascender_record})")
-            return None
-        eo_assignable = eo_sku["prepaidUnits"]["enabled"] + eo_sku["prepaidUnits"]["warning"]
-        if eo_assignable - eo_sku["consumedUnits"] <= 0:
-            LOGGER.warning(f"Creation of new Entra ID account aborted, no Cloud Exchange Online licences available ({ascender_record})")
-            return None
+    licence_type = LICENCE_TYPES.get(licence_type_code)
+    if not licence_type:
+        LOGGER.warning(f"Creation of new Entra ID account aborted, invalid license type ({ascender_record})")
+        return None
 
-        sec_sku = ms_graph_get_subscribed_sku(MS_PRODUCTS["MICROSOFT 365 F5 SECURITY + COMPLIANCE ADD-ON"], token)
-        if not sec_sku:
-            LOGGER.warning(f"Graph API F5 Security Addon SKU query returned no data ({ascender_record})")
+    reserved = None
+    for sku_id, sku_desc, licence_desc in LICENCE_TYPE_SKUS[licence_type]:
+        available = SUBSCRIBED_SKU_CACHE.available(sku_id, token)
+        if available is None:
+            LOGGER.warning(f"Graph API {sku_desc} SKU query returned no data ({ascender_record})")
             return None
-        sec_assignable = sec_sku["prepaidUnits"]["enabled"] + sec_sku["prepaidUnits"]["warning"]
-        if sec_assignable - sec_sku["consumedUnits"] <= 0:
-            LOGGER.warning(
-                f"Creation of new Entra ID account aborted, no Cloud Security & Compliance for FLW licences available ({ascender_record})"
-            )
+        if reserved is None:
+            reserved = _reserved_licences(licence_type)
+        if available - reserved <= 0:
+            LOGGER.warning(f"Creation of new Entra ID account aborted, no {licence_desc} licences available ({ascender_record})")
             return None
-        return "Cloud"
 
-    else:
-        LOGGER.warning(f"Creation of new Entra ID account aborted, invalid license type ({ascender_record})")
-        return None
+    return licence_type
 
 
 def _build_licence_payload(licence_type: str) -> dict:
@@ -758,7 +1140,7 @@ def _wait_for_usage_location(guid: str, headers: dict, job: dict, email: str) ->
     params = {"$select": "id,usageLocation"}
 
     while retry_delay < 300:
-        resp = requests.get(url, headers=headers, params=params)
+        resp = graph.get(url, headers=headers, params=params)
         try:
             resp.raise_for_status()
             graph_user = resp.json()
@@ -814,9 +1196,10 @@ def _assign_licence_with_retry(
 
     while retry_delay < 300:
         try:
-            resp = requests.post(url, headers=headers, json=licence_payload)
+            resp = graph.post(url, headers=headers, json=licence_payload)
             resp.raise_for_status()
             user_has_license = True
+            SUBSCRIBED_SKU_CACHE.consume(licence["skuId"] for licence in licence_payload["addLicenses"])
         except (requests.exceptions.HTTPError, requests.exceptions.RequestException, Exception) as exc:
             LOGGER.warning(f"Call to {url} raised exception", exc_info=exc)
 
@@ -839,24 +1222,112 @@ def _assign_licence_with_retry(
             f"Ascender record:\n{job}\nMicrosoft Graph API endpoint: {url}\nRetry delay: {retry_delay}\nQuery timestamp: {timestamp.isoformat()}\nRequest body: {licence_payload}\nResponse code: {resp_code}\nResponse content: {resp_content}",
         )
 
-        # Delete the partially-provisioned account to avoid an orphaned Entra ID user.
-        delete_url = f"https://graph.microsoft.com/v1.0/users/{guid}"
-        try:
-            delete_resp = requests.delete(delete_url, headers=headers)
-            delete_resp.raise_for_status()
-            cleanup_log = (
-                f"Create new Entra ID user cleanup due to license assign failure: deleted orphaned Entra ID account {guid} ({email})"
-            )
-            AscenderActionLog.objects.create(level="INFO", log=cleanup_log, ascender_data=job)
-            LOGGER.info(cleanup_log)
-        except (requests.exceptions.HTTPError, requests.exceptions.RequestException, Exception):
-            cleanup_log = f"Create new Entra ID user cleanup due to license assign failure: failed to delete orphaned Entra ID account {guid} ({email}), manual deletion required"
-            AscenderActionLog.objects.create(level="WARNING", log=cleanup_log, ascender_data=job)
-            LOGGER.exception(cleanup_log)
+        _delete_orphaned_entra_id_user(guid, headers, job, email)
 
     return user_has_license
 
 
+def _delete_orphaned_entra_id_user(guid: str, headers: dict, job: dict, email: str) -> None:
+    """Delete a partially-provisioned Entra ID account (after licence assignment has failed), to
+    avoid leaving an orphaned user in the directory. The cleanup result is logged regardless of outcome.
+    """
+    delete_url = f"https://graph.microsoft.com/v1.0/users/{guid}"
+    try:
+        delete_resp = graph.delete(delete_url, headers=headers)
+        delete_resp.raise_for_status()
+        cleanup_log = f"Create new Entra ID user cleanup due to license assign failure: deleted orphaned Entra ID account {guid} ({email})"
+        AscenderActionLog.objects.create(level="INFO", log=cleanup_log, ascender_data=job)
+        LOGGER.info(cleanup_log)
+    except (requests.exceptions.HTTPError, requests.exceptions.RequestException, Exception):
+        cleanup_log = f"Create new Entra ID user cleanup due to license assign failure: failed to delete orphaned Entra ID account {guid} ({email}), manual deletion required"
+        AscenderActionLog.objects.create(level="WARNING", log=cleanup_log, ascender_data=job)
+        LOGGER.exception(cleanup_log)
+
+
+def _prepare_entra_id_user(job: dict, token: dict, ascender_record: str) -> dict | None:
+    """Pre-flight checks for creating a new Entra ID user account from Ascender job data.
+
+    Validates names, generates a unique DBCA email address, the display name and job title,
+    and checks that an M365 licence is available. Returns a dict of those values, or None
+    (after logging the reason) if any check fails.
+    """
+    # --- Name validation and email generation ---
+    # Surname is required, plus one of preferred_name or first_name.
+    first_name, second_name, surname, preferred_name = _resolve_names(job)
+
+    if not surname:
+        _log_and_abort(f"Creation of new Entra ID account aborted, surname absent ({ascender_record})", job)
+        return None
+    if not preferred_name and not first_name:
+        _log_and_abort(f"Creation of new Entra ID account aborted, first and preferred name both absent ({ascender_record})", job)
+        return None
+
+    email, mail_nickname = generate_valid_dbca_email(surname, preferred_name, first_name, second_name)
+    if not email:
+        _log_and_abort(f"Creation of new Entra ID account aborted at email step, unable to generate unique email ({ascender_record})", job)
+        return None
+
+    # --- Display name and job title ---
+    # Set names to title case and strip trailing whitespace.
+    if job["preferred_name"] and job["surname"]:
+        display_name = f"{job['preferred_name'].title().strip()} {job['surname'].title().strip()}"
+    elif job["first_name"] and job["surname"]:
+        display_name = f"{job['first_name'].title().strip()} {job['surname'].title().strip()}"
+    else:
+        _log_and_abort(f"Creation of new Entra ID account aborted, first/preferred name absent ({ascender_record})", job)
+        return None
+    title = title_except(job["occup_pos_title"])
+
+    # --- M365 licence availability check ---
+    licence_type = _check_licence_availability(job["licence_type"], token, ascender_record)
+    if not licence_type:
+        return None
+
+    return {
+        "email": email,
+        "mail_nickname": mail_nickname,
+        "display_name": display_name,
+        "title": title,
+        "licence_type": licence_type,
+    }
+
+
+def _entra_id_create_payload(display_name: str, email: str, mail_nickname: str, password: str) -> dict:
+    """Returns the request body to create the bare-minimum (disabled) Entra ID user account."""
+    return {
+        "accountEnabled": False,
+        "displayName": display_name,
+        "userPrincipalName": email,
+        "mailNickname": mail_nickname,
+        "usageLocation": "AU",
+        "passwordProfile": {
+            "forceChangePasswordNextSignIn": True,
+            "password": password,
+        },
+    }
+
+
+def _entra_id_update_payload(job: dict, email: str, title: str, cc: CostCentre, location: Location) -> dict:
+    """Returns the request body to patch additional details onto a new Entra ID user account."""
+    return {
+        "mail": email,
+        "employeeId": job["employee_id"],
+        "givenName": job["preferred_name"].title().strip() if job["preferred_name"] else job["first_name"].title().strip(),
+        "surname": job["surname"].title(),
+        "jobTitle": title,
+        "companyName": cc.code,
+        "department": cc.get_division_name_display(),
+        "officeLocation": location.name,
+        "streetAddress": location.address,
+        "state": "Western Australia",
+    }
+
+
+def _entra_id_manager_payload(manager: DepartmentUser) -> dict:
+    """Returns the request body to set the manager of an Entra ID user account."""
+    return {"@odata.id": f"https://graph.microsoft.com/v1.0/users/{manager.azure_guid}"}
+
+
 def create_entra_id_user(
     job: dict,
     cc: CostCentre,
@@ -893,37 +1364,15 @@ def create_entra_id_user(
     if job["job_end_date"] and datetime.strptime(job["job_end_date"], "%Y-%m-%d").date() != DATE_MAX:
         job_end_date = datetime.strptime(job["job_end_date"], "%Y-%m-%d").date()
 
-    # --- Name validation and email generation ---
-    # Surname is required, plus one of preferred_name or first_name.
-    first_name, second_name, surname, preferred_name = _resolve_names(job)
-
-    if not surname:
-        _log_and_abort(f"Creation of new Entra ID account aborted, surname absent ({ascender_record})", job)
-        return None
-    if not preferred_name and not first_name:
-        _log_and_abort(f"Creation of new Entra ID account aborted, first and preferred name both absent ({ascender_record})", job)
-        return None
-
-    email, mail_nickname = generate_valid_dbca_email(surname, preferred_name, first_name, second_name)
-    if not email:
-        _log_and_abort(f"Creation of new Entra ID account aborted at email step, unable to generate unique email ({ascender_record})", job)
-        return None
-
-    # --- Display name and job title ---
-    # Set names to title case and strip trailing whitespace.
-    if job["preferred_name"] and job["surname"]:
-        display_name = f"{job['preferred_name'].title().strip()} {job['surname'].title().strip()}"
-    elif job["first_name"] and job["surname"]:
-        display_name = f"{job['first_name'].title().strip()} {job['surname'].title().strip()}"
-    else:
-        _log_and_abort(f"Creation of new Entra ID account aborted, first/preferred name absent ({ascender_record})", job)
-        return None
-    title = title_except(job["occup_pos_title"])
-
-    # --- M365 licence availability check ---
-    licence_type = _check_licence_availability(job["licence_type"], token, ascender_record)
-    if not licence_type:
+    # --- Names, email, display name, job title and M365 licence availability ---
+    account = _prepare_entra_id_user(job, token, ascender_record)
+    if not account:
         return None
+    email = account["email"]
+    mail_nickname = account["mail_nickname"]
+    display_name = account["display_name"]
+    title = account["title"]
+    licence_type = account["licence_type"]
 
     # --- Password generation ---
     # Generate a random password and retry until it satisfies MS Graph complexity rules.
@@ -951,20 +1400,10 @@ def create_entra_id_user(
 
     # --- Step 1: Create the bare-minimum Entra ID user ---
     url = "https://graph.microsoft.com/v1.0/users"
-    data = {
-        "accountEnabled": False,
-        "displayName": display_name,
-        "userPrincipalName": email,
-        "mailNickname": mail_nickname,
-        "usageLocation": "AU",
-        "passwordProfile": {
-            "forceChangePasswordNextSignIn": True,
-            "password": password,
-        },
-    }
+    data = _entra_id_create_payload(display_name, email, mail_nickname, password)
     resp = None
     try:
-        resp = requests.post(url, headers=headers, json=data)
+        resp = graph.post(url, headers=headers, json=data)
         resp.raise_for_status()
         guid = resp.json()["id"]
     except (requests.exceptions.HTTPError, requests.exceptions.RequestException, Exception):
@@ -982,19 +1421,8 @@ def create_entra_id_user(
     # --- Step 2: Patch additional user details ---
     sleep(3)
     url = f"https://graph.microsoft.com/v1.0/users/{guid}"
-    data = {
-        "mail": email,
-        "employeeId": job["employee_id"],
-        "givenName": job["preferred_name"].title().strip() if job["preferred_name"] else job["first_name"].title().strip(),
-        "surname": job["surname"].title(),
-        "jobTitle": title,
-        "companyName": cc.code,
-        "department": cc.get_division_name_display(),
-        "officeLocation": location.name,
-        "streetAddress": location.address,
-        "state": "Western Australia",
-    }
-    resp = requests.patch(url, headers=headers, json=data)
+    data = _entra_id_update_payload(job, email, title, cc, location)
+    resp = graph.patch(url, headers=headers, json=data)
     try:
         resp.raise_for_status()
     except (requests.exceptions.HTTPError, requests.exceptions.RequestException, Exception):
@@ -1010,8 +1438,8 @@ def create_entra_id_user(
     # --- Step 3: Assign the manager ---
     sleep(3)
     manager_url = f"https://graph.microsoft.com/v1.0/users/{guid}/manager/$ref"
-    data = {"@odata.id": f"https://graph.microsoft.com/v1.0/users/{manager.azure_guid}"}
-    resp = requests.put(manager_url, headers=headers, json=data)
+    data = _entra_id_manager_payload(manager)
+    resp = graph.put(manager_url, headers=headers, json=data)
     try:
         resp.raise_for_status()
     except (requests.exceptions.HTTPError, requests.exceptions.RequestException, Exception):
@@ -1048,6 +1476,323 @@ def create_entra_id_user(
     return new_user
 
 
+def enqueue_entra_id_user(
+    job: dict,
+    cc: CostCentre,
+    job_start_date: date,
+    licence_type: str,
+    manager: DepartmentUser,
+    location: Location,
+    position_no: Optional[str] = None,
+) -> EntraIdProvisioningTask | None:
+    """Record a new EntraIdProvisioningTask to create an Entra ID user account from the supplied
+    Ascender job data. The account is provisioned later by advance_entra_id_provisioning_tasks,
+    so this function doesn't make any Graph API calls.
+    Returns the new task, or None if one wasn't created.
+    """
+    ascender_record = f"{job['employee_id']}, {job['first_name']} {job['surname']}"
+
+    if not manager.azure_guid:
+        LOGGER.warning(f"Creation of new Entra ID account aborted, manager does not have Entra ID account ({manager})")
+        return None
+    if not settings.ASCENDER_CREATE_AZURE_AD:
+        LOGGER.info(f"Skipping creation of new Entra ID account: {ascender_record} (ASCENDER_CREATE_AZURE_AD == False)")
+        return None
+    if settings.DEBUG:
+        LOGGER.info(f"Skipping creation of new Entra ID account for emp ID {ascender_record} (DEBUG)")
+        return None
+    # Don't queue a second account for an employee who already has one in progress.
+    if EntraIdProvisioningTask.objects.filter(
+        employee_id=job["employee_id"], state__in=EntraIdProvisioningTask.IN_PROGRESS_STATES
+    ).exists():
+        return None
+
+    task = EntraIdProvisioningTask.objects.create(
+        employee_id=job["employee_id"],
+        ascender_data=job,
+        cost_centre=cc,
+        location=location,
+        manager=manager,
+        job_start_date=job_start_date,
+        licence_type=licence_type,
+        position_no=position_no,
+        next_attempt_at=timezone.now(),
+    )
+    LOGGER.info(f"Queued creation of new Entra ID account ({ascender_record})")
+    return task
+
+
+def _provisioning_task_advance(task: EntraIdProvisioningTask, next_state: str, **fields) -> None:
+    """Move the task to the next state, due after the configured propagation delay."""
+    for field, value in fields.items():
+        setattr(task, field, value)
+    task.state = next_state
+    task.attempts = 0
+    task.last_error = None
+    task.next_attempt_at = timezone.now() + timedelta(seconds=settings.ENTRA_ID_PROVISIONING_STEP_DELAY)
+    task.save()
+
+
+def _provisioning_task_retry(task: EntraIdProvisioningTask, error: str) -> bool:
+    """Schedule another attempt at the task's current step, with exponential backoff.
+    Returns False if the task has reached the maximum number of attempts (it is left unchanged).
+    """
+    if task.attempts + 1 >= settings.ENTRA_ID_PROVISIONING_MAX_ATTEMPTS:
+        return False
+    task.attempts += 1
+    task.last_error = error
+    task.next_attempt_at = timezone.now() + timedelta(seconds=min(2**task.attempts, settings.ENTRA_ID_PROVISIONING_MAX_RETRY_DELAY))
+    task.save()
+    LOGGER.info(f"{error}; retrying at {task.next_attempt_at.isoformat()}")
+    return True
+
+
+def _provisioning_task_fail(task: EntraIdProvisioningTask, log: str, detail: Optional[str] = None, level: str = "ERROR") -> None:
+    """Mark the task as failed, log the reason and (optionally) email admins the supplied detail."""
+    task.state = EntraIdProvisioningTask.STATE_FAILED
+    task.last_error = log
+    task.save()
+    _log_and_abort(log, task.ascender_data, level)
+    if detail:
+        _send_admin_failure_email(log, detail)
+
+
+def _provisioning_step_create(task: EntraIdProvisioningTask, token: dict, headers: dict) -> None:
+    """pending -> created: pre-flight checks, then create the bare-minimum Entra ID user."""
+    job = task.ascender_data
+    ascender_record = f"{job['employee_id']}, {job['first_name']} {job['surname']}"
+    if task.azure_guid:
+        # The account was created by a previous attempt which failed before the task advanced:
+        # don't create a second account.
+        LOGGER.info(f"Entra ID account {task.azure_guid} already created for {task.email} ({ascender_record})")
+        _provisioning_task_advance(task, EntraIdProvisioningTask.STATE_CREATED)
+        return
+
+    account = _prepare_entra_id_user(job, token, ascender_record)
+    if not account:
+        # The reason has already been logged.
+        task.state = EntraIdProvisioningTask.STATE_FAILED
+        task.last_error = "Pre-flight checks failed"
+        task.save()
+        return
+
+    password = generate_password()
+    while not ms_graph_validate_password(password):
+        LOGGER.info("Generated password did not meet complexity requirements, retrying")
+        password = generate_password()
+
+    LOGGER.info(f"Creating new Entra ID account: {account['display_name']}, {account['email']}, {task.licence_type} account")
+    url = "https://graph.microsoft.com/v1.0/users"
+    data = _entra_id_create_payload(account["display_name"], account["email"], account["mail_nickname"], password)
+    resp = None
+    try:
+        resp = graph.post(url, headers=headers, json=data)
+        resp.raise_for_status()
+        guid = resp.json()["id"]
+    except (requests.exceptions.HTTPError, requests.exceptions.RequestException, Exception):
+        log = f"Create new Entra ID user failed at account creation step for {account['email']}, most likely duplicate email account exists ({ascender_record})"
+        resp_code = resp.status_code if resp is not None else "N/A"
+        resp_content = resp.content if resp is not None else "N/A"
+        _provisioning_task_fail(
+            task,
+            log,
+            f"Ascender record:\n{job}\nRequest URL: {url}\nRequest body:\n{data}\nResponse code: {resp_code}\nResponse content:\n{resp_content}",
+        )
+        return
+
+    # Record the new account on the task before anything else can fail, so that a retry of this
+    # step doesn't create a second account.
+    created = {
+        "azure_guid": guid,
+        "email": account["email"],
+        "mail_nickname": account["mail_nickname"],
+        "display_name": account["display_name"],
+        "title": account["title"],
+    }
+    for field, value in created.items():
+        setattr(task, field, value)
+    EntraIdProvisioningTask.objects.filter(pk=task.pk).update(**created)
+    _provisioning_task_advance(task, EntraIdProvisioningTask.STATE_CREATED)
+
+
+def _provisioning_step_update(task: EntraIdProvisioningTask, token: dict, headers: dict) -> None:
+    """created -> updated: patch additional user details onto the new account."""
+    job = task.ascender_data
+    ascender_record = f"{job['employee_id']}, {job['first_name']} {job['surname']}"
+    url = f"https://graph.microsoft.com/v1.0/users/{task.azure_guid}"
+    data = _entra_id_update_payload(job, task.email, task.title, task.cost_centre, task.location)
+    resp = graph.patch(url, headers=headers, json=data)
+    try:
+        resp.raise_for_status()
+    except (requests.exceptions.HTTPError, requests.exceptions.RequestException, Exception):
+        log = (
+            f"Create new Entra ID user failed at account update step for {task.email}, ask administrator to investigate ({ascender_record})"
+        )
+        _provisioning_task_fail(
+            task,
+            log,
+            f"Ascender record:\n{job}\nRequest URL: {url}\nRequest body:\n{data}\nResponse code: {resp.status_code}\nResponse content:\n{resp.content}",
+        )
+        return
+
+    _provisioning_task_advance(task, EntraIdProvisioningTask.STATE_UPDATED)
+
+
+def _provisioning_step_manager(task: EntraIdProvisioningTask, token: dict, headers: dict) -> None:
+    """updated -> manager_set: assign the new account's manager."""
+    url = f"https://graph.microsoft.com/v1.0/users/{task.azure_guid}/manager/$ref"
+    data = _entra_id_manager_payload(task.manager)
+    resp = graph.put(url, headers=headers, json=data)
+    try:
+        resp.raise_for_status()
+    except (requests.exceptions.HTTPError, requests.exceptions.RequestException, Exception):
+        log = f"Create new Entra ID user failed at assign manager update step for {task.email} (manager {task.manager})"
+        _provisioning_task_fail(
+            task,
+            log,
+            f"Ascender record:\n{task.ascender_data}\nRequest URL: {url}\nRequest body:\n{data}\nResponse code: {resp.status_code}\nResponse content:\n{resp.content}",
+        )
+        return
+
+    _provisioning_task_advance(task, EntraIdProvisioningTask.STATE_MANAGER_SET)
+
+
+def _provisioning_step_usage_location(task: EntraIdProvisioningTask, token: dict, headers: dict) -> None:
+    """manager_set -> usage_location_confirmed: check that usageLocation has propagated to the new account."""
+    url = f"https://graph.microsoft.com/v1.0/users/{task.azure_guid}"
+    graph_user = None
+    try:
+        resp = graph.get(url, headers=headers, params={"$select": "id,usageLocation"})
+        resp.raise_for_status()
+        graph_user = resp.json()
+    except (requests.exceptions.HTTPError, requests.exceptions.RequestException, Exception) as exc:
+        LOGGER.warning(f"Call to {url} raised exception", exc_info=exc)
+
+    if graph_user and graph_user.get("usageLocation") == "AU":
+        _provisioning_task_advance(task, EntraIdProvisioningTask.STATE_USAGE_LOCATION_CONFIRMED)
+    elif not _provisioning_task_retry(task, f"User {task.azure_guid} usageLocation not set"):
+        log = f"Create new Entra ID user failed at assign license step for {task.email}, usageLocation field value not set"
+        _provisioning_task_fail(
+            task,
+            log,
+            f"Ascender record:\n{task.ascender_data}\nMicrosoft Graph API endpoint: {url}\nAttempts: {task.attempts + 1}\nQuery timestamp: {timezone.now().isoformat()}",
+            level="WARNING",
+        )
+
+
+def _provisioning_step_licence(task: EntraIdProvisioningTask, token: dict, headers: dict) -> None:
+    """usage_location_confirmed -> licensed: assign M365 licences to the new account."""
+    job = task.ascender_data
+    ascender_record = f"{job['employee_id']}, {job['first_name']} {job['surname']}"
+    url = f"https://graph.microsoft.com/v1.0/users/{task.azure_guid}/assignLicense"
+    licence_payload = _build_licence_payload(task.licence_type)
+    resp = None
+    try:
+        resp = graph.post(url, headers=headers, json=licence_payload)
+        resp.raise_for_status()
+        SUBSCRIBED_SKU_CACHE.consume(licence["skuId"] for licence in licence_payload["addLicenses"])
+        _provisioning_task_advance(task, EntraIdProvisioningTask.STATE_LICENSED)
+        return
+    except (requests.exceptions.HTTPError, requests.exceptions.RequestException, Exception) as exc:
+        LOGGER.warning(f"Call to {url} raised exception", exc_info=exc)
+
+    if not _provisioning_task_retry(task, f"Licence assignment for user {task.azure_guid} not yet successful"):
+        log = (
+            f"Create new Entra ID user failed at assign license step for {task.email}, ask administrator to investigate ({ascender_record})"
+        )
+        resp_code = resp.status_code if resp is not None else "N/A"
+        resp_content = resp.content if resp is not None else "N/A"
+        _provisioning_task_fail(
+            task,
+            log,
+            f"Ascender record:\n{job}\nMicrosoft Graph API endpoint: {url}\nAttempts: {task.attempts + 1}\nQuery timestamp: {timezone.now().isoformat()}\nRequest body: {licence_payload}\nResponse code: {resp_code}\nResponse content: {resp_content}",
+            level="WARNING",
+        )
+        _delete_orphaned_entra_id_user(task.azure_guid, headers, job, task.email)
+
+
+def _provisioning_step_complete(task: EntraIdProvisioningTask, token: dict, headers: dict) -> None:
+    """licensed -> complete: create the DepartmentUser and email the manager."""
+    job = task.ascender_data
+    LOGGER.info(f"New Entra ID account created from Ascender data ({task.email})")
+    new_user = department_user_create(
+        job, task.azure_guid, task.email, task.display_name, task.title, task.cost_centre, task.location, task.manager, task.position_no
+    )
+    _provisioning_task_advance(task, EntraIdProvisioningTask.STATE_COMPLETE, department_user=new_user)
+
+    job_end_date = None
+    if job["job_end_date"] and datetime.strptime(job["job_end_date"], "%Y-%m-%d").date() != DATE_MAX:
+        job_end_date = datetime.strptime(job["job_end_date"], "%Y-%m-%d").date()
+    email_sent = new_user_creation_email(new_user, task.manager, task.licence_type, task.job_start_date, job_end_date)
+    if email_sent:
+        LOGGER.info(f"ASCENDER SYNC: Emailed {task.manager.email} about new user account creation")
+    else:
+        LOGGER.error("ASCENDER SYNC: no email sent regarding new user account creation")
+
+
+# Maps each in-progress provisioning task state to the function which carries out the next step.
+PROVISIONING_STEPS = {
+    EntraIdProvisioningTask.STATE_PENDING: _provisioning_step_create,
+    EntraIdProvisioningTask.STATE_CREATED: _provisioning_step_update,
+    EntraIdProvisioningTask.STATE_UPDATED: _provisioning_step_manager,
+    EntraIdProvisioningTask.STATE_MANAGER_SET: _provisioning_step_usage_location,
+    EntraIdProvisioningTask.STATE_USAGE_LOCATION_CONFIRMED: _provisioning_step_licence,
+    EntraIdProvisioningTask.STATE_LICENSED: _provisioning_step_complete,
+}
+
+
+def advance_entra_id_provisioning_tasks(max_seconds: int = 0, token: Optional[dict] = None) -> int:
+    """Carry out the next step of every in-progress EntraIdProvisioningTask which is due.
+    No task waits on Entra ID propagation: each step records when the following step is due and
+    the scheduler moves on to the next task, so many new accounts are provisioned side by side.
+    If `max_seconds` is set, keep processing tasks as they fall due until none remain or that
+    time has elapsed, sleeping only while no task is due.
+    Returns the number of tasks still in progress.
+    """
+    if not token:
+        token = ms_graph_client_token()
+    headers = {
+        "Authorization": "Bearer {}".format(token["access_token"]),
+        "Content-Type": "application/json",
+    }
+    deadline = monotonic() + max_seconds
+    in_progress = EntraIdProvisioningTask.objects.filter(state__in=EntraIdProvisioningTask.IN_PROGRESS_STATES)
+
+    while True:
+        due = in_progress.filter(next_attempt_at__lte=timezone.now()).select_related("cost_centre", "location", "manager")
+        for task in due.order_by("next_attempt_at"):
+            if not (task.cost_centre and task.location and task.manager):
+                # The cost centre, location or manager was deleted after the task was queued.
+                _provisioning_task_fail(
+                    task, f"Create new Entra ID user failed for employee {task.employee_id}, cost centre/location/manager deleted"
+                )
+                continue
+            try:
+                PROVISIONING_STEPS[task.state](task, token, headers)
+            except Exception:
+                LOGGER.exception(f"Exception while provisioning Entra ID account for {task.employee_id} (state {task.state})")
+                if not _provisioning_task_retry(task, f"Exception during step {task.state}"):
+                    _provisioning_task_fail(task, f"Create new Entra ID user failed at step {task.state} for employee {task.employee_id}")
+
+        next_due = in_progress.aggregate(next_due=Min("next_attempt_at"))["next_due"]
+        if not next_due:
+            break
+        wait = max((next_due - timezone.now()).total_seconds(), 0)
+        if monotonic() + wait > deadline:
+            break
+        sleep(wait)
+
+    return in_progress.count()
+
+
+def _email_in_use(email: str) -> bool:
+    """Returns True if the email is used by a DepartmentUser, or reserved by an in-progress provisioning task."""
+    return (
+        DepartmentUser.objects.filter(email=email).exists()
+        or EntraIdProvisioningTask.objects.filter(email=email, state__in=EntraIdProvisioningTask.IN_PROGRESS_STATES).exists()
+    )
+
+
 def generate_valid_dbca_email(
     surname: str, preferred_name: str = "", first_name: str = "", second_name: str = ""
 ) -> tuple[str, str] | tuple[None, None]:
@@ -1072,7 +1817,7 @@ def generate_valid_dbca_email(
             f"{preferred_name}{second_name}.{surname}@dbca.wa.gov.au",
         ]
         for pattern in email_patterns:
-            if not DepartmentUser.objects.filter(email=pattern).exists():
+            if not _email_in_use(pattern):
                 email = pattern
                 mail_nickname = pattern.split("@")[0]
                 return (email, mail_nickname)
@@ -1082,7 +1827,7 @@ def generate_valid_dbca_email(
             f"{first_name}{second_name}.{surname}@dbca.wa.gov.au",
         ]
         for pattern in email_patterns:
-            if not DepartmentUser.objects.filter(email=pattern).exists():
+            if not _email_in_use(pattern):
                 email = pattern
                 mail_nickname = pattern.split("@")[0]
                 return (email, mail_nickname)
@@ -1221,10 +1966,10 @@ OIM Service Desk\n"""
 
 def ascender_cc_manager_fetch() -> List[tuple]:
     """Returns all records from cc_manager_view."""
-    conn = get_ascender_db_connection()
-    cursor = conn.cursor()
     schema = sql.Identifier(settings.FOREIGN_SCHEMA)
     table = sql.Identifier(settings.FOREIGN_TABLE_CC_MANAGER)
     query = sql.SQL("SELECT * FROM {schema}.{table}").format(schema=schema, table=table)
-    cursor.execute(query)
-    return cursor.fetchall()
+    with get_ascender_db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(query)
+            return cursor.fetchall()
@@ -0,0 +1,295 @@
+import json
+import logging
+from collections import Counter
+from datetime import timedelta
+from typing import Iterable, Optional
+
+from django.conf import settings
+from django.core import mail
+from django.db import DatabaseError, transaction
+from django.utils import timezone
+
+from organisation.microsoft_products import MS_PRODUCTS
+from organisation.models import CostCentre, DepartmentUser, Location
+from organisation.utils import json_digest
+
+LOGGER = logging.getLogger("organisation")
+# A new DepartmentUser is only created for an Entra ID account with one of these licences assigned.
+LICENCES = {MS_PRODUCTS["MICROSOFT 365 E5"], MS_PRODUCTS["MICROSOFT 365 F3"]}
+# DepartmentUser fields which may be changed when syncing Entra ID data (see update_from_entra_id_data).
+ENTRA_ID_FIELDS = [
+    "azure_guid",
+    "azure_ad_data",
+    "azure_ad_data_updated",
+    "azure_ad_data_hash",
+    "assigned_groups",
+    "active",
+    "email",
+    "dir_sync_enabled",
+    "proxy_addresses",
+    "assigned_licences",
+    "last_password_change",
+]
+
+
+class EntraIdSyncIndex:
+    """A run-scoped index of the reference data used when syncing Entra ID user accounts:
+    DepartmentUser objects (by Entra ID GUID, email and employee ID), CostCentre objects (by code)
+    and Location objects (by name). Each table is queried once, by load().
+    """
+
+    def __init__(self):
+        self.users_by_guid = {}
+        self.users_by_email = {}
+        self.users_by_employee_id = {}  # Employee ID values are not unique: {employee_id: [users]}
+        self.cost_centres = {}
+        self.locations = {}
+
+    def load(self):
+        """Query the reference tables and build the lookup dicts. Returns the index."""
+        self.users_by_guid = {}
+        self.users_by_email = {}
+        self.users_by_employee_id = {}
+        for user in DepartmentUser.objects.order_by("pk"):
+            self.add_user(user)
+        self.cost_centres = {cc.code: cc for cc in CostCentre.objects.all()}
+        self.locations = {location.name: location for location in Location.objects.all()}
+        return self
+
+    def add_user(self, user: DepartmentUser):
+        if user.azure_guid:
+            self.users_by_guid[user.azure_guid] = user
+        self.users_by_email[user.email] = user
+        if user.employee_id:
+            self.users_by_employee_id.setdefault(user.employee_id, []).append(user)
+
+
+class EntraIdReconciler:
+    """Reconciles Entra ID user accounts against DepartmentUser objects in memory, using an
+    EntraIdSyncIndex. Each account is classified as one of the actions below, and the resulting
+    changes are queued and written to the database in bulk by flush():
+      - update: a DepartmentUser is linked to the account; cache the account data on it.
+      - unchanged: as for update, but the account data and group membership are unchanged
+        since they were cached (see update()), so nothing is written.
+      - link: an unlinked DepartmentUser has the account's email; link it to the account.
+      - create: no DepartmentUser matches a licensed account; create one.
+      - conflict: the account's email or employee ID is held by another DepartmentUser; skip
+        the account and email the admins.
+      - skip: no DepartmentUser matches an unlicensed account.
+    Cached Entra ID GUIDs for accounts which no longer exist are removed by unlink().
+    """
+
+    UPDATE = "update"
+    UNCHANGED = "unchanged"
+    LINK = "link"
+    CREATE = "create"
+    CONFLICT = "conflict"
+    SKIP = "skip"
+    UNLINK = "unlink"
+
+    def __init__(self, index: Optional[EntraIdSyncIndex] = None):
+        self.index = index or EntraIdSyncIndex().load()
+        self.created = []
+        self.updated = {}  # {pk: DepartmentUser}
+        self.counts = Counter()
+
+    def classify(self, az: dict) -> tuple[str, Optional[DepartmentUser], Optional[str]]:
+        """Classify the passed-in Entra ID account (as returned by ms_graph_user_transform),
+        returning a tuple of (action, matching DepartmentUser or None, conflicting field or None).
+        """
+        user = self.index.users_by_guid.get(az["objectId"])
+        if user:
+            return self.UPDATE, user, None
+
+        user = self.index.users_by_email.get(az["userPrincipalName"]) if az["userPrincipalName"] else None
+        # EDGE CASE 1: a department user with matching email may already exist with a different azure_guid.
+        # This should be cleaned up by the 'invalid GUID' check in most cases.
+        if user and user.azure_guid:
+            return self.CONFLICT, user, "email"
+
+        # EDGE CASE 2: a department user with matching employee ID may already exist with no azure_guid.
+        employee_users = self.index.users_by_employee_id.get(az["employeeId"], []) if az["employeeId"] else []
+        if any(not i.azure_guid for i in employee_users):
+            return self.CONFLICT, employee_users[0], "employee_id"
+
+        # A department user with matching email may already exist with no azure_guid.
+        if user:
+            return self.LINK, user, None
+
+        if az["assignedLicenses"] and not LICENCES.isdisjoint(az["assignedLicenses"]):
+            return self.CREATE, None, None
+
+        return self.SKIP, None, None
+
+    def reconcile(self, az: dict, member_groups: Optional[dict] = None) -> Optional[str]:
+        """Classify the passed-in Entra ID account and queue the resulting change, returning the
+        action. `member_groups` is a dict of {guid: [groups]} for linked accounts (the assigned
+        groups of a linked user are retained if it has no entry).
+        """
+        try:
+            action, user, field = self.classify(az)
+            if action == self.UPDATE:
+                assigned_groups = member_groups.get(user.azure_guid) if member_groups else None
+                if not self.update(user, az, assigned_groups):
+                    action = self.UNCHANGED
+            elif action == self.LINK:
+                user.azure_guid = az["objectId"]
+                self.index.users_by_guid[user.azure_guid] = user
+                self.update(user, az, force=True)
+                LOGGER.info(f"Linked existing user {user.email} with Azure objectId {az['objectId']}")
+            elif action == self.CREATE:
+                self.create(az)
+            elif action == self.CONFLICT:
+                self.conflict(az, user, field)
+        except Exception as e:
+            # In the event of an exception, fail gracefully and alert the admins.
+            self.exception_email(az, e)
+            return None
+
+        self.counts[action] += 1
+        return action
+
+    def update(self, user: DepartmentUser, az: dict, assigned_groups: Optional[list] = None, force: bool = False) -> bool:
+        """Cache the Entra ID account data (and the assigned groups, if known) on the passed-in
+        DepartmentUser, and queue it to be written. Unless `force` is True, the user is skipped if
+        the account data and groups are unchanged, the cached data is no older than
+        ENTRA_ID_DATA_MAX_AGE_HOURS, and the user's onprem AD data hasn't changed since (it is also
+        used by update_from_entra_id_data). Returns True if the user was queued.
+        """
+        digest = json_digest(az)
+        refresh_before = timezone.now() - timedelta(hours=settings.ENTRA_ID_DATA_MAX_AGE_HOURS)
+        if (
+            not force
+            and user.azure_ad_data_hash == digest
+            and (assigned_groups is None or assigned_groups == user.assigned_groups)
+            and user.azure_ad_data_updated
+            and user.azure_ad_data_updated >= refresh_before
+            and not (user.ad_data_updated and user.ad_data_updated > user.azure_ad_data_updated)
+        ):
+            return False
+
+        if assigned_groups is not None:
+            user.assigned_groups = assigned_groups
+        user.azure_ad_data = az
+        user.azure_ad_data_hash = digest
+        user.azure_ad_data_updated = timezone.now()
+        user.update_from_entra_id_data(commit=False)
+        self.updated[user.pk] = user
+        return True
+
+    def create(self, az: dict):
+        user = DepartmentUser(
+            azure_guid=az["objectId"],
+            azure_ad_data=az,
+            azure_ad_data_updated=timezone.now(),
+            azure_ad_data_hash=json_digest(az),
+            active=az["accountEnabled"],
+            email=az["userPrincipalName"],
+            name=az["displayName"],
+            given_name=az["givenName"],
+            surname=az["surname"],
+            title=az["jobTitle"],
+            telephone=az["telephoneNumber"],
+            mobile_phone=az["mobilePhone"],
+            employee_id=az["employeeId"],
+            cost_centre=self.index.cost_centres.get(az["companyName"]) if az["companyName"] else None,
+            location=self.index.locations.get(az["officeLocation"]) if az["officeLocation"] else None,
+            dir_sync_enabled=az["onPremisesSyncEnabled"],
+        )
+        user.update_from_entra_id_data(commit=False)
+        self.created.append(user)
+        self.index.add_user(user)
+
+    def conflict(self, az: dict, existing_user: DepartmentUser, field: str):
+        """Email the admins about an Entra ID account which conflicts with an existing DepartmentUser."""
+        if field == "email":
+            subject = f"ENTRA ID SYNC: DepartmentUser with duplicate email while syncing Entra ID account {az['objectId']}"
+            message = f"Skipped {az['userPrincipalName']} ({az['objectId']}): email exists and is already associated with Entra ID {existing_user.azure_guid}"
+        else:
+            subject = f"ENTRA ID SYNC: DepartmentUser with duplicate employee_id while syncing Entra ID account {az['objectId']}"
+            message = (
+                f"Skipped {az['userPrincipalName']} ({az['objectId']}): employeeId exists and is already associated with {existing_user}"
+            )
+        LOGGER.warning(message)
+        mail.send_mail(
+            subject=subject,
+            message=message,
+            from_email=settings.NOREPLY_EMAIL,
+            recipient_list=settings.ADMIN_EMAILS,
+            fail_silently=True,
+        )
+
+    def exception_email(self, az: dict, e: Exception):
+        subject = f"ENTRA ID SYNC: exception during sync of Entra ID account {az.get('objectId')}"
+        LOGGER.exception(subject)
+        message = f"Azure data:\n{json.dumps(az, indent=2)}\nException:\n{str(e)}\n"
+        html_message = f"<p>Azure data:</p><p>{json.dumps(az, indent=2)}</p><p>Exception:</p><p>{str(e)}\n</p>"
+        mail.send_mail(
+            subject=subject,
+            message=message,
+            from_email=settings.NOREPLY_EMAIL,
+            recipient_list=settings.ADMIN_EMAILS,
+            html_message=html_message,
+            fail_silently=True,
+        )
+
+    def unlink(self, azure_guids: Iterable[str]):
+        """Queue the removal of invalid Entra ID GUID values from department users."""
+        for guid in azure_guids:
+            user = self.index.users_by_guid.pop(guid, None)
+            if not user:
+                continue
+            user.azure_guid = None
+            self.updated[user.pk] = user
+            self.counts[self.UNLINK] += 1
+            LOGGER.info(f"Removed invalid Entra ID GUID {guid} from department user {user}")
+
+    def flush(self):
+        """Write all queued changes to the database in a single transaction, using bulk_update and
+        bulk_create. If the bulk write fails (e.g. an Entra ID email change clashes with another
+        department user), each object is saved individually instead and failures are emailed to admins.
+        """
+        created, updated = self.created, list(self.updated.values())
+        self.created, self.updated = [], {}
+        if not created and not updated:
+            return
+
+        # bulk_update doesn't call save(), so apply the same derived values and timestamp here.
+        # Updated users have only the Entra ID fields written (plus any derived field whose value
+        # changed), grouped by the set of fields to write, so that other fields edited elsewhere
+        # during the sync aren't overwritten.
+        now = timezone.now()
+        for user in created:
+            user.set_derived_fields()
+            user.date_updated = now
+        groups = {}  # {frozenset(field names): [DepartmentUser]}
+        for user in updated:
+            derived = {field: getattr(user, field) for field in DepartmentUser.DERIVED_FIELDS}
+            user.set_derived_fields()
+            user.date_updated = now
+            fields = set(ENTRA_ID_FIELDS)
+            fields.update(field for field, value in derived.items() if getattr(user, field) != value)
+            fields.add("date_updated")
+            groups.setdefault(frozenset(fields), []).append(user)
+
+        try:
+            # Update before creating: a failed bulk_create leaves the new objects unsaved, so they
+            # can still be saved individually below.
+            with transaction.atomic():
+                for fields, group in groups.items():
+                    DepartmentUser.objects.bulk_update(group, fields=sorted(fields))
+                if created:
+                    DepartmentUser.objects.bulk_create(created)
+        except DatabaseError:
+            LOGGER.exception("Bulk write of Entra ID changes failed, saving department users individually")
+            for user in updated + created:
+                try:
+                    with transaction.atomic():
+                        user.save()
+                except DatabaseError as e:
+                    self.exception_email(user.azure_ad_data or {}, e)
+                    created = [i for i in created if i is not user]
+
+        for user in created:
+            LOGGER.info(f"Created new department user {user}")
+        LOGGER.info(f"Wrote {len(updated)} department user update(s), {len(created)} new department user(s)")
@@ -0,0 +1,76 @@
+import csv
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+
+from organisation.ascender import (
+    ACCOUNT_RULE_REASONS,
+    ascender_employee_fetch,
+    ascender_employees_iter,
+    close_ascender_db_pool,
+    validate_ascender_user_accounts,
+)
+
+
+class Command(BaseCommand):
+    help = "Reports the reason that each Ascender employee has not passed the rules to provision a new Entra ID account"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--employee-id",
+            action="store",
+            default=None,
+            type=str,
+            help="Comma-separated list of Ascender employee no. to check (defaults to all employees)",
+            dest="employee_id",
+        )
+        parser.add_argument(
+            "--reason",
+            action="store",
+            default=None,
+            type=str,
+            help="Only report employees failing the rules for this reason code",
+            dest="reason",
+        )
+        parser.add_argument(
+            "--include-existing",
+            action="store_true",
+            help="Include employees having an existing DepartmentUser",
+            dest="include_existing",
+        )
+        parser.add_argument(
+            "--summary",
+            action="store_true",
+            help="Output the count of employees for each reason code, instead of each employee",
+            dest="summary",
+        )
+
+    def handle(self, *args, **options):
+        if options["reason"] and options["reason"] not in ACCOUNT_RULE_REASONS:
+            raise CommandError(f"Invalid reason code: {options['reason']} (valid codes: {', '.join(ACCOUNT_RULE_REASONS)})")
+
+        if options["employee_id"]:
+            employee_records = [ascender_employee_fetch(employee_id.strip()) for employee_id in options["employee_id"].split(",")]
+        else:
+            employee_records = ascender_employees_iter()
+        # New accounts are provisioned from the first job in the sorted list for each employee.
+        jobs = [jobs[0] for employee_id, jobs in employee_records if jobs]
+        close_ascender_db_pool()
+
+        results = validate_ascender_user_accounts(jobs)
+        names = {job["employee_id"]: f"{job['first_name']} {job['surname']}" for job in jobs}
+        rows = [
+            (employee_id, reason)
+            for employee_id, (reason, values) in results.items()
+            if (options["include_existing"] or reason != "user_exists") and (not options["reason"] or reason == options["reason"])
+        ]
+
+        writer = csv.writer(self.stdout, lineterminator="\n")
+        if options["summary"]:
+            writer.writerow(["reason", "description", "count"])
+            for reason, count in Counter(reason for employee_id, reason in rows).most_common():
+                writer.writerow([reason or "passed", ACCOUNT_RULE_REASONS.get(reason, "Passed all rules"), count])
+        else:
+            writer.writerow(["employee_id", "name", "reason", "description"])
+            for employee_id, reason in rows:
+                writer.writerow([employee_id, names[employee_id], reason or "passed", ACCOUNT_RULE_REASONS.get(reason, "Passed all rules")])
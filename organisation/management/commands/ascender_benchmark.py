@@ -0,0 +1,124 @@
+import tracemalloc
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from itassets.utils import humanise_bytes
+from organisation.ascender import (
+    AscenderSyncIndex,
+    AscenderSyncWriter,
+    ascender_data_digest,
+    ascender_db_fetch,
+    ascender_employees_iter,
+    validate_ascender_user_accounts,
+)
+from organisation.models import DepartmentUser
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks each phase of the Ascender import (fetch, grouping, validation and writes), "
+        "reporting rows/s, query counts and peak memory. Database changes are rolled back by default. "
+        "Query counts are for the Django database only: Ascender queries use a separate connection pool."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--match-ratio",
+            action="store",
+            type=float,
+            default=0.0,
+            dest="match_ratio",
+            help="Proportion of Ascender employees to create matching DepartmentUser objects for, before benchmarking (default 0)",
+        )
+        parser.add_argument(
+            "--commit",
+            action="store_true",
+            help="Commit database changes instead of rolling them back",
+        )
+
+    def measure(self, phase: str, func, count=len, queries: bool = True):
+        """Run `func`, recording the elapsed time, Django queries and peak memory used.
+        `count` is a callable which returns the number of rows processed from the result.
+        Pass `queries=False` for a phase which only queries the Ascender database, as those
+        queries aren't captured (its query count is reported as "-").
+        """
+        tracemalloc.reset_peak()
+        start = perf_counter()
+        with CaptureQueriesContext(connection) as captured:
+            result = func()
+        elapsed = perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        rows = count(result)
+        self.results.append((phase, rows, elapsed, rows / elapsed if elapsed else 0, len(captured) if queries else "-", peak))
+        return result
+
+    def handle(self, *args, **options):
+        self.results = []
+        tracemalloc.start()
+
+        # Stream the rows without keeping them, so that peak memory reflects the fetch alone.
+        self.measure("fetch", lambda: sum(1 for _ in ascender_db_fetch()), count=lambda rows: rows, queries=False)
+        # Fetch again, grouping and sorting each employee's jobs (subtract the fetch phase for the cost of grouping).
+        employees = self.measure("fetch+group", lambda: list(ascender_employees_iter()), queries=False)
+
+        with transaction.atomic():
+            if options["match_ratio"]:
+                # Create matching DepartmentUser objects for a proportion of employees (not timed).
+                matched = employees[: int(len(employees) * options["match_ratio"])]
+                existing = set(DepartmentUser.objects.filter(employee_id__isnull=False).values_list("employee_id", flat=True))
+                DepartmentUser.objects.bulk_create(
+                    [
+                        DepartmentUser(
+                            email=f"{employee_id}@benchmark.invalid",
+                            name=f"{jobs[0]['first_name']} {jobs[0]['surname']}",
+                            given_name=jobs[0]["first_name"],
+                            surname=jobs[0]["surname"],
+                            employee_id=employee_id,
+                            ascender_data={},
+                        )
+                        for employee_id, jobs in matched
+                        if employee_id not in existing
+                    ],
+                    batch_size=1000,
+                )
+
+            index = self.measure("index", lambda: AscenderSyncIndex().load(), count=lambda index: len(index.users))
+
+            def validate():
+                new_jobs = [jobs[0] for employee_id, jobs in employees if not index.get_user(employee_id)]
+                return validate_ascender_user_accounts(new_jobs, index=index)
+
+            self.measure("validate", validate)
+
+            def write():
+                writer = AscenderSyncWriter()
+                count = 0
+                for employee_id, jobs in employees:
+                    user = index.get_user(employee_id)
+                    if not user:
+                        continue
+                    user.ascender_data = jobs[0]
+                    user.ascender_data_updated = timezone.localtime()
+                    user.ascender_data_hash = ascender_data_digest(jobs[0])
+                    changed = user.update_from_ascender_data(index=index, writer=writer)
+                    writer.add_user(user, changed | {"ascender_data", "ascender_data_updated", "ascender_data_hash"})
+                    count += 1
+                writer.flush()
+                return count
+
+            self.measure("write", write, count=lambda count: count)
+
+            if not options["commit"]:
+                transaction.set_rollback(True)
+
+        tracemalloc.stop()
+
+        self.stdout.write(f"{'Phase':<12}{'Rows':>10}{'Seconds':>10}{'Rows/s':>12}{'Queries':>10}{'Peak memory':>14}")
+        for phase, rows, elapsed, rate, queries, peak in self.results:
+            self.stdout.write(f"{phase:<12}{rows:>10}{elapsed:>10.2f}{rate:>12.0f}{queries:>10}{humanise_bytes(peak):>14}")
+        if not options["commit"]:
+            self.stdout.write("Database changes rolled back")
@@ -0,0 +1,179 @@
+import logging
+import random
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from psycopg import sql
+
+from organisation.ascender import DATE_MAX, FOREIGN_TABLE_FIELDS, get_ascender_db_connection
+
+# Columns which are stored as a date in the Ascender view; all other columns are text.
+DATE_COLUMNS = ("job_start_date", "job_end_date", "ext_lv_end_date")
+CC_MANAGER_COLUMNS = (
+    "cc_manager_id",
+    "paypoint",
+    "paypoint_desc",
+    "manager_surname",
+    "manager_first_name",
+    "position_no",
+    "manager_emp_no",
+)
+FIRST_NAMES = ("ALICE", "BOB", "CAROL", "DAVID", "EMMA", "FRANK", "GRACE", "HENRY", "ISLA", "JACK", "KATE", "LIAM", "MIA", "NOAH", "OLIVIA")
+SURNAMES = ("SMITH", "JONES", "WILLIAMS", "BROWN", "WILSON", "TAYLOR", "NGUYEN", "JOHNSON", "MARTIN", "WHITE", "ANDERSON", "WALKER")
+TITLES = ("ADMINISTRATION OFFICER", "PROJECT OFFICER", "SENIOR RANGER", "RANGER", "SCIENTIST", "MANAGER", "SENIOR POLICY OFFICER")
+# (emp_status, emp_stat_desc, weight)
+EMP_STATUSES = (
+    ("PFT", "PERMANENT FULL TIME", 40),
+    ("PPT", "PERMANENT PART TIME", 15),
+    ("CFT", "CONTRACT FULL TIME", 20),
+    ("CAS", "CASUAL EMPLOYEES", 10),
+    ("SEAS", "SEASONAL", 5),
+    ("EXT", "EXTERNAL", 5),
+    ("NOPAY", "NO PAY", 5),
+)
+
+
+class Command(BaseCommand):
+    help = "Populates a local copy of the Ascender database with synthetic employee data, for load testing"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--employees", action="store", type=int, default=5000, help="Number of employees (default 5000)")
+        parser.add_argument("--max-jobs", action="store", type=int, default=3, help="Maximum jobs per employee (default 3)")
+        parser.add_argument("--seed", action="store", type=int, default=None, help="Random seed, for repeatable data")
+        parser.add_argument(
+            "--allow-remote",
+            action="store_true",
+            help="Allow writing to a database host other than localhost",
+            dest="allow_remote",
+        )
+
+    def handle(self, *args, **options):
+        logger = logging.getLogger("organisation")
+
+        # Guard against accidentally writing synthetic data into the real Ascender database.
+        if settings.FOREIGN_DB_HOST not in ("localhost", "127.0.0.1", "::1") and not options["allow_remote"]:
+            raise CommandError(f"FOREIGN_DB_HOST is {settings.FOREIGN_DB_HOST}; pass --allow-remote to write to it")
+        if not settings.FOREIGN_TABLE or not settings.FOREIGN_TABLE_CC_MANAGER:
+            raise CommandError("FOREIGN_TABLE and FOREIGN_TABLE_CC_MANAGER must be set")
+
+        rng = random.Random(options["seed"])
+        employee_count = options["employees"]
+        paypoints = [str(100 + i) for i in range(max(employee_count // 25, 1))]
+        locations = [
+            f"{i} {rng.choice(SURNAMES).title()} Street, {rng.choice(SURNAMES)}VILLE" for i in range(1, max(employee_count // 100, 2))
+        ]
+        schema = sql.Identifier(settings.FOREIGN_SCHEMA)
+        table = sql.Identifier(settings.FOREIGN_TABLE)
+        cc_table = sql.Identifier(settings.FOREIGN_TABLE_CC_MANAGER)
+        columns = [f[0] if isinstance(f, (list, tuple)) else f for f in FOREIGN_TABLE_FIELDS]
+
+        with get_ascender_db_connection() as conn:
+            logger.info(f"Creating table {settings.FOREIGN_SCHEMA}.{settings.FOREIGN_TABLE}")
+            conn.execute(sql.SQL("CREATE SCHEMA IF NOT EXISTS {}").format(schema))
+            conn.execute(sql.SQL("DROP TABLE IF EXISTS {}.{}").format(schema, table))
+            conn.execute(
+                sql.SQL("CREATE TABLE {}.{} ({})").format(
+                    schema,
+                    table,
+                    sql.SQL(", ").join(
+                        sql.SQL("{} {}").format(sql.Identifier(col), sql.SQL("date" if col in DATE_COLUMNS else "text")) for col in columns
+                    ),
+                )
+            )
+            conn.execute(sql.SQL("DROP TABLE IF EXISTS {}.{}").format(schema, cc_table))
+            conn.execute(
+                sql.SQL("CREATE TABLE {}.{} ({})").format(
+                    schema, cc_table, sql.SQL(", ").join(sql.SQL("{} text").format(sql.Identifier(col)) for col in CC_MANAGER_COLUMNS)
+                )
+            )
+
+            logger.info(f"Generating {employee_count} synthetic employees")
+            row_count = 0
+            with conn.cursor() as cur:
+                copy_sql = sql.SQL("COPY {}.{} ({}) FROM STDIN").format(schema, table, sql.SQL(", ").join(map(sql.Identifier, columns)))
+                with cur.copy(copy_sql) as copy:
+                    for i in range(employee_count):
+                        for job in self.employee_jobs(rng, i, options["max_jobs"], paypoints, locations):
+                            copy.write_row([job.get(col) for col in columns])
+                            row_count += 1
+
+                # Assign a manager to each cost centre.
+                copy_sql = sql.SQL("COPY {}.{} ({}) FROM STDIN").format(
+                    schema, cc_table, sql.SQL(", ").join(map(sql.Identifier, CC_MANAGER_COLUMNS))
+                )
+                with cur.copy(copy_sql) as copy:
+                    for i, paypoint in enumerate(paypoints):
+                        manager_no = str(100000 + rng.randrange(min(employee_count, 50)))
+                        copy.write_row(
+                            [str(i), paypoint, f"COST CENTRE {paypoint}", rng.choice(SURNAMES), rng.choice(FIRST_NAMES), None, manager_no]
+                        )
+
+        logger.info(f"Inserted {row_count} job rows for {employee_count} employees, {len(paypoints)} cost centres")
+
+    def employee_jobs(self, rng: random.Random, i: int, max_jobs: int, paypoints: list, locations: list) -> list:
+        """Returns a list of synthetic Ascender job records (dicts) for employee number `i`."""
+        today = date.today()
+        employee_no = str(100000 + i)
+        # Build a manager hierarchy: the first 10 employees report to employee 0 (who has no manager),
+        # and everyone else reports to an employee with a lower number.
+        if i == 0:
+            manager_no = None
+        elif i < 10:
+            manager_no = "100000"
+        else:
+            manager_no = str(100000 + rng.randrange(i // 10, i))
+        first_name = rng.choice(FIRST_NAMES)
+        surname = rng.choice(SURNAMES)
+        # Most employees have a single job; a minority have several.
+        job_count = min(max_jobs, 1 + int(rng.expovariate(2.0)))
+        jobs = []
+
+        for job_no in range(1, job_count + 1):
+            emp_status, emp_stat_desc = rng.choices([(s[0], s[1]) for s in EMP_STATUSES], weights=[s[2] for s in EMP_STATUSES])[0]
+            start_date = today - timedelta(days=rng.randint(0, 3650))
+            # Ascender records a "null" job end date as DATE_MAX. Older jobs have ended.
+            end_choice = rng.random()
+            if job_no < job_count or end_choice < 0.2:
+                end_date = start_date + timedelta(days=rng.randint(30, 1000))
+            elif end_choice < 0.35:
+                end_date = today + timedelta(days=rng.randint(1, 365))
+            elif end_choice < 0.4:
+                end_date = None
+            else:
+                end_date = DATE_MAX
+            # A small proportion of new starters, who don't have an account yet.
+            if job_no == job_count and rng.random() < 0.02:
+                start_date = today + timedelta(days=rng.randint(1, 14))
+                end_date = DATE_MAX
+
+            jobs.append(
+                {
+                    "employee_no": employee_no,
+                    "job_no": str(job_no),
+                    "surname": surname,
+                    "first_name": first_name,
+                    "second_name": rng.choice(FIRST_NAMES) if rng.random() < 0.5 else None,
+                    "preferred_name": rng.choice(FIRST_NAMES) if rng.random() < 0.1 else None,
+                    "clevel1_id": "FPC" if rng.random() < 0.05 else "BCA",
+                    "clevel1_desc": "DEPT BIODIVERSITY, CONSERVATION AND ATTRACTIONS",
+                    "clevel2_desc": "STRATEGY AND GOVERNANCE",
+                    "clevel3_desc": "OFFICE OF INFORMATION MANAGEMENT",
+                    "clevel4_desc": None,
+                    "clevel5_desc": None,
+                    "position_no": str(rng.randint(10000000, 99999999)),
+                    "occup_pos_title": rng.choice(TITLES),
+                    "emp_status": emp_status,
+                    "emp_stat_desc": emp_stat_desc,
+                    "paypoint": rng.choice(paypoints),
+                    "geo_location_desc": rng.choice(locations),
+                    "job_start_date": start_date,
+                    "job_end_date": end_date,
+                    "ext_lv_end_date": None,
+                    "licence_type": rng.choices(["ONPUL", "CLDUL", None], weights=[70, 25, 5])[0],
+                    "manager_emp_no": manager_no,
+                    "manager_name": None,
+                }
+            )
+
+        return jobs
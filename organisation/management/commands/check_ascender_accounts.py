@@ -8,6 +8,13 @@ from sentry_sdk.crons import monitor
 class Command(BaseCommand):
     help = "Caches data from Ascender on DepartmentUser objects, optionally create new M365 accounts"
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Update all matched users, including those with unchanged Ascender data",
+        )
+
     def handle(self, *args, **options):
         logger = logging.getLogger("organisation")
         logger.info("Running Ascender database import")
@@ -15,7 +22,7 @@ class Command(BaseCommand):
         if settings.SENTRY_CRON_CHECK_ASCENDER:
             logger.info(f"Applying Sentry Cron Monitor: {settings.SENTRY_CRON_CHECK_ASCENDER}")
             with monitor(monitor_slug=settings.SENTRY_CRON_CHECK_ASCENDER):
-                ascender_user_import_all()
+                ascender_user_import_all(force=options["force"])
         else:
-            ascender_user_import_all()
+            ascender_user_import_all(force=options["force"])
         logger.info("Completed")
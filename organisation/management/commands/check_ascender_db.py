@@ -0,0 +1,19 @@
+import logging
+
+from django.core.management.base import BaseCommand, CommandError
+
+from organisation.ascender import ascender_db_health_check, close_ascender_db_pool
+
+
+class Command(BaseCommand):
+    help = "Checks that the Ascender database is reachable"
+
+    def handle(self, *args, **options):
+        logger = logging.getLogger("organisation")
+        logger.info("Checking connection to the Ascender database")
+        healthy = ascender_db_health_check()
+        close_ascender_db_pool()
+
+        if not healthy:
+            raise CommandError("Unable to query the Ascender database")
+        logger.info("Completed")
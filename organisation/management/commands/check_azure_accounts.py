@@ -1,161 +1,165 @@
-import json
 import logging
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
+from itertools import islice
 
 from django.conf import settings
-from django.core import mail
 from django.core.management.base import BaseCommand
 from sentry_sdk.crons import monitor
 
 from itassets.utils import ms_graph_client_token
-from organisation.microsoft_products import MS_PRODUCTS
-from organisation.models import CostCentre, DepartmentUser, Location
-from organisation.utils import ms_graph_list_member_groups, ms_graph_list_users
+from organisation.entra_id import EntraIdReconciler
+from organisation.models import SyncCheckpoint
+from organisation.utils import (
+    DeltaLinkExpired,
+    ms_graph_get_user,
+    ms_graph_iter_users,
+    ms_graph_list_member_groups_many,
+    ms_graph_user_transform,
+    ms_graph_users_delta,
+)
 
 
 class Command(BaseCommand):
     help = "Checks licensed user accounts from Entra ID and updates linked DepartmentUser objects"
+    # Name of the SyncCheckpoint used to persist the Entra ID users delta link between runs.
+    CHECKPOINT_NAME = "entra_id_users"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--full",
+            action="store_true",
+            help="Check all Entra ID user accounts, instead of only those changed since the previous run",
+            dest="full",
+        )
 
     def handle(self, *args, **options):
         logger = logging.getLogger("organisation")
-        logger.info("Querying Microsoft Graph API for Entra ID user accounts")
         # Optionally run this management command in the context of a Sentry cron monitor.
         if settings.SENTRY_CRON_CHECK_AZURE:
             with monitor(monitor_slug=settings.SENTRY_CRON_CHECK_AZURE):
                 logger.info(f"Applying Sentry Cron Monitor: {settings.SENTRY_CRON_CHECK_AZURE}")
-                self.check_azure_accounts(logger)
+                self.check_azure_accounts(logger, options["full"])
         else:
-            self.check_azure_accounts(logger)
+            self.check_azure_accounts(logger, options["full"])
 
         logger.info("Completed")
 
-    def check_azure_accounts(self, logger):
+    def check_azure_accounts(self, logger, full=False):
         """Separate the body of this management command to allow running it in context with
         the Sentry monitor process.
+        Changes to Entra ID user accounts since the previous run are queried using a delta link, unless
+        a full check is requested, no delta link is saved, the saved delta link has expired, or the
+        previous full check was more than ENTRA_ID_FULL_SYNC_HOURS ago.
         """
         token = ms_graph_client_token()
-        azure_users = ms_graph_list_users(token=token)
+        checkpoint = SyncCheckpoint.get_state(self.CHECKPOINT_NAME)
+
+        if not full and checkpoint.get("delta_link") and checkpoint.get("full_sync"):
+            full_sync_due = datetime.fromisoformat(checkpoint["full_sync"]) + timedelta(hours=settings.ENTRA_ID_FULL_SYNC_HOURS)
+            if datetime.now(timezone.utc) < full_sync_due:
+                try:
+                    self.check_changed_accounts(logger, token, checkpoint)
+                    return
+                except DeltaLinkExpired:
+                    logger.warning("Entra ID users delta link has expired, checking all accounts")
+
+        self.check_all_accounts(logger, token)
+
+    def check_all_accounts(self, logger, token):
+        """Check all Entra ID user accounts against DepartmentUser records. Accounts are streamed
+        from the API and reconciled in batches, rather than downloading the whole directory first.
+        DepartmentUser records are loaded once and the changes for each batch are written in bulk.
+        """
+        logger.info("Querying Microsoft Graph API for Entra ID user accounts")
+        # Obtain a delta link prior to listing users, so that any changes made while
+        # the accounts are being checked are picked up by the next run.
+        delta = ms_graph_users_delta(latest=True, token=token)
+        # Initially, query only the ID of each account to check for any invalid Entra ID GUID values that are cached.
+        valid_azure_guids = set(i["objectId"] for i in ms_graph_iter_users(select="id", token=token))
 
-        if not azure_users:
+        if not valid_azure_guids:
             logger.error("Microsoft Graph API returned no data")
             return
 
-        logger.info("Comparing Department Users to Entra ID user accounts")
-
-        # Initially, check for any invalid Entra ID GUID values that are cached.
         logger.info("Checking cached Entra ID GUID values for validity")
-        valid_azure_guids = [i["objectId"] for i in azure_users]
-        cached_azure_guids = DepartmentUser.objects.filter(azure_guid__isnull=False).values_list("azure_guid", flat=True)
-        for guid in cached_azure_guids:
-            if guid not in valid_azure_guids:
-                du = DepartmentUser.objects.get(azure_guid=guid)
-                du.azure_guid = None
-                du.save()
-                logger.info(f"Removed invalid Entra ID GUID {guid} from department user {du}")
+        reconciler = EntraIdReconciler()
+        cached_azure_guids = set(reconciler.index.users_by_guid.keys())
+        reconciler.unlink(cached_azure_guids - valid_azure_guids)
+        reconciler.flush()
+        linked_azure_guids = cached_azure_guids & valid_azure_guids
 
         logger.info("Checking Entra ID accounts against DepartmentUser records")
-        licences = set([MS_PRODUCTS["MICROSOFT 365 E5"], MS_PRODUCTS["MICROSOFT 365 F3"]])
+        azure_users = ms_graph_iter_users(token=token)
+        count = 0
+        while batch := list(islice(azure_users, settings.MS_GRAPH_PAGE_SIZE)):
+            # Query the group membership of linked Entra ID users in each batch up front (concurrently).
+            batch_azure_guids = [az["objectId"] for az in batch if az["objectId"] in linked_azure_guids]
+            member_groups = self.list_member_groups(logger, token, batch_azure_guids)
+            for az in batch:
+                reconciler.reconcile(az, member_groups)
+            reconciler.flush()
+            count += len(batch)
+        logger.info(f"Checked {count} Entra ID user accounts: {dict(reconciler.counts)}")
+
+        if delta:
+            SyncCheckpoint.set_state(self.CHECKPOINT_NAME, {"delta_link": delta[1], "full_sync": datetime.now(timezone.utc).isoformat()})
+
+    def check_changed_accounts(self, logger, token, checkpoint):
+        """Check Entra ID user accounts which have been added, changed or removed since the
+        saved delta link was obtained, and save the next delta link.
+        """
+        logger.info("Querying Microsoft Graph API for changed Entra ID user accounts")
+        delta = ms_graph_users_delta(checkpoint["delta_link"], token=token)
+
+        if not delta:
+            logger.error("Microsoft Graph API returned no data")
+            return
+
+        changes, delta_link = delta
+        logger.info(f"{len(changes)} Entra ID user accounts changed since the previous run")
+
+        reconciler = EntraIdReconciler()
+        reconciler.unlink(i["objectId"] for i in changes if "@removed" in i)
+
+        # Changed accounts include only the changed properties: merge these with the cached Entra ID
+        # data for linked users, or query the full account details for other users.
+        changes = [i for i in changes if "@removed" not in i]
+        linked_users = [reconciler.index.users_by_guid.get(i["objectId"]) for i in changes]
+        cached_data = {du.azure_guid: du.azure_ad_data for du in linked_users if du and du.azure_ad_data}
+        azure_users = []
+        for change in changes:
+            if change["objectId"] in cached_data:
+                az = {**cached_data[change["objectId"]], **change}
+            else:
+                try:
+                    az = ms_graph_user_transform(ms_graph_get_user(change["objectId"], token=token))
+                except Exception:
+                    logger.exception(f"Unable to query Entra ID user account {change['objectId']}")
+                    continue
+            # A delta query doesn't return the email of a changed manager: keep the cached value if the
+            # manager is unchanged, otherwise use the email of the manager's department user (if any).
+            if az["manager"] and not az["manager"]["mail"]:
+                cached_manager = cached_data.get(change["objectId"], {}).get("manager")
+                if cached_manager and cached_manager["id"] == az["manager"]["id"] and cached_manager["mail"]:
+                    az["manager"]["mail"] = cached_manager["mail"]
+                else:
+                    manager = reconciler.index.users_by_guid.get(az["manager"]["id"])
+                    az["manager"]["mail"] = manager.email if manager else None
+            azure_users.append(az)
+
+        member_groups = self.list_member_groups(logger, token, set(cached_data.keys()))
+
         for az in azure_users:
-            try:
-                # No existing DepartmentUser is linked to this Entra ID user.
-                if not DepartmentUser.objects.filter(azure_guid=az["objectId"]).exists():
-                    # EDGE CASE 1: a department user with matching email may already exist with a different azure_guid.
-                    # This should be cleaned up by the 'invalid GUID' check above in most cases.
-                    # We'll need to correct this issue manually. Email a warning to admins and skip the account.
-                    if (
-                        az["userPrincipalName"]
-                        and DepartmentUser.objects.filter(email=az["userPrincipalName"], azure_guid__isnull=False).exists()
-                    ):
-                        existing_user = DepartmentUser.objects.filter(email=az["userPrincipalName"]).first()
-                        message = f"Skipped {az['userPrincipalName']} ({az['objectId']}): email exists and is already associated with Entra ID {existing_user.azure_guid}"
-                        logger.warning(message)
-                        mail.send_mail(
-                            subject=f"ENTRA ID SYNC: DepartmentUser with duplicate email while syncing Entra ID account {az['objectId']}",
-                            message=message,
-                            from_email=settings.NOREPLY_EMAIL,
-                            recipient_list=settings.ADMIN_EMAILS,
-                            fail_silently=True,
-                        )
-                        continue
-
-                    # EDGE CASE 2: a department user with matching employee ID may already exist with a different azure_guid.
-                    # We'll need to correct this issue manually. Email a warning to admins and skip the account.
-                    if az["employeeId"] and DepartmentUser.objects.filter(employee_id=az["employeeId"], azure_guid__isnull=True).exists():
-                        existing_user = DepartmentUser.objects.filter(employee_id=az["employeeId"]).first()
-                        message = f"Skipped {az['userPrincipalName']} ({az['objectId']}): employeeId exists and is already associated with {existing_user}"
-                        logger.warning(message)
-                        mail.send_mail(
-                            subject=f"ENTRA ID SYNC: DepartmentUser with duplicate employee_id while syncing Entra ID account {az['objectId']}",
-                            message=message,
-                            from_email=settings.NOREPLY_EMAIL,
-                            recipient_list=settings.ADMIN_EMAILS,
-                            fail_silently=True,
-                        )
-                        continue
-
-                    # A department user with matching email may already exist in IT Assets with no azure_guid.
-                    # If so, associate the Entra ID objectId with that user record.
-                    if DepartmentUser.objects.filter(email=az["userPrincipalName"], azure_guid__isnull=True).exists():
-                        existing_user = DepartmentUser.objects.get(email=az["userPrincipalName"])
-                        existing_user.azure_guid = az["objectId"]
-                        existing_user.azure_ad_data = az
-                        existing_user.azure_ad_data_updated = datetime.now(timezone.utc)
-                        existing_user.update_from_entra_id_data()  # This method calls save()
-                        logger.info(f"Linked existing user {existing_user.email} with Azure objectId {az['objectId']}")
-                        continue  # Skip to the next Azure user.
-
-                    # Only create a new DepartmentUser instance if the Entra ID account has an E5 or F3 licence assigned.
-                    if az["assignedLicenses"] and not licences.isdisjoint(az["assignedLicenses"]):
-                        if az["companyName"] and CostCentre.objects.filter(code=az["companyName"]).exists():
-                            cost_centre = CostCentre.objects.get(code=az["companyName"])
-                        else:
-                            cost_centre = None
-
-                        if az["officeLocation"] and Location.objects.filter(name=az["officeLocation"]).exists():
-                            location = Location.objects.get(name=az["officeLocation"])
-                        else:
-                            location = None
-
-                        new_user = DepartmentUser.objects.create(
-                            azure_guid=az["objectId"],
-                            azure_ad_data=az,
-                            azure_ad_data_updated=datetime.now(timezone.utc),
-                            active=az["accountEnabled"],
-                            email=az["userPrincipalName"],
-                            name=az["displayName"],
-                            given_name=az["givenName"],
-                            surname=az["surname"],
-                            title=az["jobTitle"],
-                            telephone=az["telephoneNumber"],
-                            mobile_phone=az["mobilePhone"],
-                            employee_id=az["employeeId"],
-                            cost_centre=cost_centre,
-                            location=location,
-                            dir_sync_enabled=az["onPremisesSyncEnabled"],
-                        )
-                        new_user.update_from_entra_id_data()
-                        logger.info(f"Created new department user {new_user}")
-                # An existing DepartmentUser is linked to this Entra ID user - cache the Azure data on it.
-                elif DepartmentUser.objects.filter(azure_guid=az["objectId"]).exists():
-                    # Update the existing DepartmentUser object fields with values from Azure.
-                    existing_user = DepartmentUser.objects.get(azure_guid=az["objectId"])
-                    existing_user.azure_ad_data = az
-                    # Cache the list of assigned Entra groups on the user account.
-                    groups = ms_graph_list_member_groups(azure_guid=existing_user.azure_guid, token=token)
-                    existing_user.assigned_groups = groups
-                    existing_user.azure_ad_data_updated = datetime.now(timezone.utc)
-                    existing_user.update_from_entra_id_data()  # This method calls save()
-            except Exception as e:
-                # In the event of an exception, fail gracefully and alert the admins.
-                subject = f"ENTRA ID SYNC: exception during sync of Entra ID account {az['objectId']}"
-                logger.exception(subject)
-                message = f"Azure data:\n{json.dumps(az, indent=2)}\nException:\n{str(e)}\n"
-                html_message = f"<p>Azure data:</p><p>{json.dumps(az, indent=2)}</p><p>Exception:</p><p>{str(e)}\n</p>"
-                mail.send_mail(
-                    subject=subject,
-                    message=message,
-                    from_email=settings.NOREPLY_EMAIL,
-                    recipient_list=settings.ADMIN_EMAILS,
-                    html_message=html_message,
-                    fail_silently=True,
-                )
+            reconciler.reconcile(az, member_groups)
+        reconciler.flush()
+        logger.info(f"Checked {len(azure_users)} Entra ID user accounts: {dict(reconciler.counts)}")
+
+        SyncCheckpoint.set_state(self.CHECKPOINT_NAME, dict(checkpoint, delta_link=delta_link))
+
+    def list_member_groups(self, logger, token, azure_guids):
+        """Query the group membership of the passed-in Entra ID users, returning a dict of {guid: [groups]}."""
+        logger.info(f"Querying group membership for {len(azure_guids)} linked Entra ID accounts")
+        member_groups = ms_graph_list_member_groups_many(azure_guids, token=token)
+        if len(member_groups) < len(azure_guids):
+            logger.warning(f"Group membership query failed for {len(azure_guids) - len(member_groups)} Entra ID accounts")
+        return member_groups
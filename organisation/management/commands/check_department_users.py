@@ -20,8 +20,10 @@ class Command(BaseCommand):
             du.account_type = 14  # Unknown
             du.ad_data = {}
             du.ad_data_updated = None
+            du.ad_data_hash = None
             du.azure_ad_data = {}
             du.azure_ad_data_updated = None
+            du.azure_ad_data_hash = None
             du.dir_sync_enabled = None
             du.last_signin = None
             du.last_password_change = None
@@ -29,6 +31,7 @@ class Command(BaseCommand):
             if du.employee_id is None:
                 du.ascender_data = {}
                 du.ascender_data_updated = None
+                du.ascender_data_hash = None
 
             logger.info(f"Clearing cached data from {du}")
             du.save()
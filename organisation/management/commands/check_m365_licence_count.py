@@ -6,7 +6,7 @@ from django.core.management.base import BaseCommand, CommandError
 
 from itassets.utils import ms_graph_client_token
 from organisation.microsoft_products import MS_PRODUCTS
-from organisation.utils import ms_graph_get_subscribed_sku
+from organisation.utils import SubscribedSkuCache
 
 
 class Command(BaseCommand):
@@ -62,29 +62,31 @@ class Command(BaseCommand):
         send_notification = False
         logger.info("Checking Microsoft 365 license availability")
         token = ms_graph_client_token()
+        # A single subscribedSkus query returns all of the SKUs below.
+        skus = SubscribedSkuCache()
 
-        e5_sku = ms_graph_get_subscribed_sku(MS_PRODUCTS["MICROSOFT 365 E5"], token)
+        e5_sku = skus.get(MS_PRODUCTS["MICROSOFT 365 E5"], token)
         e5_consumed = e5_sku["consumedUnits"]
         e5_assignable = e5_sku["prepaidUnits"]["enabled"] + e5_sku["prepaidUnits"]["warning"]
         e5_available = e5_assignable - e5_consumed
         if e5_available <= threshold:
             send_notification = True
 
-        f3_sku = ms_graph_get_subscribed_sku(MS_PRODUCTS["MICROSOFT 365 F3"], token)
+        f3_sku = skus.get(MS_PRODUCTS["MICROSOFT 365 F3"], token)
         f3_consumed = f3_sku["consumedUnits"]
         f3_assignable = f3_sku["prepaidUnits"]["enabled"] + f3_sku["prepaidUnits"]["warning"]
         f3_available = f3_assignable - f3_consumed
         if f3_available <= threshold:
             send_notification = True
 
-        eo_sku = ms_graph_get_subscribed_sku(MS_PRODUCTS["EXCHANGE ONLINE (PLAN 2)"], token)
+        eo_sku = skus.get(MS_PRODUCTS["EXCHANGE ONLINE (PLAN 2)"], token)
         eo_consumed = eo_sku["consumedUnits"]
         eo_assignable = eo_sku["prepaidUnits"]["enabled"] + eo_sku["prepaidUnits"]["warning"]
         eo_available = eo_assignable - eo_consumed
         if eo_available <= threshold:
             send_notification = True
 
-        sec_sku = ms_graph_get_subscribed_sku(MS_PRODUCTS["MICROSOFT 365 F5 SECURITY + COMPLIANCE ADD-ON"], token)
+        sec_sku = skus.get(MS_PRODUCTS["MICROSOFT 365 F5 SECURITY + COMPLIANCE ADD-ON"], token)
         sec_consumed = sec_sku["consumedUnits"]
         sec_assignable = sec_sku["prepaidUnits"]["enabled"] + sec_sku["prepaidUnits"]["warning"]
         sec_available = sec_assignable - sec_consumed
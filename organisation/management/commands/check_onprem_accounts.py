@@ -3,10 +3,12 @@ from datetime import datetime, timezone
 
 from django.conf import settings
 from django.core.management.base import BaseCommand
+from django.db import transaction
 from sentry_sdk.crons import monitor
 
-from itassets.utils import get_blob_json
+from itassets.utils import iter_blob_json
 from organisation.models import DepartmentUser
+from organisation.utils import json_digest
 
 
 class Command(BaseCommand):
@@ -34,45 +36,70 @@ class Command(BaseCommand):
     def check_onprem_accounts(self, logger, container, blob):
         """Separate the body of this management command to allow running it in context with
         the Sentry monitor process.
+        The AD export is parsed as a stream of user objects and compared against indexes of cached onprem
+        AD GUID and email values, so that only department users with changed AD data are written (in batches,
+        within a single transaction). Changes are detected by comparing a digest of each AD user object with
+        the stored ad_data_hash.
         """
-        ad_users = get_blob_json(container=container, blob=blob)
+        # Index linked department users by onprem AD GUID (with the digest of their cached AD data),
+        # and unlinked department users by email.
+        linked_users = {}  # {ad_guid: (pk, digest)}
+        unlinked_users = {}  # {email: pk}
+        users = DepartmentUser.objects.values_list("pk", "ad_guid", "email", "ad_data_hash")
+        for pk, ad_guid, email, ad_data_hash in users.iterator(chunk_size=2000):
+            if ad_guid:
+                linked_users[ad_guid] = (pk, ad_data_hash)
+            else:
+                unlinked_users[email.lower()] = pk
 
-        if not ad_users:
-            logger.error("No on-prem AD user account data could be downloaded")
-            return
+        logger.info("Comparing Department Users to on-prem AD user accounts")
+        # The batched writes and the removal of invalid GUIDs are applied together, so that a failure
+        # partway through the export leaves no changes applied (and no GUIDs are removed on partial data).
+        with transaction.atomic():
+            now = datetime.now(timezone.utc)
+            valid_ad_guids = set()
+            changed_users = []
+            updated = 0
+            for ad in iter_blob_json(container=container, blob=blob):
+                valid_ad_guids.add(ad["ObjectGUID"])
+                if "EmailAddress" in ad and ad["EmailAddress"] and "-admin" in ad["EmailAddress"]:  # Skip admin users.
+                    continue
+                digest = json_digest(ad)
+                if ad["ObjectGUID"] in linked_users:
+                    # An existing department user is linked to this onprem AD user: skip it if the AD data is unchanged.
+                    pk, ad_data_hash = linked_users[ad["ObjectGUID"]]
+                    if digest == ad_data_hash:
+                        continue
+                elif "EmailAddress" in ad and ad["EmailAddress"] and ad["EmailAddress"].lower() in unlinked_users:
+                    # No current link to this onprem AD user; link the department user with a matching email.
+                    pk = unlinked_users.pop(ad["EmailAddress"].lower())
+                    logger.info(f"Linked existing department user {ad['EmailAddress'].lower()} with onprem AD object {ad['ObjectGUID']}")
+                else:
+                    continue
 
-        # Initially, check for any invalid onprem AD GUID values that are cached.
-        logger.info("Checking cached onprem AD GUID values")
-        valid_ad_guids = [i["ObjectGUID"] for i in ad_users]
-        cached_ad_guids = DepartmentUser.objects.filter(ad_guid__isnull=False).values_list("ad_guid", flat=True)
-        for guid in cached_ad_guids:
-            if guid not in valid_ad_guids:
-                du = DepartmentUser.objects.get(ad_guid=guid)
-                du.ad_guid = None
-                du.save()
-                logger.info(f"Removed invalid onprem AD GUID {guid} from department user {du}")
+                changed_users.append(
+                    DepartmentUser(pk=pk, ad_guid=ad["ObjectGUID"], ad_data=ad, ad_data_hash=digest, ad_data_updated=now, date_updated=now)
+                )
+                if len(changed_users) >= settings.ONPREM_AD_WRITE_BATCH_SIZE:
+                    updated += self.write_users(changed_users)
+                    changed_users = []
+            updated += self.write_users(changed_users)
 
-        logger.info("Comparing Department Users to on-prem AD user accounts")
-        for ad in ad_users:
-            # Skip admin accounts
-            if "EmailAddress" in ad and ad["EmailAddress"] and "-admin" in ad["EmailAddress"]:  # Skip admin users.
-                continue
-            if not DepartmentUser.objects.filter(ad_guid=ad["ObjectGUID"]).exists():
-                # No current link to this onprem AD user; try to find a match by email and link it.
-                if (
-                    "EmailAddress" in ad
-                    and ad["EmailAddress"]
-                    and DepartmentUser.objects.filter(ad_guid__isnull=True, email__istartswith=ad["EmailAddress"]).exists()
-                ):
-                    du = DepartmentUser.objects.get(email=ad["EmailAddress"].lower())
-                    du.ad_guid = ad["ObjectGUID"]
-                    du.ad_data = ad
-                    du.ad_data_updated = datetime.now(timezone.utc)
-                    du.save()
-                    logger.info(f"Linked existing department user {du} with onprem AD object {ad['ObjectGUID']}")
-            else:
-                # An existing department user is linked to this onprem AD user.
-                du = DepartmentUser.objects.get(ad_guid=ad["ObjectGUID"])
-                du.ad_data = ad
-                du.ad_data_updated = datetime.now(timezone.utc)
-                du.save()
+            if not valid_ad_guids:
+                logger.error("No on-prem AD user account data could be downloaded")
+                return
+
+            logger.info(f"Checked {len(valid_ad_guids)} on-prem AD user accounts, updated {updated} department users")
+
+            # Remove any cached onprem AD GUID values which are no longer valid.
+            logger.info("Checking cached onprem AD GUID values")
+            invalid_users = DepartmentUser.objects.filter(ad_guid__in=set(linked_users.keys()) - valid_ad_guids)
+            for guid, email in invalid_users.values_list("ad_guid", "email"):
+                logger.info(f"Removed invalid onprem AD GUID {guid} from department user {email}")
+            invalid_users.update(ad_guid=None, date_updated=now)
+
+    def write_users(self, users):
+        """Write the changed onprem AD fields for the passed-in department users, returning the number written."""
+        if users:
+            DepartmentUser.objects.bulk_update(users, ["ad_guid", "ad_data", "ad_data_hash", "ad_data_updated", "date_updated"])
+        return len(users)
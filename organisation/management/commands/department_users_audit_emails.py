@@ -3,7 +3,7 @@ import logging
 from django.core.management.base import BaseCommand
 
 from organisation.models import DepartmentUser
-from organisation.utils import ms_graph_list_users
+from organisation.utils import ms_graph_iter_users
 
 
 class Command(BaseCommand):
@@ -12,8 +12,12 @@ class Command(BaseCommand):
     def handle(self, *args, **options):
         logger = logging.getLogger("organisation")
         logger.info("Checking currently-recorded emails for department users against Entra ID")
-        entra_users = ms_graph_list_users()
-        entra_emails = [i["mail"].lower() for i in entra_users if i["mail"]]
+        # Stream only the mail property of each Entra ID user.
+        entra_emails = set(i["mail"] for i in ms_graph_iter_users(select="id,mail") if i["mail"])
+        if not entra_emails:
+            logger.error("Microsoft Graph API returned no data")
+            return
+
         du_emails = [
             i.lower()
             for i in DepartmentUser.objects.filter(email__iendswith="@dbca.wa.gov.au", active=False).values_list("email", flat=True)
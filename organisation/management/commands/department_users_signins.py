@@ -1,25 +1,27 @@
 import logging
 from datetime import datetime, timedelta, timezone
 
-import requests
 from dateutil.parser import parse
 from django.conf import settings
 from django.core.management.base import BaseCommand
 
+from itassets import graph
 from itassets.utils import ms_graph_client_token
-from organisation.models import DepartmentUser
+from organisation.models import DepartmentUser, SyncCheckpoint
 
 
 class Command(BaseCommand):
     help = "Query Entra ID sign-in audit logs and update last_signin property for DepartmentUser records"
+    # Name of the SyncCheckpoint used to persist the sign-in high-watermark between runs.
+    CHECKPOINT_NAME = "entra_id_signins"
 
     def add_arguments(self, parser):
         parser.add_argument(
             "--minutes",
             action="store",
-            default=5,
+            default=None,
             type=int,
-            help="Query successful interactive sign-ins for the previous number of minutes (default 5)",
+            help="Query successful interactive sign-ins for the previous number of minutes, instead of since the previous run",
             dest="minutes",
         )
         parser.add_argument(
@@ -39,12 +41,19 @@ class Command(BaseCommand):
         headers = {
             "Authorization": f"Bearer {token['access_token']}",
         }
-        # Filters: interactive logins, and within the previous n minutes.
-        minutes = options["minutes"]
-        t = datetime.now(timezone.utc) - timedelta(minutes=minutes)
+        # Query sign-ins from the latest sign-in processed by the previous run (the high-watermark).
+        # Sign-in events are sometimes recorded after a delay, so the query overlaps the previous
+        # run by SIGNIN_LOOKBACK_MINUTES; updates are idempotent, so this is harmless.
+        checkpoint = SyncCheckpoint.get_state(self.CHECKPOINT_NAME)
+        watermark = datetime.fromisoformat(checkpoint["watermark"]) if checkpoint.get("watermark") else None
+        if options["minutes"] or not watermark:
+            t = datetime.now(timezone.utc) - timedelta(minutes=options["minutes"] or 5)
+        else:
+            t = watermark - timedelta(minutes=settings.SIGNIN_LOOKBACK_MINUTES)
         ts = t.strftime("%Y-%m-%dT%H:%M:%SZ")
+        # Filters: interactive logins, and since the timestamp.
         params = {
-            "$orderby": "createdDateTime desc",
+            "$select": "userId,createdDateTime",
             "$filter": f"(isInteractive eq true and status/errorCode eq 0 and createdDateTime ge {ts})",
         }
         # Reference: https://learn.microsoft.com/en-us/graph/api/signin-list
@@ -53,26 +62,26 @@ class Command(BaseCommand):
         if log:
             logger.info(f"Querying user interactive sign-ins since {ts}")
 
-        resp = requests.get(url, headers=headers, params=params)
-        resp.raise_for_status()
-        j = resp.json()
-        signins = j["value"]
+        # Reduce the sign-in events to the latest sign-in for each user.
+        latest_signins = {}
+        for signin in graph.paginate(url, headers, params):
+            created = parse(signin["createdDateTime"])
+            if signin["userId"] not in latest_signins or created > latest_signins[signin["userId"]]:
+                latest_signins[signin["userId"]] = created
 
-        while "@odata.nextLink" in j:
-            resp = requests.get(j["@odata.nextLink"], headers=headers)
-            resp.raise_for_status()
-            j = resp.json()
-            signins.extend(j["value"])
-
-        for signin in signins:
-            try:
-                du = DepartmentUser.objects.get(azure_guid=signin["userId"])
-            except DepartmentUser.DoesNotExist:
-                continue
-
-            last_signin = parse(signin["createdDateTime"]).astimezone(settings.TZ)
+        # Update only those users whose latest sign-in has moved forward.
+        users = []
+        for du in DepartmentUser.objects.filter(azure_guid__in=latest_signins.keys()).only("pk", "azure_guid", "last_signin"):
+            last_signin = latest_signins[du.azure_guid].astimezone(settings.TZ)
             if not du.last_signin or last_signin > du.last_signin:
                 du.last_signin = last_signin
-                du.save()
-                if log:
-                    logger.info(f"Updated last_signin for {du} to {last_signin}")
+                users.append(du)
+        DepartmentUser.objects.bulk_update(users, ["last_signin"], batch_size=1000)
+
+        if log:
+            logger.info(f"Processed sign-ins for {len(latest_signins)} users, updated last_signin for {len(users)} department users")
+
+        if latest_signins:
+            latest = max(latest_signins.values())
+            if not watermark or latest > watermark:
+                SyncCheckpoint.set_state(self.CHECKPOINT_NAME, {"watermark": latest.isoformat()})
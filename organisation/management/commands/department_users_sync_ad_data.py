@@ -1,7 +1,9 @@
 from django.core.management.base import BaseCommand
 import logging
+from itassets import graph
 from itassets.utils import ms_graph_client_token
 from organisation.models import DepartmentUser
+from organisation.utils import OnpremChangeManifest
 
 
 class Command(BaseCommand):
@@ -19,7 +21,21 @@ class Command(BaseCommand):
         logger = logging.getLogger("organisation")
         logger.info("Checking department users for required changes to sync to AD")
         token = ms_graph_client_token()
+        # Changes to Entra ID accounts are sent in JSON batch requests, for many users at once.
+        batch = graph.GraphBatch(token) if token and "access_token" in token else None
+        # Changes to onprem AD accounts are uploaded together, as a change manifest for this run.
+        changes = OnpremChangeManifest()
 
         # Check all users, not just 'active' ones, otherwise we won't catch all changes.
-        for du in DepartmentUser.objects.all():
-            du.sync_ad_data(log_only=options["log_only"], token=token)
+        # Changes queued before any failure are still uploaded and sent.
+        try:
+            for du in DepartmentUser.objects.all():
+                du.sync_ad_data(log_only=options["log_only"], token=token, batch=batch, changes=changes)
+        finally:
+            changes.flush()
+            if changes.sequence:
+                logger.info(f"Queued {changes.sequence} onprem AD change(s) for sync run {changes.run_id}")
+
+            if batch:
+                batch.flush()
+                logger.info(f"Sent Entra ID account changes for {batch.group_count} user(s) in {batch.request_count} batch request(s)")
@@ -0,0 +1,90 @@
+import tracemalloc
+from io import StringIO
+from time import perf_counter
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from itassets.fake_graph import FakeGraphTenant, fake_graph
+from itassets.utils import humanise_bytes
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks the Entra ID sync jobs (check_azure_accounts, department_users_signins and "
+        "department_users_sync_ad_data) against a fake Microsoft Graph API serving a generated tenant, "
+        "reporting elapsed time, Graph requests, query counts and peak memory. Database changes are rolled back "
+        "and onprem AD changes are not uploaded to blob storage."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", action="store", type=int, default=1000, help="Number of users in the tenant (default 1000)")
+        parser.add_argument("--groups", action="store", type=int, default=100, help="Number of groups in the tenant (default 100)")
+        parser.add_argument(
+            "--signins", action="store", type=int, default=5000, help="Number of sign-in events in the previous hour (default 5000)"
+        )
+        parser.add_argument(
+            "--change-ratio",
+            action="store",
+            type=float,
+            default=0.01,
+            dest="change_ratio",
+            help="Proportion of users changed before the incremental check (default 0.01)",
+        )
+        parser.add_argument(
+            "--latency", action="store", type=float, default=0.0, help="Latency added to each Graph request, in milliseconds (default 0)"
+        )
+        parser.add_argument(
+            "--throttle-rate",
+            action="store",
+            type=float,
+            default=0.0,
+            dest="throttle_rate",
+            help="Proportion of Graph requests which are throttled (default 0)",
+        )
+        parser.add_argument("--seed", action="store", type=int, default=0, help="Random seed for the generated tenant (default 0)")
+
+    def measure(self, phase: str, server, func):
+        """Run `func`, recording the elapsed time, Graph API requests, Django queries and peak memory used."""
+        requests, throttled = sum(server.requests.values()), server.throttled
+        tracemalloc.reset_peak()
+        start = perf_counter()
+        with CaptureQueriesContext(connection) as queries:
+            func()
+        elapsed = perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        self.results.append((phase, elapsed, sum(server.requests.values()) - requests, server.throttled - throttled, len(queries), peak))
+
+    def handle(self, *args, **options):
+        self.results = []
+        tenant = FakeGraphTenant(
+            users=options["users"], groups=options["groups"], signins=options["signins"], signin_hours=1, seed=options["seed"]
+        )
+        out = StringIO()
+        tracemalloc.start()
+
+        # Don't report to Sentry, send email or upload onprem AD changes to blob storage while benchmarking.
+        with (
+            override_settings(SENTRY_CRON_CHECK_AZURE=None, EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend"),
+            patch("organisation.utils.upload_blob") as mock_upload_blob,
+            patch("organisation.utils.upload_blobs", return_value={}) as mock_upload_blobs,
+            fake_graph(tenant, latency=options["latency"] / 1000, throttle_rate=options["throttle_rate"], seed=options["seed"]) as server,
+            transaction.atomic(),
+        ):
+            self.measure("check_azure_accounts --full", server, lambda: call_command("check_azure_accounts", full=True, stdout=out))
+            tenant.modify_users(int(options["users"] * options["change_ratio"]))
+            self.measure("check_azure_accounts", server, lambda: call_command("check_azure_accounts", stdout=out))
+            self.measure("department_users_signins", server, lambda: call_command("department_users_signins", minutes=60, stdout=out))
+            self.measure("department_users_sync_ad_data", server, lambda: call_command("department_users_sync_ad_data", stdout=out))
+            transaction.set_rollback(True)
+
+        tracemalloc.stop()
+
+        self.stdout.write(f"{'Phase':<32}{'Seconds':>10}{'Requests':>10}{'Throttled':>11}{'Queries':>10}{'Peak memory':>14}")
+        for phase, elapsed, requests, throttled, queries, peak in self.results:
+            self.stdout.write(f"{phase:<32}{elapsed:>10.2f}{requests:>10}{throttled:>11}{queries:>10}{humanise_bytes(peak):>14}")
+        uploads = mock_upload_blob.call_count + sum(len(list(call.args[0])) for call in mock_upload_blobs.call_args_list)
+        self.stdout.write(f"Database changes rolled back, {uploads} onprem AD change blob upload(s) skipped")
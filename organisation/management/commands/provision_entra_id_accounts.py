@@ -0,0 +1,33 @@
+import logging
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from sentry_sdk.crons import monitor
+
+from organisation.ascender import advance_entra_id_provisioning_tasks
+
+
+class Command(BaseCommand):
+    help = "Carries out the next due steps for queued new Entra ID accounts (see check_ascender_accounts)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--max-seconds",
+            action="store",
+            type=int,
+            default=0,
+            dest="max_seconds",
+            help="Keep provisioning accounts as steps fall due, for up to this many seconds (default 0)",
+        )
+
+    def handle(self, *args, **options):
+        logger = logging.getLogger("organisation")
+        logger.info("Provisioning queued Entra ID accounts")
+        # Optionally run this management command in the context of a Sentry cron monitor.
+        if settings.SENTRY_CRON_PROVISION_ENTRA_ID:
+            logger.info(f"Applying Sentry Cron Monitor: {settings.SENTRY_CRON_PROVISION_ENTRA_ID}")
+            with monitor(monitor_slug=settings.SENTRY_CRON_PROVISION_ENTRA_ID):
+                remaining = advance_entra_id_provisioning_tasks(options["max_seconds"])
+        else:
+            remaining = advance_entra_id_provisioning_tasks(options["max_seconds"])
+        logger.info(f"Completed, {remaining} account(s) still in progress")
@@ -1,13 +1,20 @@
 from django.core.management.base import BaseCommand
 import logging
+from organisation.models import SyncCheckpoint
 from organisation.utils import ms_graph_site_storage_summary
 
 
 class Command(BaseCommand):
     help = "Generates a CSV containing SharePoint site storage usage and uploads it to blob storage"
+    # Name of the SyncCheckpoint used to persist resolved SharePoint site URLs between runs.
+    CHECKPOINT_NAME = "sharepoint_site_urls"
 
     def handle(self, *args, **options):
         logger = logging.getLogger("organisation")
         logger.info("Generating CSV of SharePoint site storage usage and uploading to blob storage")
-        ms_graph_site_storage_summary()
+        site_urls = SyncCheckpoint.get_state(self.CHECKPOINT_NAME).get("site_urls", {})
+        resolved = ms_graph_site_storage_summary(site_urls=site_urls)
+        if resolved is not None:
+            logger.info(f"Resolved {len(set(resolved) - set(site_urls))} new SharePoint site URL(s)")
+            SyncCheckpoint.set_state(self.CHECKPOINT_NAME, {"site_urls": resolved})
         logger.info("Completed")
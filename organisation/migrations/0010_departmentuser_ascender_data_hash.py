@@ -0,0 +1,18 @@
+# Generated by Django 5.2.14 on 2026-10-17 02:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('organisation', '0009_departmentuser_assigned_groups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='departmentuser',
+            name='ascender_data_hash',
+            field=models.CharField(blank=True, editable=False, help_text='Digest of the cached Ascender data, used to detect changes', max_length=64, null=True),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.14 on 2026-10-17 03:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('organisation', '0010_departmentuser_ascender_data_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EntraIdProvisioningTask',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('state', models.CharField(choices=[('pending', 'Pending'), ('created', 'Account created'), ('updated', 'Account updated'), ('manager_set', 'Manager set'), ('usage_location_confirmed', 'Usage location confirmed'), ('licensed', 'Licensed'), ('complete', 'Complete'), ('failed', 'Failed')], db_index=True, default='pending', editable=False, max_length=32)),
+                ('employee_id', models.CharField(db_index=True, editable=False, max_length=128)),
+                ('ascender_data', models.JSONField(default=dict, editable=False)),
+                ('job_start_date', models.DateField(editable=False)),
+                ('licence_type', models.CharField(editable=False, max_length=32)),
+                ('position_no', models.CharField(blank=True, editable=False, max_length=128, null=True)),
+                ('email', models.EmailField(blank=True, editable=False, max_length=254, null=True)),
+                ('mail_nickname', models.CharField(blank=True, editable=False, max_length=128, null=True)),
+                ('display_name', models.CharField(blank=True, editable=False, max_length=128, null=True)),
+                ('title', models.CharField(blank=True, editable=False, max_length=128, null=True)),
+                ('azure_guid', models.CharField(blank=True, editable=False, max_length=48, null=True)),
+                ('attempts', models.PositiveIntegerField(default=0, editable=False, help_text='Failed attempts at the current step')),
+                ('next_attempt_at', models.DateTimeField(db_index=True, editable=False, help_text='When the next step is due')),
+                ('last_error', models.TextField(blank=True, editable=False, null=True)),
+                ('cost_centre', models.ForeignKey(editable=False, on_delete=django.db.models.deletion.PROTECT, to='organisation.costcentre')),
+                ('department_user', models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='organisation.departmentuser')),
+                ('location', models.ForeignKey(editable=False, on_delete=django.db.models.deletion.PROTECT, to='organisation.location')),
+                ('manager', models.ForeignKey(editable=False, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='organisation.departmentuser')),
+            ],
+            options={
+                'ordering': ('-created',),
+            },
+        ),
+    ]
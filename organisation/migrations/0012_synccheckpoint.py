@@ -0,0 +1,25 @@
+# Generated by Django 5.2.14 on 2026-10-17 05:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('organisation', '0011_entraidprovisioningtask'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncCheckpoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(editable=False, max_length=64, unique=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('state', models.JSONField(default=dict, editable=False)),
+            ],
+            options={
+                'ordering': ('name',),
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.14 on 2026-10-17 07:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('organisation', '0012_synccheckpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='departmentuser',
+            name='ad_data_hash',
+            field=models.CharField(blank=True, editable=False, help_text='Digest of the cached on-premise AD data, used to detect changes', max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='departmentuser',
+            name='azure_ad_data_hash',
+            field=models.CharField(blank=True, editable=False, help_text='Digest of the cached Entra ID data, used to detect changes', max_length=64, null=True),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.14 on 2026-10-17 09:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('organisation', '0013_departmentuser_ad_data_hash_azure_ad_data_hash'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='entraidprovisioningtask',
+            name='cost_centre',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to='organisation.costcentre'),
+        ),
+        migrations.AlterField(
+            model_name='entraidprovisioningtask',
+            name='location',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to='organisation.location'),
+        ),
+        migrations.AlterField(
+            model_name='entraidprovisioningtask',
+            name='manager',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='organisation.departmentuser'),
+        ),
+    ]
@@ -1,19 +1,17 @@
-import json
 import logging
 from datetime import date, datetime, timedelta
-from io import BytesIO
-from typing import Optional
+from typing import Dict, Optional
 
-import requests
 from dateutil.parser import parse
 from django.conf import settings
 from django.contrib.gis.db import models
 from django.contrib.postgres.fields import ArrayField
 
-from itassets.utils import ms_graph_client_token, smart_truncate, upload_blob
+from itassets import graph
+from itassets.utils import ms_graph_client_token, smart_truncate
 
 from .microsoft_products import MS_PRODUCTS
-from .utils import compare_values, ms_graph_get_user, parse_ad_pwd_last_set, parse_windows_ts, title_except
+from .utils import OnpremChangeManifest, compare_values, ms_graph_get_user, parse_ad_pwd_last_set, parse_windows_ts, title_except
 
 LOGGER = logging.getLogger("organisation")
 
@@ -40,6 +38,8 @@ class DepartmentUser(models.Model):
         9,  # Role-based
         14,  # Unknown, disabled
     ]
+    # Fields which may be changed by the set_derived_fields method.
+    DERIVED_FIELDS = ["employee_id", "account_type", "telephone", "mobile_phone"]
     # Hard-coded mapping of Entra security group object IDs to human-readable descriptions.
     COPILOT_GROUPS = {
         "0fd74638-f7d9-48ae-b570-833e988c3adf": "sg-oim-app-copilot-eval",
@@ -166,6 +166,13 @@ class DepartmentUser(models.Model):
         editable=False,
         help_text="Timestamp of when Ascender data was last updated for this user",
     )
+    ascender_data_hash = models.CharField(
+        max_length=64,
+        null=True,
+        blank=True,
+        editable=False,
+        help_text="Digest of the cached Ascender data, used to detect changes",
+    )
     position_no = models.CharField(
         max_length=128,
         null=True,
@@ -191,6 +198,13 @@ class DepartmentUser(models.Model):
         help_text="Cache of on-premise AD data",
     )
     ad_data_updated = models.DateTimeField(null=True, editable=False)
+    ad_data_hash = models.CharField(
+        max_length=64,
+        null=True,
+        blank=True,
+        editable=False,
+        help_text="Digest of the cached on-premise AD data, used to detect changes",
+    )
 
     # Azure Entra ID data
     azure_guid = models.CharField(
@@ -209,6 +223,13 @@ class DepartmentUser(models.Model):
         help_text="Cache of Entra ID data",
     )
     azure_ad_data_updated = models.DateTimeField(null=True, editable=False)
+    azure_ad_data_hash = models.CharField(
+        max_length=64,
+        null=True,
+        blank=True,
+        editable=False,
+        help_text="Digest of the cached Entra ID data, used to detect changes",
+    )
     dir_sync_enabled = models.BooleanField(null=True, default=None, help_text="Entra ID account is synced to on-prem Active Directory")
     last_signin = models.DateTimeField(null=True, editable=False, help_text="Entra ID last sign-in time")
     last_password_change = models.DateTimeField(
@@ -226,6 +247,13 @@ class DepartmentUser(models.Model):
 
     def save(self, *args, **kwargs):
         """Override the save method with additional business logic."""
+        self.set_derived_fields()
+        super(DepartmentUser, self).save(*args, **kwargs)
+
+    def set_derived_fields(self):
+        """Business logic to clean or derive field values prior to saving this object.
+        Fields which may be changed are listed in DERIVED_FIELDS.
+        """
         if self.employee_id:
             if (self.employee_id.lower() == "n/a") or (self.employee_id.strip() == ""):
                 self.employee_id = None
@@ -247,7 +275,6 @@ class DepartmentUser(models.Model):
             self.telephone = self.telephone.strip()
         if self.mobile_phone:
             self.mobile_phone = self.mobile_phone.strip()
-        super(DepartmentUser, self).save(*args, **kwargs)
 
     def get_licence(self) -> Optional[str]:
         """Return Microsoft 365 licence description consistent with other OIM communications."""
@@ -468,18 +495,46 @@ class DepartmentUser(models.Model):
 
         return None
 
-    def sync_ad_data(self, container: str = "azuread", log_only: bool = False, token: dict = {}):
+    def sync_ad_data(self, container: str = "azuread", log_only: bool = False, token: dict = {}, batch=None, changes=None):
         """For this DepartmentUser, iterate through fields which need to be synced between IT Assets
         and external AD databases (Entra ID, onprem AD).
         Each field has a 'source of truth'. In each case, check the source of truth and make changes
         to the required databases.
         If `log_only` is True, do not schedule changes to AD databases (output logs only).
+        Changes to an Entra ID account are sent in a single JSON batch request. Optionally pass in a
+        GraphBatch object to queue the changes on it instead, to be sent along with other users' changes.
+        Changes to an onprem AD account are uploaded to blob storage (in `container`) for the onprem
+        sync process. Optionally pass in an OnpremChangeManifest to queue the changes on it instead,
+        to be uploaded along with other users' changes from the same sync run.
         """
         if not token:
             token = ms_graph_client_token()
-        url = f"https://graph.microsoft.com/v1.0/users/{self.azure_guid}"
         acct = "onprem" if (self.ad_guid and self.ad_data and self.dir_sync_enabled) else "cloud"
         today = datetime.today().replace(hour=0, minute=0, second=0, microsecond=0)  # We need a datetime object.
+        flush_changes = changes is None
+        if flush_changes:
+            changes = OnpremChangeManifest(container)
+
+        # Changes to an Entra ID (cloud only) account are collected and sent together, after all fields
+        # are checked: property changes are merged into a single PATCH request, plus any other requests.
+        entra_id_patch = {}
+        entra_id_requests = {}
+        entra_id_logs = {}  # {request id: [log messages]}
+        revoke_request = {
+            "id": "revoke",
+            "method": "POST",
+            "url": f"/users/{self.azure_guid}/revokeSignInSessions",
+            "dependsOn": ["patch"],
+        }
+
+        def entra_id_change(data: dict, *logs: str):
+            entra_id_patch.update(data)
+            entra_id_logs.setdefault("patch", []).extend(logs)
+
+        def entra_id_request(request: dict, log: str):
+            if request["id"] not in entra_id_requests:
+                entra_id_requests[request["id"]] = request
+                entra_id_logs[request["id"]] = [log]
 
         # active (source of truth: Ascender).
         # This also includes Cloud-licenced users, which don't have an "expiry date".
@@ -507,31 +562,20 @@ class DepartmentUser(models.Model):
                         "property": prop,
                         "value": False,
                     }
-                    f = BytesIO()
-                    f.write(json.dumps(change, indent=2).encode("utf-8"))
-                    f.seek(0)
                     if not log_only and settings.ASCENDER_DEACTIVATE_EXPIRED:  # Defaults as False, must be explicitly set True.
-                        blob = f"onprem_changes/{self.ad_guid}_{prop}.json"
-                        upload_blob(f, container, blob)
-                        LOGGER.info(f"AD SYNC: {self} onprem AD change diff uploaded to blob storage ({prop})")
+                        changes.add(change)
+                        LOGGER.info(f"AD SYNC: {self} onprem AD change diff queued for upload to blob storage ({prop})")
                     else:
                         LOGGER.info("NO ACTION (log only)")
 
                 # Cloud users.
                 elif not self.dir_sync_enabled and self.azure_guid and self.azure_ad_data:
                     if token:
-                        headers = {
-                            "Authorization": f"Bearer {token['access_token']}",
-                            "Content-Type": "application/json",
-                        }
                         data = {"accountEnabled": False}
                         if not log_only and settings.ASCENDER_DEACTIVATE_EXPIRED:
-                            requests.patch(url, headers=headers, json=data)
-                            LOGGER.info(f"AZURE SYNC: {self} Entra ID account accountEnabled set to False")
-                            # Revoke cloud user sessions.
-                            revoke_url = f"https://graph.microsoft.com/v1.0/users/{self.azure_guid}/revokeSignInSessions"
-                            requests.post(revoke_url, headers=headers)
-                            LOGGER.info(f"AZURE SYNC: {self} Entra ID account user sessions revoked")
+                            entra_id_change(data, f"AZURE SYNC: {self} Entra ID account accountEnabled set to False")
+                            # Revoke cloud user sessions (after the account is disabled).
+                            entra_id_request(revoke_request, f"AZURE SYNC: {self} Entra ID account user sessions revoked")
                         else:
                             LOGGER.info("NO ACTION (log only)")
 
@@ -553,31 +597,20 @@ class DepartmentUser(models.Model):
                     "property": prop,
                     "value": False,
                 }
-                f = BytesIO()
-                f.write(json.dumps(change, indent=2).encode("utf-8"))
-                f.seek(0)
                 if not log_only and settings.DORMANT_ACCOUNT_DEACTIVATE:  # Defaults as False, must be explicitly set True.
-                    blob = f"onprem_changes/{self.ad_guid}_{prop}.json"
-                    upload_blob(f, container, blob)
-                    LOGGER.info(f"AD SYNC: {self} onprem AD change diff uploaded to blob storage ({prop})")
+                    changes.add(change)
+                    LOGGER.info(f"AD SYNC: {self} onprem AD change diff queued for upload to blob storage ({prop})")
                 else:
                     LOGGER.info("NO ACTION (log only)")
 
             # Cloud users.
             elif not self.dir_sync_enabled and self.azure_guid and self.azure_ad_data:
                 if token:
-                    headers = {
-                        "Authorization": f"Bearer {token['access_token']}",
-                        "Content-Type": "application/json",
-                    }
                     data = {"accountEnabled": False}
                     if not log_only and settings.DORMANT_ACCOUNT_DEACTIVATE:
-                        requests.patch(url, headers=headers, json=data)
-                        LOGGER.info(f"AZURE SYNC: {self} Entra ID account accountEnabled set to False")
-                        # Revoke cloud user sessions.
-                        revoke_url = f"https://graph.microsoft.com/v1.0/users/{self.azure_guid}/revokeSignInSessions"
-                        requests.post(revoke_url, headers=headers)
-                        LOGGER.info(f"AZURE SYNC: {self} Entra ID account user sessions revoked")
+                        entra_id_change(data, f"AZURE SYNC: {self} Entra ID account accountEnabled set to False")
+                        # Revoke cloud user sessions (after the account is disabled).
+                        entra_id_request(revoke_request, f"AZURE SYNC: {self} Entra ID account user sessions revoked")
                     else:
                         LOGGER.info("NO ACTION (log only)")
 
@@ -610,13 +643,9 @@ class DepartmentUser(models.Model):
                     "property": prop,
                     "value": job_end_date.strftime("%m/%d/%Y"),
                 }
-                f = BytesIO()
-                f.write(json.dumps(change, indent=2).encode("utf-8"))
-                f.seek(0)
                 if not log_only:
-                    blob = f"onprem_changes/{self.ad_guid}_{prop}.json"
-                    upload_blob(f, container, blob)
-                    LOGGER.info(f"AD SYNC: {self} onprem AD change diff uploaded to blob storage ({prop})")
+                    changes.add(change)
+                    LOGGER.info(f"AD SYNC: {self} onprem AD change diff queued for upload to blob storage ({prop})")
                 else:
                     LOGGER.info("NO ACTION (log only)")
 
@@ -655,13 +684,9 @@ class DepartmentUser(models.Model):
                     "property": prop,
                     "value": None,
                 }
-                f = BytesIO()
-                f.write(json.dumps(change, indent=2).encode("utf-8"))
-                f.seek(0)
                 if not log_only:
-                    blob = f"onprem_changes/{self.ad_guid}_{prop}.json"
-                    upload_blob(f, container, blob)
-                    LOGGER.info(f"AD SYNC: {self} onprem AD change diff uploaded to blob storage ({prop})")
+                    changes.add(change)
+                    LOGGER.info(f"AD SYNC: {self} onprem AD change diff queued for upload to blob storage ({prop})")
                 else:
                     LOGGER.info("NO ACTION (log only)")
 
@@ -692,13 +717,9 @@ class DepartmentUser(models.Model):
                 "property": prop,
                 "value": self.name,
             }
-            f = BytesIO()
-            f.write(json.dumps(change, indent=2).encode("utf-8"))
-            f.seek(0)
             if not log_only:
-                blob = f"onprem_changes/{self.ad_guid}_{prop}.json"
-                upload_blob(f, container, blob)
-                LOGGER.info(f"AD SYNC: {self} onprem AD change diff uploaded to blob storage ({prop})")
+                changes.add(change)
+                LOGGER.info(f"AD SYNC: {self} onprem AD change diff queued for upload to blob storage ({prop})")
             else:
                 LOGGER.info("NO ACTION (log only)")
         # Azure (cloud only) AD users.
@@ -710,14 +731,9 @@ class DepartmentUser(models.Model):
             and self.azure_ad_data["displayName"] != self.name
         ):
             if token:
-                headers = {
-                    "Authorization": f"Bearer {token['access_token']}",
-                    "Content-Type": "application/json",
-                }
                 data = {"displayName": self.name}
                 if not log_only:
-                    requests.patch(url, headers=headers, json=data)
-                    LOGGER.info(f"ENTRA ID SYNC: {self} Entra ID account displayName set to {self.name}")
+                    entra_id_change(data, f"ENTRA ID SYNC: {self} Entra ID account displayName set to {self.name}")
                 else:
                     LOGGER.info("NO ACTION (log only)")
 
@@ -745,13 +761,9 @@ class DepartmentUser(models.Model):
                 "property": prop,
                 "value": given_name,
             }
-            f = BytesIO()
-            f.write(json.dumps(change, indent=2).encode("utf-8"))
-            f.seek(0)
             if not log_only:
-                blob = f"onprem_changes/{self.ad_guid}_{prop}.json"
-                upload_blob(f, container, blob)
-                LOGGER.info(f"AD SYNC: {self} onprem AD change diff uploaded to blob storage ({prop})")
+                changes.add(change)
+                LOGGER.info(f"AD SYNC: {self} onprem AD change diff queued for upload to blob storage ({prop})")
             else:
                 LOGGER.info("NO ACTION (log only)")
         # Azure (cloud only) AD users.
@@ -763,14 +775,9 @@ class DepartmentUser(models.Model):
             and self.azure_ad_data["givenName"] != given_name
         ):
             if token:
-                headers = {
-                    "Authorization": f"Bearer {token['access_token']}",
-                    "Content-Type": "application/json",
-                }
                 data = {"givenName": given_name}
                 if not log_only:
-                    requests.patch(url, headers=headers, json=data)
-                    LOGGER.info(f"ENTRA ID SYNC: {self} Entra ID account givenName set to {given_name}")
+                    entra_id_change(data, f"ENTRA ID SYNC: {self} Entra ID account givenName set to {given_name}")
                 else:
                     LOGGER.info("NO ACTION (log only)")
 
@@ -789,13 +796,9 @@ class DepartmentUser(models.Model):
                 "property": prop,
                 "value": self.surname,
             }
-            f = BytesIO()
-            f.write(json.dumps(change, indent=2).encode("utf-8"))
-            f.seek(0)
             if not log_only:
-                blob = f"onprem_changes/{self.ad_guid}_{prop}.json"
-                upload_blob(f, container, blob)
-                LOGGER.info(f"AD SYNC: {self} onprem AD change diff uploaded to blob storage ({prop})")
+                changes.add(change)
+                LOGGER.info(f"AD SYNC: {self} onprem AD change diff queued for upload to blob storage ({prop})")
             else:
                 LOGGER.info("NO ACTION (log only)")
         # Azure (cloud only) AD users.
@@ -807,14 +810,9 @@ class DepartmentUser(models.Model):
             and self.azure_ad_data["surname"] != self.surname
         ):
             if token:
-                headers = {
-                    "Authorization": f"Bearer {token['access_token']}",
-                    "Content-Type": "application/json",
-                }
                 data = {"surname": self.surname}
                 if not log_only:
-                    requests.patch(url, headers=headers, json=data)
-                    LOGGER.info(f"ENTRA ID SYNC: {self} Entra ID account surname set to {self.surname}")
+                    entra_id_change(data, f"ENTRA ID SYNC: {self} Entra ID account surname set to {self.surname}")
                 else:
                     LOGGER.info("NO ACTION (log only)")
 
@@ -834,13 +832,9 @@ class DepartmentUser(models.Model):
                 "property": prop,
                 "value": self.cost_centre.code,
             }
-            f = BytesIO()
-            f.write(json.dumps(change, indent=2).encode("utf-8"))
-            f.seek(0)
             if not log_only:
-                blob = f"onprem_changes/{self.ad_guid}_{prop}.json"
-                upload_blob(f, container, blob)
-                LOGGER.info(f"AD SYNC: {self} onprem AD change diff uploaded to blob storage ({prop})")
+                changes.add(change)
+                LOGGER.info(f"AD SYNC: {self} onprem AD change diff queued for upload to blob storage ({prop})")
             else:
                 LOGGER.info("NO ACTION (log only)")
         # Azure (cloud only) AD users. Update the user account directly using the MS Graph API.
@@ -854,14 +848,9 @@ class DepartmentUser(models.Model):
             and self.azure_ad_data["companyName"] != self.cost_centre.code
         ):
             if token:
-                headers = {
-                    "Authorization": f"Bearer {token['access_token']}",
-                    "Content-Type": "application/json",
-                }
                 data = {"companyName": self.cost_centre.code}
                 if not log_only:
-                    requests.patch(url, headers=headers, json=data)
-                    LOGGER.info(f"AZURE SYNC: {self} Entra ID account companyName set to {self.cost_centre.code}")
+                    entra_id_change(data, f"AZURE SYNC: {self} Entra ID account companyName set to {self.cost_centre.code}")
                 else:
                     LOGGER.info("NO ACTION (log only)")
 
@@ -881,13 +870,9 @@ class DepartmentUser(models.Model):
                 "property": prop,
                 "value": self.get_business_unit(),
             }
-            f = BytesIO()
-            f.write(json.dumps(change, indent=2).encode("utf-8"))
-            f.seek(0)
             if not log_only:
-                blob = f"onprem_changes/{self.ad_guid}_{prop}.json"
-                upload_blob(f, container, blob)
-                LOGGER.info(f"AD SYNC: {self} onprem AD change diff uploaded to blob storage ({prop})")
+                changes.add(change)
+                LOGGER.info(f"AD SYNC: {self} onprem AD change diff queued for upload to blob storage ({prop})")
             else:
                 LOGGER.info("NO ACTION (log only)")
         # Azure (cloud only) AD users.
@@ -900,14 +885,9 @@ class DepartmentUser(models.Model):
             and self.azure_ad_data["department"] != self.get_business_unit()
         ):
             if token:
-                headers = {
-                    "Authorization": f"Bearer {token['access_token']}",
-                    "Content-Type": "application/json",
-                }
                 data = {"department": self.get_business_unit()}
                 if not log_only:
-                    requests.patch(url, headers=headers, json=data)
-                    LOGGER.info(f"AZURE SYNC: {self} Entra ID account department set to {self.get_business_unit()}")
+                    entra_id_change(data, f"AZURE SYNC: {self} Entra ID account department set to {self.get_business_unit()}")
                 else:
                     LOGGER.info("NO ACTION (log only)")
 
@@ -920,13 +900,9 @@ class DepartmentUser(models.Model):
                 "property": prop,
                 "value": self.title,
             }
-            f = BytesIO()
-            f.write(json.dumps(change, indent=2).encode("utf-8"))
-            f.seek(0)
             if not log_only:
-                blob = f"onprem_changes/{self.ad_guid}_{prop}.json"
-                upload_blob(f, container, blob)
-                LOGGER.info(f"AD SYNC: {self} onprem AD change diff uploaded to blob storage ({prop})")
+                changes.add(change)
+                LOGGER.info(f"AD SYNC: {self} onprem AD change diff queued for upload to blob storage ({prop})")
             else:
                 LOGGER.info("NO ACTION (log only)")
         # Azure (cloud only) AD users.
@@ -938,14 +914,9 @@ class DepartmentUser(models.Model):
             and self.azure_ad_data["jobTitle"] != self.title
         ):
             if token:
-                headers = {
-                    "Authorization": f"Bearer {token['access_token']}",
-                    "Content-Type": "application/json",
-                }
                 data = {"jobTitle": self.title}
                 if not log_only:
-                    requests.patch(url, headers=headers, json=data)
-                    LOGGER.info(f"ENTRA ID SYNC: {self} Entra ID account jobTitle set to {self.title}")
+                    entra_id_change(data, f"ENTRA ID SYNC: {self} Entra ID account jobTitle set to {self.title}")
                 else:
                     LOGGER.info("NO ACTION (log only)")
 
@@ -961,13 +932,9 @@ class DepartmentUser(models.Model):
                     "property": prop,
                     "value": self.telephone,
                 }
-                f = BytesIO()
-                f.write(json.dumps(change, indent=2).encode("utf-8"))
-                f.seek(0)
                 if not log_only:
-                    blob = f"onprem_changes/{self.ad_guid}_{prop}.json"
-                    upload_blob(f, container, blob)
-                    LOGGER.info(f"AD SYNC: {self} onprem AD change diff uploaded to blob storage ({prop})")
+                    changes.add(change)
+                    LOGGER.info(f"AD SYNC: {self} onprem AD change diff queued for upload to blob storage ({prop})")
                 else:
                     LOGGER.info("NO ACTION (log only)")
         # Azure (cloud only) AD users
@@ -976,14 +943,9 @@ class DepartmentUser(models.Model):
                 self.azure_ad_data["telephoneNumber"] and not compare_values(self.azure_ad_data["telephoneNumber"].strip(), self.telephone)
             ) or (self.telephone and not self.azure_ad_data["telephoneNumber"]):
                 if token:
-                    headers = {
-                        "Authorization": f"Bearer {token['access_token']}",
-                        "Content-Type": "application/json",
-                    }
                     data = {"businessPhones": [self.telephone if self.telephone else " "]}
                     if not log_only:
-                        requests.patch(url, headers=headers, json=data)
-                        LOGGER.info(f"ENTRA ID SYNC: {self} Entra ID account telephoneNumber set to {self.telephone}")
+                        entra_id_change(data, f"ENTRA ID SYNC: {self} Entra ID account telephoneNumber set to {self.telephone}")
                     else:
                         LOGGER.info("NO ACTION (log only)")
 
@@ -999,13 +961,9 @@ class DepartmentUser(models.Model):
                     "property": prop,
                     "value": self.mobile_phone,
                 }
-                f = BytesIO()
-                f.write(json.dumps(change, indent=2).encode("utf-8"))
-                f.seek(0)
                 if not log_only:
-                    blob = f"onprem_changes/{self.ad_guid}_{prop}.json"
-                    upload_blob(f, container, blob)
-                    LOGGER.info(f"AD SYNC: {self} onprem AD change diff uploaded to blob storage ({prop})")
+                    changes.add(change)
+                    LOGGER.info(f"AD SYNC: {self} onprem AD change diff queued for upload to blob storage ({prop})")
                 else:
                     LOGGER.info("NO ACTION (log only)")
         # Azure (cloud only) AD users
@@ -1014,14 +972,9 @@ class DepartmentUser(models.Model):
                 self.mobile_phone and not self.azure_ad_data["mobilePhone"]
             ):
                 if token:
-                    headers = {
-                        "Authorization": f"Bearer {token['access_token']}",
-                        "Content-Type": "application/json",
-                    }
                     data = {"mobilePhone": self.mobile_phone}
                     if not log_only:
-                        requests.patch(url, headers=headers, json=data)
-                        LOGGER.info(f"ENTRA ID SYNC: {self} Entra ID account mobilePhone set to {self.mobile_phone}")
+                        entra_id_change(data, f"ENTRA ID SYNC: {self} Entra ID account mobilePhone set to {self.mobile_phone}")
                     else:
                         LOGGER.info("NO ACTION (log only)")
 
@@ -1040,13 +993,9 @@ class DepartmentUser(models.Model):
                 "property": prop,
                 "value": self.employee_id,
             }
-            f = BytesIO()
-            f.write(json.dumps(change, indent=2).encode("utf-8"))
-            f.seek(0)
             if not log_only:
-                blob = f"onprem_changes/{self.ad_guid}_{prop}.json"
-                upload_blob(f, container, blob)
-                LOGGER.info(f"AD SYNC: {self} onprem AD change diff uploaded to blob storage ({prop})")
+                changes.add(change)
+                LOGGER.info(f"AD SYNC: {self} onprem AD change diff queued for upload to blob storage ({prop})")
             else:
                 LOGGER.info("NO ACTION (log only)")
         # Azure (cloud only) AD users
@@ -1058,14 +1007,9 @@ class DepartmentUser(models.Model):
             and self.azure_ad_data["employeeId"] != self.employee_id
         ):
             if token:
-                headers = {
-                    "Authorization": f"Bearer {token['access_token']}",
-                    "Content-Type": "application/json",
-                }
                 data = {"employeeId": self.employee_id}
                 if not log_only:
-                    requests.patch(url, headers=headers, json=data)
-                    LOGGER.info(f"ENTRA ID SYNC: {self} Entra ID account employeeId set to {self.employee_id}")
+                    entra_id_change(data, f"ENTRA ID SYNC: {self} Entra ID account employeeId set to {self.employee_id}")
                 else:
                     LOGGER.info("NO ACTION (log only)")
 
@@ -1092,13 +1036,9 @@ class DepartmentUser(models.Model):
                     "property": prop,
                     "value": self.manager.ad_guid if self.manager else None,
                 }
-                f = BytesIO()
-                f.write(json.dumps(change, indent=2).encode("utf-8"))
-                f.seek(0)
                 if not log_only:
-                    blob = f"onprem_changes/{self.ad_guid}_{prop}.json"
-                    upload_blob(f, container, blob)
-                    LOGGER.info(f"AD SYNC: {self} onprem AD change diff uploaded to blob storage ({prop})")
+                    changes.add(change)
+                    LOGGER.info(f"AD SYNC: {self} onprem AD change diff queued for upload to blob storage ({prop})")
                 else:
                     LOGGER.info("NO ACTION (log only)")
         # Azure (cloud only) AD users
@@ -1112,15 +1052,16 @@ class DepartmentUser(models.Model):
 
             if self.manager and self.manager.azure_guid and self.manager != manager_ad:
                 if token:
-                    headers = {
-                        "Authorization": f"Bearer {token['access_token']}",
-                        "Content-Type": "application/json",
-                    }
-                    manager_url = f"https://graph.microsoft.com/v1.0/users/{self.azure_guid}/manager/$ref"
                     data = {"@odata.id": f"https://graph.microsoft.com/v1.0/users/{self.manager.azure_guid}"}
+                    manager_request = {
+                        "id": "manager",
+                        "method": "PUT",
+                        "url": f"/users/{self.azure_guid}/manager/$ref",
+                        "headers": {"Content-Type": "application/json"},
+                        "body": data,
+                    }
                     if not log_only:
-                        requests.put(manager_url, headers=headers, json=data)
-                        LOGGER.info(f"ENTRA ID SYNC: {self} Entra ID account manager set to {self.manager}")
+                        entra_id_request(manager_request, f"ENTRA ID SYNC: {self} Entra ID account manager set to {self.manager}")
                     else:
                         LOGGER.info("NO ACTION (log only)")
 
@@ -1154,13 +1095,9 @@ class DepartmentUser(models.Model):
                     "property": prop,
                     "value": ascender_location.name,
                 }
-                f = BytesIO()
-                f.write(json.dumps(change, indent=2).encode("utf-8"))
-                f.seek(0)
                 if not log_only:
-                    blob = f"onprem_changes/{self.ad_guid}_{prop}.json"
-                    upload_blob(f, container, blob)
-                    LOGGER.info(f"AD SYNC: {self} onprem AD change diff uploaded to blob storage ({prop})")
+                    changes.add(change)
+                    LOGGER.info(f"AD SYNC: {self} onprem AD change diff queued for upload to blob storage ({prop})")
                 else:
                     LOGGER.info("NO ACTION (log only)")
                 prop = "StreetAddress"
@@ -1169,13 +1106,9 @@ class DepartmentUser(models.Model):
                     "property": prop,
                     "value": ascender_location.address,
                 }
-                f = BytesIO()
-                f.write(json.dumps(change, indent=2).encode("utf-8"))
-                f.seek(0)
                 if not log_only:
-                    blob = f"onprem_changes/{self.ad_guid}_{prop}.json"
-                    upload_blob(f, container, blob)
-                    LOGGER.info(f"AD SYNC: {self} onprem AD change diff uploaded to blob storage ({prop})")
+                    changes.add(change)
+                    LOGGER.info(f"AD SYNC: {self} onprem AD change diff queued for upload to blob storage ({prop})")
                 else:
                     LOGGER.info("NO ACTION (log only)")
         # Azure (cloud only) AD users
@@ -1199,27 +1132,76 @@ class DepartmentUser(models.Model):
             if ascender_location and ascender_location != ad_location:
                 # Update both officeLocation and streetAddress in Entra ID.
                 if token:
-                    headers = {
-                        "Authorization": f"Bearer {token['access_token']}",
-                        "Content-Type": "application/json",
-                    }
                     data = {
                         "officeLocation": ascender_location.name,
                         "streetAddress": ascender_location.address,
                     }
                     if not log_only:
-                        requests.patch(url, headers=headers, json=data)
-                        LOGGER.info(f"ENTRA ID SYNC: {self} Entra ID account officeLocation set to {ascender_location.name}")
-                        LOGGER.info(f"ENTRA ID SYNC: {self} Entra ID account streetAddress set to {ascender_location.address}")
+                        entra_id_change(
+                            data,
+                            f"ENTRA ID SYNC: {self} Entra ID account officeLocation set to {ascender_location.name}",
+                            f"ENTRA ID SYNC: {self} Entra ID account streetAddress set to {ascender_location.address}",
+                        )
                     else:
                         LOGGER.info("NO ACTION (log only)")
 
-    def update_from_ascender_data(self):
+        if flush_changes:
+            changes.flush()
+
+        if token and (entra_id_patch or entra_id_requests):
+            requests = []
+            if entra_id_patch:
+                requests.append(
+                    {
+                        "id": "patch",
+                        "method": "PATCH",
+                        "url": f"/users/{self.azure_guid}",
+                        "headers": {"Content-Type": "application/json"},
+                        "body": entra_id_patch,
+                    }
+                )
+            requests += entra_id_requests.values()
+
+            def log_response(request_id: str, response: Optional[dict]):
+                # Map the response for each request back to its log messages.
+                for log in entra_id_logs[request_id]:
+                    if response and 200 <= response["status"] < 300:
+                        LOGGER.info(log)
+                    else:
+                        status = response["status"] if response else "N/A"
+                        error = response.get("body", {}).get("error", {}).get("message") if response else None
+                        LOGGER.warning(f"{log} FAILED (status {status}: {error})")
+
+            if batch is not None:
+                batch.add(requests, callback=log_response)
+            else:
+                batch = graph.GraphBatch(token)
+                batch.add(requests, callback=log_response)
+                batch.flush()
+
+    def update_from_ascender_data(self, index=None, writer=None) -> set:
         """For this DepartmentUser object, update the field values from cached Ascender data
         (the source of truth for these values).
+        Optionally pass in a loaded AscenderSyncIndex to avoid querying the database for lookups.
+        Optionally pass in an AscenderSyncWriter to queue log objects for a batched write; in that
+        case, save() is not called and the caller is responsible for queuing this object.
+        Returns the set of changed field names.
         """
+        changed = set()
         if not self.employee_id or not self.ascender_data:
-            return
+            return changed
+
+        if index is None:
+            from organisation.ascender import AscenderSyncIndex  # Prevent circular import.
+
+            index = AscenderSyncIndex()
+
+        def action_log(log):
+            if writer is not None:
+                writer.add_action_log(level="INFO", log=log, ascender_data=self.ascender_data)
+            else:
+                AscenderActionLog.objects.create(level="INFO", log=log, ascender_data=self.ascender_data)
+            LOGGER.info(log)
 
         # Comment about names: assume nothing about the content or format. They may be returned in any form of casing.
         # They may change, or be set to null and then changed back. We need to handle all the circumstances because
@@ -1236,18 +1218,18 @@ class DepartmentUser(models.Model):
                 # Ascender stores names in all caps, use title case.
                 first_name = self.ascender_data["first_name"].title()
                 log = f"{self} first name {self.given_name} differs from Ascender first name {first_name}, updating it"
-                AscenderActionLog.objects.create(level="INFO", log=log, ascender_data=self.ascender_data)
-                LOGGER.info(log)
+                action_log(log)
                 self.given_name = first_name
+                changed.add("given_name")
         # Handle blank/null value.
         elif "first_name" in self.ascender_data and not self.ascender_data["first_name"]:
             if self.ascender_data["first_name"] != self.given_name:
                 log = (
                     f"{self} first name {self.given_name} differs from Ascender first name {self.ascender_data['first_name']}, updating it"
                 )
-                AscenderActionLog.objects.create(level="INFO", log=log, ascender_data=self.ascender_data)
-                LOGGER.info(log)
+                action_log(log)
                 self.given_name = self.ascender_data["first_name"]
+                changed.add("given_name")
 
         # Preferred name
         if "preferred_name" in self.ascender_data and self.ascender_data["preferred_name"]:
@@ -1258,16 +1240,16 @@ class DepartmentUser(models.Model):
             if self.ascender_data["preferred_name"].upper() != preferred_name.upper():
                 preferred_name = self.ascender_data["preferred_name"].title()
                 log = f"{self} preferred name {self.preferred_name} differs from Ascender preferred name {preferred_name}, updating it"
-                AscenderActionLog.objects.create(level="INFO", log=log, ascender_data=self.ascender_data)
-                LOGGER.info(log)
+                action_log(log)
                 self.preferred_name = preferred_name
+                changed.add("preferred_name")
         # Handle blank/null value.
         elif "preferred_name" in self.ascender_data and not self.ascender_data["preferred_name"]:
             if self.ascender_data["preferred_name"] != self.preferred_name:
                 log = f"{self} preferred name {self.preferred_name} differs from Ascender preferred name {self.ascender_data['preferred_name']}, updating it"
-                AscenderActionLog.objects.create(level="INFO", log=log, ascender_data=self.ascender_data)
-                LOGGER.info(log)
+                action_log(log)
                 self.preferred_name = self.ascender_data["preferred_name"]
+                changed.add("preferred_name")
 
         # Surname
         if "surname" in self.ascender_data and self.ascender_data["surname"]:
@@ -1278,92 +1260,92 @@ class DepartmentUser(models.Model):
             if self.ascender_data["surname"].upper() != surname.upper():
                 surname = self.ascender_data["surname"].title()
                 log = f"{self} surname {self.surname} differs from Ascender surname {surname}, updating it"
-                AscenderActionLog.objects.create(level="INFO", log=log, ascender_data=self.ascender_data)
-                LOGGER.info(log)
+                action_log(log)
                 self.surname = surname
+                changed.add("surname")
         # Handle blank/null value.
         elif "surname" in self.ascender_data and not self.ascender_data["surname"]:
             if self.ascender_data["surname"] != self.surname:
                 log = f"{self} surname {self.surname} differs from Ascender surname {self.ascender_data['surname']}, updating it"
-                AscenderActionLog.objects.create(level="INFO", log=log, ascender_data=self.ascender_data)
-                LOGGER.info(log)
+                action_log(log)
                 self.surname = self.ascender_data["surname"]
+                changed.add("surname")
 
         # Set the user display name (Entra ID / Outlook) from Ascender name values,
         # with optional local override via any value in the given_name field.
-        self.name = self.get_display_name()
+        name = self.get_display_name()
+        if name != self.name:
+            self.name = name
+            changed.add("name")
 
         # Cost centre (Ascender records cost centre as 'paypoint').
-        if "paypoint" in self.ascender_data and CostCentre.objects.filter(ascender_code=self.ascender_data["paypoint"]).exists():
+        if "paypoint" in self.ascender_data and index.get_cost_centre(self.ascender_data["paypoint"]):
             paypoint = self.ascender_data["paypoint"]
-            cc = CostCentre.objects.get(ascender_code=paypoint)
+            cc = index.get_cost_centre(paypoint)
 
             # The user's current CC differs from that in Ascender (it might be None).
-            if self.cost_centre != cc:
-                if self.cost_centre:
+            if self.cost_centre_id != cc.pk:
+                if self.cost_centre_id:
                     log = f"{self} cost centre {self.cost_centre.ascender_code} differs from Ascender paypoint {paypoint}, updating it"
-                    AscenderActionLog.objects.create(level="INFO", log=log, ascender_data=self.ascender_data)
-                    LOGGER.info(log)
+                    action_log(log)
                 else:
                     log = f"{self} cost centre set from Ascender paypoint {paypoint}"
-                    AscenderActionLog.objects.create(level="INFO", log=log, ascender_data=self.ascender_data)
-                    LOGGER.info(log)
+                    action_log(log)
                 self.cost_centre = cc  # Change the department user's cost centre.
-        elif "paypoint" in self.ascender_data and not CostCentre.objects.filter(ascender_code=self.ascender_data["paypoint"]).exists():
+                changed.add("cost_centre")
+        elif "paypoint" in self.ascender_data:
             LOGGER.info(f"Cost centre {self.ascender_data['paypoint']} is not present in the IT Assets database, creating it")
             paypoint = self.ascender_data["paypoint"]
-            new_cc = CostCentre.objects.create(code=paypoint, ascender_code=paypoint)
+            new_cc = index.create_cost_centre(paypoint)
             self.cost_centre = new_cc
+            changed.add("cost_centre")
             log = f"{self} cost centre set from Ascender paypoint {paypoint}"
-            AscenderActionLog.objects.create(level="INFO", log=log, ascender_data=self.ascender_data)
-            LOGGER.info(log)
+            action_log(log)
 
         # Manager
         if (
             "manager_emp_no" in self.ascender_data
             and self.ascender_data["manager_emp_no"]
-            and DepartmentUser.objects.filter(employee_id=self.ascender_data["manager_emp_no"]).exists()
+            and index.get_user(self.ascender_data["manager_emp_no"])
         ):
-            manager = DepartmentUser.objects.get(employee_id=self.ascender_data["manager_emp_no"])
+            manager = index.get_user(self.ascender_data["manager_emp_no"])
             # Hard-coded short-circuit business rule: a staff member having the title "DIRECTOR GENERAL"
             # will not have a manager set. Context: the Ascender record for the DG has the DDG set as
             # the 'manager' for payroll certification purposes.
             if self.title and self.title.upper() == "DIRECTOR GENERAL":
-                if self.manager:
+                if self.manager_id:
                     log = f"Director General {self} manager set manually to null"
-                    AscenderActionLog.objects.create(level="INFO", log=log, ascender_data=self.ascender_data)
-                    LOGGER.info(log)
+                    action_log(log)
                     self.manager = None
+                    changed.add("manager")
             # The user's current manager differs from that in Ascender (it might be set to None).
-            elif self.manager != manager:
-                if self.manager:
+            elif self.manager_id != manager.pk:
+                if self.manager_id:
                     log = f"{self} manager {self.manager} differs from Ascender, updating it to {manager}"
-                    AscenderActionLog.objects.create(level="INFO", log=log, ascender_data=self.ascender_data)
-                    LOGGER.info(log)
+                    action_log(log)
                 else:
                     log = f"{self} manager set from Ascender to {manager}"
-                    AscenderActionLog.objects.create(level="INFO", log=log, ascender_data=self.ascender_data)
-                    LOGGER.info(log)
+                    action_log(log)
                 self.manager = manager  # Change the department user's manager.
+                changed.add("manager")
 
         # Location
         if (
             "geo_location_desc" in self.ascender_data
             and self.ascender_data["geo_location_desc"]
-            and Location.objects.filter(ascender_desc=self.ascender_data["geo_location_desc"]).exists()
+            and index.get_location(self.ascender_data["geo_location_desc"])
         ):
-            location = Location.objects.get(ascender_desc=self.ascender_data["geo_location_desc"])
+            location = index.get_location(self.ascender_data["geo_location_desc"])
             # The user's current location differs from that in Ascender.
-            if self.location != location:
-                if self.location:
+            if self.location_id != location.pk:
+                if self.location_id:
                     log = f"{self} location {self.location} differs from Ascender location {location}, updating it"
-                    AscenderActionLog.objects.create(level="INFO", log=log, ascender_data=self.ascender_data)
-                    LOGGER.info(log)
+                    action_log(log)
                 else:
                     log = f"{self} location set from Ascender location {location}"
-                    AscenderActionLog.objects.create(level="INFO", log=log, ascender_data=self.ascender_data)
-                    LOGGER.info(log)
+                    action_log(log)
                 self.location = location
+                changed.add("location")
 
         # Title
         if "occup_pos_title" in self.ascender_data and self.ascender_data["occup_pos_title"]:
@@ -1371,15 +1353,19 @@ class DepartmentUser(models.Model):
             current_title = self.title if self.title else ""
             if ascender_title.upper() != current_title.upper():
                 log = f"{self} title {self.title} differs from Ascender title {ascender_title}, updating it"
-                AscenderActionLog.objects.create(level="INFO", log=log, ascender_data=self.ascender_data)
-                LOGGER.info(log)
+                action_log(log)
                 self.title = ascender_title
+                changed.add("title")
 
-        self.save()
+        if writer is None:
+            self.save()
 
-    def update_from_entra_id_data(self):
+        return changed
+
+    def update_from_entra_id_data(self, commit: bool = True):
         """For this DepartmentUser object, update the field values from cached Azure Entra ID data
         (the source of truth for these values).
+        Pass `commit=False` to skip calling save(), e.g. when the caller writes objects in bulk.
         """
         if not self.azure_guid or not self.azure_ad_data:
             return
@@ -1419,7 +1405,8 @@ class DepartmentUser(models.Model):
         if self.get_pw_last_change():
             self.last_password_change = self.get_pw_last_change()
 
-        self.save()
+        if commit:
+            self.save()
 
     def get_account_dormant(self, dormant_account_days: Optional[int] = None) -> Optional[bool]:
         """Returns boolean if the last_signin or last_password_change dates are within the threshold, or None if unknown."""
@@ -1572,3 +1559,94 @@ class CostCentre(models.Model):
 
     def __str__(self):
         return self.code
+
+
+class EntraIdProvisioningTask(models.Model):
+    """Represents the persisted state of a new Entra ID account being provisioned from Ascender data.
+    Each step of the process is carried out by a scheduler, which records when the next step is due
+    (rather than sleeping while Entra ID propagates changes to the new account).
+    """
+
+    STATE_PENDING = "pending"
+    STATE_CREATED = "created"
+    STATE_UPDATED = "updated"
+    STATE_MANAGER_SET = "manager_set"
+    STATE_USAGE_LOCATION_CONFIRMED = "usage_location_confirmed"
+    STATE_LICENSED = "licensed"
+    STATE_COMPLETE = "complete"
+    STATE_FAILED = "failed"
+    STATE_CHOICES = (
+        (STATE_PENDING, "Pending"),
+        (STATE_CREATED, "Account created"),
+        (STATE_UPDATED, "Account updated"),
+        (STATE_MANAGER_SET, "Manager set"),
+        (STATE_USAGE_LOCATION_CONFIRMED, "Usage location confirmed"),
+        (STATE_LICENSED, "Licensed"),
+        (STATE_COMPLETE, "Complete"),
+        (STATE_FAILED, "Failed"),
+    )
+    # States in which a task is not yet finished.
+    IN_PROGRESS_STATES = (
+        STATE_PENDING,
+        STATE_CREATED,
+        STATE_UPDATED,
+        STATE_MANAGER_SET,
+        STATE_USAGE_LOCATION_CONFIRMED,
+        STATE_LICENSED,
+    )
+
+    created = models.DateTimeField(auto_now_add=True, editable=False)
+    updated = models.DateTimeField(auto_now=True, editable=False)
+    state = models.CharField(max_length=32, choices=STATE_CHOICES, default=STATE_PENDING, editable=False, db_index=True)
+    employee_id = models.CharField(max_length=128, editable=False, db_index=True)
+    ascender_data = models.JSONField(default=dict, editable=False)
+    # Finished tasks are kept as a record, so they mustn't prevent these objects from being deleted.
+    cost_centre = models.ForeignKey(CostCentre, on_delete=models.SET_NULL, null=True, blank=True, editable=False)
+    location = models.ForeignKey(Location, on_delete=models.SET_NULL, null=True, blank=True, editable=False)
+    manager = models.ForeignKey(DepartmentUser, on_delete=models.SET_NULL, null=True, blank=True, related_name="+", editable=False)
+    job_start_date = models.DateField(editable=False)
+    licence_type = models.CharField(max_length=32, editable=False)
+    position_no = models.CharField(max_length=128, null=True, blank=True, editable=False)
+    email = models.EmailField(null=True, blank=True, editable=False)
+    mail_nickname = models.CharField(max_length=128, null=True, blank=True, editable=False)
+    display_name = models.CharField(max_length=128, null=True, blank=True, editable=False)
+    title = models.CharField(max_length=128, null=True, blank=True, editable=False)
+    azure_guid = models.CharField(max_length=48, null=True, blank=True, editable=False)
+    department_user = models.ForeignKey(DepartmentUser, on_delete=models.SET_NULL, null=True, blank=True, related_name="+", editable=False)
+    attempts = models.PositiveIntegerField(default=0, editable=False, help_text="Failed attempts at the current step")
+    next_attempt_at = models.DateTimeField(editable=False, db_index=True, help_text="When the next step is due")
+    last_error = models.TextField(null=True, blank=True, editable=False)
+
+    class Meta:
+        ordering = ("-created",)
+
+    def __str__(self):
+        return f"{self.employee_id} ({self.email or 'no email'}): {self.get_state_display()}"
+
+
+class SyncCheckpoint(models.Model):
+    """Persists the state of an incremental synchronisation process between runs (e.g. a Microsoft
+    Graph delta link), identified by a unique name. Deleting a checkpoint causes the next run of that
+    process to carry out a full synchronisation.
+    """
+
+    name = models.CharField(max_length=64, unique=True, editable=False)
+    updated = models.DateTimeField(auto_now=True, editable=False)
+    state = models.JSONField(default=dict, editable=False)
+
+    class Meta:
+        ordering = ("name",)
+
+    def __str__(self):
+        return self.name
+
+    @classmethod
+    def get_state(cls, name: str) -> Dict:
+        """Returns the persisted state for the named checkpoint, or an empty dict."""
+        checkpoint = cls.objects.filter(name=name).first()
+        return checkpoint.state if checkpoint else {}
+
+    @classmethod
+    def set_state(cls, name: str, state: Dict):
+        """Persist the state for the named checkpoint, replacing any existing state."""
+        cls.objects.update_or_create(name=name, defaults={"state": state})
@@ -6,11 +6,15 @@ from uuid import uuid4
 
 from django.contrib.auth.models import User
 from django.core import mail
+from django.core.management import call_command
 from django.test import TestCase, override_settings
+from django.utils import timezone
 from mixer.backend.django import mixer
 
 from itassets.test_api import random_dbca_email
 from organisation.ascender import (
+    FOREIGN_TABLE_FIELDS,
+    AscenderSyncIndex,
     _assign_licence_with_retry,
     _build_licence_payload,
     _check_licence_availability,
@@ -18,15 +22,27 @@ from organisation.ascender import (
     _resolve_names,
     _send_admin_failure_email,
     _wait_for_usage_location,
+    advance_entra_id_provisioning_tasks,
+    check_ascender_user_account_rules,
+    ascender_data_digest,
+    ascender_db_fetch,
+    ascender_db_health_check,
+    ascender_employees_iter,
+    ascender_jobs_sort,
+    ascender_user_import,
+    ascender_user_import_all,
     create_entra_id_user,
     department_user_create,
+    enqueue_entra_id_user,
     generate_valid_dbca_email,
     new_user_creation_email,
+    row_to_python,
     sanitise_name_values,
     validate_ascender_user_account_rules,
+    validate_ascender_user_accounts,
 )
 from organisation.microsoft_products import MS_PRODUCTS
-from organisation.models import AscenderActionLog, CostCentre, DepartmentUser, Location
+from organisation.models import AscenderActionLog, CostCentre, DepartmentUser, EntraIdProvisioningTask, Location
 from organisation.utils import title_except
 
 # Disable non-critical logging output.
@@ -99,6 +115,19 @@ class AscenderTestCase(TestCase):
         """Test the validate_ascender_user_account_rules function"""
         self.assertTrue(validate_ascender_user_account_rules(self.ascender_data))
 
+    def test_validate_ascender_user_account_rules_index(self):
+        """Test the validate_ascender_user_account_rules function with a loaded AscenderSyncIndex"""
+        index = AscenderSyncIndex().load()
+        with self.assertNumQueries(0):
+            self.assertTrue(validate_ascender_user_account_rules(self.ascender_data, index=index))
+
+    def test_ascender_sync_index_create_cost_centre(self):
+        """Test that a cost centre created via the AscenderSyncIndex is added to the index"""
+        index = AscenderSyncIndex().load()
+        cc = index.create_cost_centre("999999")
+        self.assertEqual(index.get_cost_centre("999999"), cc)
+        self.assertTrue(CostCentre.objects.filter(ascender_code="999999").exists())
+
     def test_validate_ascender_user_account_rules_fpc(self):
         """Test the validate_ascender_user_account_rules function for an FPC record"""
         self.ascender_data["clevel1_id"] = "FPC"
@@ -179,6 +208,35 @@ class AscenderTestCase(TestCase):
         self.ascender_data["geo_location_desc"] = "42 Everything Way, THE MOON"
         self.assertFalse(validate_ascender_user_account_rules(self.ascender_data))
 
+    def test_check_ascender_user_account_rules_reason(self):
+        """Test the check_ascender_user_account_rules function returns a reason code for failed rules"""
+        self.assertEqual(check_ascender_user_account_rules(self.ascender_data)[0], None)
+        self.ascender_data["manager_emp_no"] = "000001"
+        self.assertEqual(check_ascender_user_account_rules(self.ascender_data), ("manager_not_found", None))
+        self.ascender_data["licence_type"] = None
+        self.assertEqual(check_ascender_user_account_rules(self.ascender_data), ("no_licence_type", None))
+
+    def test_check_ascender_user_account_rules_no_create_cost_centre(self):
+        """Test the check_ascender_user_account_rules function doesn't create a new Cost Centre if told not to"""
+        initial_count = CostCentre.objects.count()
+        self.ascender_data["paypoint"] = "001"
+        reason, values = check_ascender_user_account_rules(self.ascender_data, create_cost_centre=False)
+        self.assertIsNone(reason)
+        self.assertIsNone(values[1])
+        self.assertEqual(CostCentre.objects.count(), initial_count)
+
+    def test_validate_ascender_user_accounts(self):
+        """Test the validate_ascender_user_accounts function checks many records using bulk queries"""
+        fpc_job = dict(self.ascender_data, employee_id="000002", clevel1_id="FPC")
+        no_location_job = dict(self.ascender_data, employee_id="000003", geo_location_desc="42 Everything Way, THE MOON")
+        # One query each for users, cost centres and locations.
+        with self.assertNumQueries(3):
+            results = validate_ascender_user_accounts([self.ascender_data, fpc_job, no_location_job])
+        self.assertIsNone(results[self.ascender_data["employee_id"]][0])
+        self.assertEqual(results[self.ascender_data["employee_id"]][1][4], self.manager)
+        self.assertEqual(results["000002"], ("fpc", None))
+        self.assertEqual(results["000003"], ("location_not_found", None))
+
     def test_generate_valid_dbca_email(self):
         """Test that generate_valid_dbca_email function works with preferred name"""
         email, mail_nickname = generate_valid_dbca_email(surname=mixer.faker.last_name(), preferred_name=mixer.faker.first_name())
@@ -267,6 +325,68 @@ class AscenderTestCase(TestCase):
         new_user.save()
         self.assertTrue(new_user.get_term_reason())
 
+    def test_ascender_data_digest(self):
+        """The digest is independent of key order and changes with the data."""
+        digest = ascender_data_digest(self.ascender_data)
+        self.assertEqual(digest, ascender_data_digest(dict(reversed(list(self.ascender_data.items())))))
+        job = self.ascender_data.copy()
+        job["occup_pos_title"] = "A NEW JOB TITLE"
+        self.assertNotEqual(digest, ascender_data_digest(job))
+
+    def import_all(self, force=False):
+        """Run ascender_user_import_all for this test case's Ascender record, returning the number
+        of times the existing user was updated from Ascender data.
+        """
+        with (
+            patch(
+                "organisation.ascender.ascender_employees_iter", return_value=[(self.ascender_data["employee_id"], [self.ascender_data])]
+            ),
+            patch.object(DepartmentUser, "update_from_ascender_data", return_value=set()) as mock_update,
+        ):
+            ascender_user_import_all(force=force)
+        return mock_update.call_count
+
+    def test_ascender_user_import_all_unchanged_skipped(self):
+        """An existing user whose Ascender data is unchanged since the last import is skipped."""
+        user = self.create_new_user()
+        user.ascender_data_hash = ascender_data_digest(self.ascender_data)
+        user.save()
+        self.assertEqual(self.import_all(), 0)
+
+    def test_ascender_user_import_all_changed(self):
+        """An existing user whose Ascender data has changed is updated."""
+        user = self.create_new_user()
+        user.ascender_data_hash = ascender_data_digest(self.ascender_data)
+        user.save()
+        self.ascender_data["occup_pos_title"] = "A NEW JOB TITLE"
+        self.assertEqual(self.import_all(), 1)
+        user.refresh_from_db()
+        self.assertEqual(user.ascender_data_hash, ascender_data_digest(self.ascender_data))
+        self.assertEqual(user.ascender_data["occup_pos_title"], "A NEW JOB TITLE")
+
+    @override_settings(ASCENDER_DATA_MAX_AGE_HOURS=24)
+    def test_ascender_user_import_all_outdated(self):
+        """An existing user whose cached Ascender data is older than ASCENDER_DATA_MAX_AGE_HOURS is updated."""
+        user = self.create_new_user()
+        DepartmentUser.objects.filter(pk=user.pk).update(
+            ascender_data_hash=ascender_data_digest(self.ascender_data), ascender_data_updated=timezone.now() - timedelta(hours=25)
+        )
+        self.assertEqual(self.import_all(), 1)
+        user.refresh_from_db()
+        self.assertGreater(user.ascender_data_updated, timezone.now() - timedelta(hours=1))
+
+    @override_settings(SENTRY_CRON_CHECK_ASCENDER=None)
+    def test_ascender_user_import_all_force(self):
+        """All existing users are updated when forced, including via check_ascender_accounts --force."""
+        user = self.create_new_user()
+        user.ascender_data_hash = ascender_data_digest(self.ascender_data)
+        user.save()
+        self.assertEqual(self.import_all(force=True), 1)
+
+        with patch("organisation.management.commands.check_ascender_accounts.ascender_user_import_all") as mock_import:
+            call_command("check_ascender_accounts", "--force")
+        mock_import.assert_called_once_with(force=True)
+
     def test_sanitise_name_values(self):
         """Test the sanitise_name_values function"""
         first_name = "Joseph123"
@@ -374,70 +494,70 @@ class CheckLicenceAvailabilityTestCase(TestCase):
         self.token = {"access_token": "dummy"}
         self.record = "123456, Test User"
 
-    @patch("organisation.ascender.ms_graph_get_subscribed_sku")
+    @patch("organisation.ascender.SUBSCRIBED_SKU_CACHE.get")
     def test_onpul_available_returns_on_premise(self, mock_sku):
         """Returns 'On-premise' when E5 licence is available."""
         mock_sku.return_value = _make_sku(100, 0, 50)
         result = _check_licence_availability("ONPUL", self.token, self.record)
         self.assertEqual(result, "On-premise")
 
-    @patch("organisation.ascender.ms_graph_get_subscribed_sku")
+    @patch("organisation.ascender.SUBSCRIBED_SKU_CACHE.get")
     def test_onpul_no_sku_data_returns_none(self, mock_sku):
         """Returns None when the E5 SKU query returns no data."""
         mock_sku.return_value = None
         result = _check_licence_availability("ONPUL", self.token, self.record)
         self.assertIsNone(result)
 
-    @patch("organisation.ascender.ms_graph_get_subscribed_sku")
+    @patch("organisation.ascender.SUBSCRIBED_SKU_CACHE.get")
     def test_onpul_exhausted_returns_none(self, mock_sku):
         """Returns None when all E5 licences are consumed."""
         mock_sku.return_value = _make_sku(10, 0, 10)
         result = _check_licence_availability("ONPUL", self.token, self.record)
         self.assertIsNone(result)
 
-    @patch("organisation.ascender.ms_graph_get_subscribed_sku")
+    @patch("organisation.ascender.SUBSCRIBED_SKU_CACHE.get")
     def test_cldul_all_available_returns_cloud(self, mock_sku):
         """Returns 'Cloud' when F3, Exchange Online and Security skus are available."""
         mock_sku.return_value = _make_sku(100, 0, 50)
         result = _check_licence_availability("CLDUL", self.token, self.record)
         self.assertEqual(result, "Cloud")
 
-    @patch("organisation.ascender.ms_graph_get_subscribed_sku")
+    @patch("organisation.ascender.SUBSCRIBED_SKU_CACHE.get")
     def test_cldul_f3_no_data_returns_none(self, mock_sku):
         """Returns None when the F3 SKU query returns no data."""
         mock_sku.side_effect = [None]  # First call (F3) returns None
         result = _check_licence_availability("CLDUL", self.token, self.record)
         self.assertIsNone(result)
 
-    @patch("organisation.ascender.ms_graph_get_subscribed_sku")
+    @patch("organisation.ascender.SUBSCRIBED_SKU_CACHE.get")
     def test_cldul_f3_exhausted_returns_none(self, mock_sku):
         """Returns None when all F3 licences are consumed."""
         mock_sku.side_effect = [_make_sku(5, 0, 5)]  # F3 exhausted
         result = _check_licence_availability("CLDUL", self.token, self.record)
         self.assertIsNone(result)
 
-    @patch("organisation.ascender.ms_graph_get_subscribed_sku")
+    @patch("organisation.ascender.SUBSCRIBED_SKU_CACHE.get")
     def test_cldul_exchange_online_exhausted_returns_none(self, mock_sku):
         """Returns None when Exchange Online licences are exhausted."""
         mock_sku.side_effect = [_make_sku(100, 0, 50), _make_sku(5, 0, 5)]  # F3 ok, EO exhausted
         result = _check_licence_availability("CLDUL", self.token, self.record)
         self.assertIsNone(result)
 
-    @patch("organisation.ascender.ms_graph_get_subscribed_sku")
+    @patch("organisation.ascender.SUBSCRIBED_SKU_CACHE.get")
     def test_cldul_security_addon_exhausted_returns_none(self, mock_sku):
         """Returns None when Security + Compliance Add-on licences are exhausted."""
         mock_sku.side_effect = [_make_sku(100, 0, 50), _make_sku(100, 0, 50), _make_sku(5, 0, 5)]
         result = _check_licence_availability("CLDUL", self.token, self.record)
         self.assertIsNone(result)
 
-    @patch("organisation.ascender.ms_graph_get_subscribed_sku")
+    @patch("organisation.ascender.SUBSCRIBED_SKU_CACHE.get")
     def test_invalid_licence_code_returns_none(self, mock_sku):
         """Returns None for an unrecognised licence type code."""
         result = _check_licence_availability("FOOBAR", self.token, self.record)
         self.assertIsNone(result)
         mock_sku.assert_not_called()
 
-    @patch("organisation.ascender.ms_graph_get_subscribed_sku")
+    @patch("organisation.ascender.SUBSCRIBED_SKU_CACHE.get")
     def test_onpul_available_with_warning_units(self, mock_sku):
         """Licence availability calculation includes 'warning' prepaid units."""
         # 8 enabled + 2 warning = 10 assignable; 9 consumed → 1 available
@@ -445,6 +565,16 @@ class CheckLicenceAvailabilityTestCase(TestCase):
         result = _check_licence_availability("ONPUL", self.token, self.record)
         self.assertEqual(result, "On-premise")
 
+    @patch("organisation.ascender.SUBSCRIBED_SKU_CACHE.get")
+    def test_licences_reserved_for_queued_accounts(self, mock_sku):
+        """Licences for queued accounts which are created but not yet licensed aren't available."""
+        mock_sku.return_value = _make_sku(10, 0, 9)
+        mixer.blend(EntraIdProvisioningTask, state=EntraIdProvisioningTask.STATE_COMPLETE, licence_type="On-premise")
+        mixer.blend(EntraIdProvisioningTask, state=EntraIdProvisioningTask.STATE_CREATED, licence_type="Cloud")
+        self.assertEqual(_check_licence_availability("ONPUL", self.token, self.record), "On-premise")
+        mixer.blend(EntraIdProvisioningTask, state=EntraIdProvisioningTask.STATE_MANAGER_SET, licence_type="On-premise")
+        self.assertIsNone(_check_licence_availability("ONPUL", self.token, self.record))
+
 
 class BuildLicencePayloadTestCase(TestCase):
     """Tests for the _build_licence_payload helper."""
@@ -492,7 +622,7 @@ class WaitForUsageLocationTestCase(TestCase):
         self.email = "test.user@dbca.wa.gov.au"
 
     @patch("organisation.ascender.sleep")
-    @patch("organisation.ascender.requests.get")
+    @patch("itassets.graph.get")
     def test_returns_true_when_usage_location_set(self, mock_get, mock_sleep):
         """Returns True immediately when usageLocation is 'AU' on the first poll."""
         mock_resp = MagicMock()
@@ -503,7 +633,7 @@ class WaitForUsageLocationTestCase(TestCase):
         mock_sleep.assert_not_called()
 
     @patch("organisation.ascender.sleep")
-    @patch("organisation.ascender.requests.get")
+    @patch("itassets.graph.get")
     def test_returns_false_on_timeout_and_logs(self, mock_get, mock_sleep):
         """Returns False and creates an AscenderActionLog when usageLocation never appears."""
         mock_resp = MagicMock()
@@ -514,7 +644,7 @@ class WaitForUsageLocationTestCase(TestCase):
         self.assertTrue(AscenderActionLog.objects.filter(log__icontains="usageLocation field value not set").exists())
 
     @patch("organisation.ascender.sleep")
-    @patch("organisation.ascender.requests.get")
+    @patch("itassets.graph.get")
     def test_returns_false_on_timeout_sends_email(self, mock_get, mock_sleep):
         """Sends an admin alert email when the usageLocation poll times out."""
         mock_resp = MagicMock()
@@ -524,7 +654,7 @@ class WaitForUsageLocationTestCase(TestCase):
         self.assertGreater(len(mail.outbox), 0)
 
     @patch("organisation.ascender.sleep")
-    @patch("organisation.ascender.requests.get")
+    @patch("itassets.graph.get")
     def test_returns_true_after_initial_failures(self, mock_get, mock_sleep):
         """Returns True once the poll eventually sees usageLocation == 'AU'."""
         resp_no_location = MagicMock()
@@ -547,7 +677,7 @@ class AssignLicenceWithRetryTestCase(TestCase):
         self.payload = {"addLicenses": [], "removeLicenses": []}
 
     @patch("organisation.ascender.sleep")
-    @patch("organisation.ascender.requests.post")
+    @patch("itassets.graph.post")
     def test_returns_true_on_success(self, mock_post, mock_sleep):
         """Returns True when the licence assignment POST succeeds on the first attempt."""
         mock_resp = MagicMock()
@@ -557,8 +687,8 @@ class AssignLicenceWithRetryTestCase(TestCase):
         self.assertTrue(result)
 
     @patch("organisation.ascender.sleep")
-    @patch("organisation.ascender.requests.delete")
-    @patch("organisation.ascender.requests.post")
+    @patch("itassets.graph.delete")
+    @patch("itassets.graph.post")
     def test_returns_false_on_timeout_and_logs(self, mock_post, mock_delete, mock_sleep):
         """Returns False and creates a log entry when licence assignment exhausts retries."""
         import requests as req
@@ -572,8 +702,8 @@ class AssignLicenceWithRetryTestCase(TestCase):
         self.assertTrue(AscenderActionLog.objects.filter(log__icontains="assign license step").exists())
 
     @patch("organisation.ascender.sleep")
-    @patch("organisation.ascender.requests.delete")
-    @patch("organisation.ascender.requests.post")
+    @patch("itassets.graph.delete")
+    @patch("itassets.graph.post")
     def test_deletes_orphan_on_failure(self, mock_post, mock_delete, mock_sleep):
         """Attempts to delete the orphaned Entra ID account when licence assignment fails."""
         import requests as req
@@ -589,8 +719,8 @@ class AssignLicenceWithRetryTestCase(TestCase):
         self.assertIn(self.guid, url_called)
 
     @patch("organisation.ascender.sleep")
-    @patch("organisation.ascender.requests.delete")
-    @patch("organisation.ascender.requests.post")
+    @patch("itassets.graph.delete")
+    @patch("itassets.graph.post")
     def test_logs_cleanup_failure(self, mock_post, mock_delete, mock_sleep):
         """Logs a WARNING when the orphan deletion itself fails."""
         import requests as req
@@ -605,8 +735,8 @@ class AssignLicenceWithRetryTestCase(TestCase):
         self.assertTrue(AscenderActionLog.objects.filter(log__icontains="manual deletion required").exists())
 
     @patch("organisation.ascender.sleep")
-    @patch("organisation.ascender.requests.delete")
-    @patch("organisation.ascender.requests.post")
+    @patch("itassets.graph.delete")
+    @patch("itassets.graph.post")
     def test_returns_false_and_sends_email_on_failure(self, mock_post, mock_delete, mock_sleep):
         """Sends an admin alert email when licence assignment exhausts retries."""
         import requests as req
@@ -707,3 +837,217 @@ class CreateEntraIdUserTestCase(TestCase):
             result = create_entra_id_user(self.job, self.cc, self.next_week, self.manager, self.location, token=self.token)
         self.assertIsNone(result)
         self.assertTrue(AscenderActionLog.objects.filter(log__icontains="unable to generate unique email").exists())
+
+
+class EntraIdProvisioningTaskTestCase(TestCase):
+    """Tests for the queued (non-blocking) Entra ID account provisioning process."""
+
+    def setUp(self):
+        loc_desc = "1 Fake Street, DULLSVILLE"
+        self.location = mixer.blend(Location, name=loc_desc, ascender_desc=loc_desc)
+        cc_code = str(random.randint(100, 999))
+        self.cc = mixer.blend(CostCentre, code=cc_code, ascender_code=cc_code)
+        self.manager = mixer.blend(
+            DepartmentUser,
+            active=True,
+            email=random_dbca_email,
+            azure_guid=str(uuid4()),
+            employee_id=str(random.randint(100000, 999999)),
+        )
+        self.next_week = date.today() + timedelta(days=7)
+        self.job = {
+            "employee_id": str(random.randint(100000, 999999)),
+            "first_name": "JOHN",
+            "second_name": "PAUL",
+            "surname": "SMITH",
+            "preferred_name": None,
+            "occup_pos_title": "SENIOR RANGER",
+            "job_end_date": None,
+            "licence_type": "ONPUL",
+            "manager_emp_no": str(self.manager.employee_id),
+        }
+        self.token = {"access_token": "dummy-token"}
+
+    def enqueue(self):
+        return enqueue_entra_id_user(self.job, self.cc, self.next_week, "On-premise", self.manager, self.location)
+
+    @override_settings(ASCENDER_CREATE_AZURE_AD=True, DEBUG=False)
+    def test_enqueue_creates_single_task(self):
+        """A task is queued once per employee."""
+        task = self.enqueue()
+        self.assertEqual(task.state, EntraIdProvisioningTask.STATE_PENDING)
+        self.assertIsNone(self.enqueue())
+        self.assertEqual(EntraIdProvisioningTask.objects.filter(employee_id=self.job["employee_id"]).count(), 1)
+
+    @override_settings(ASCENDER_CREATE_AZURE_AD=False, DEBUG=False)
+    def test_enqueue_disabled(self):
+        """No task is queued when ASCENDER_CREATE_AZURE_AD is False."""
+        self.assertIsNone(self.enqueue())
+
+    @override_settings(ASCENDER_CREATE_AZURE_AD=True, DEBUG=False, ENTRA_ID_PROVISIONING_STEP_DELAY=0)
+    @patch("organisation.ascender.sleep")
+    @patch("organisation.ascender.new_user_creation_email", return_value=True)
+    @patch("organisation.ascender.ms_graph_validate_password", return_value=True)
+    @patch("organisation.ascender._check_licence_availability", return_value="On-premise")
+    @patch("itassets.graph.get")
+    @patch("itassets.graph.put")
+    @patch("itassets.graph.patch")
+    @patch("itassets.graph.post")
+    def test_advance_to_complete(self, mock_post, mock_patch, mock_put, mock_get, mock_licence, mock_pwd, mock_email, mock_sleep):
+        """A queued task advances through each step and creates the DepartmentUser."""
+        guid = str(uuid4())
+        mock_post.return_value = MagicMock(status_code=201, json=MagicMock(return_value={"id": guid}))
+        mock_get.return_value = MagicMock(status_code=200, json=MagicMock(return_value={"id": guid, "usageLocation": "AU"}))
+        task = self.enqueue()
+        remaining = advance_entra_id_provisioning_tasks(max_seconds=5, token=self.token)
+        self.assertEqual(remaining, 0)
+        task.refresh_from_db()
+        self.assertEqual(task.state, EntraIdProvisioningTask.STATE_COMPLETE)
+        self.assertEqual(task.department_user.azure_guid, guid)
+        mock_email.assert_called_once()
+
+    @override_settings(ASCENDER_CREATE_AZURE_AD=True, DEBUG=False)
+    @patch("organisation.ascender.ms_graph_validate_password", return_value=True)
+    @patch("organisation.ascender._check_licence_availability", return_value="On-premise")
+    @patch("itassets.graph.post")
+    def test_create_not_repeated_after_failure(self, mock_post, mock_licence, mock_pwd):
+        """A failure after the account is created doesn't cause a duplicate account on retry."""
+        guid = str(uuid4())
+        mock_post.return_value = MagicMock(status_code=201, json=MagicMock(return_value={"id": guid}))
+        task = self.enqueue()
+        with patch("organisation.ascender._provisioning_task_advance", side_effect=Exception("database unavailable")):
+            advance_entra_id_provisioning_tasks(token=self.token)
+        task.refresh_from_db()
+        self.assertEqual(task.state, EntraIdProvisioningTask.STATE_PENDING)
+        self.assertEqual(task.azure_guid, guid)
+
+        task.next_attempt_at = timezone.now()
+        task.save()
+        advance_entra_id_provisioning_tasks(token=self.token)
+        task.refresh_from_db()
+        self.assertEqual(task.state, EntraIdProvisioningTask.STATE_CREATED)
+        mock_post.assert_called_once()
+
+    @override_settings(ASCENDER_CREATE_AZURE_AD=True, DEBUG=False)
+    @patch("organisation.ascender.sleep")
+    @patch("itassets.graph.get")
+    def test_usage_location_not_set_is_rescheduled(self, mock_get, mock_sleep):
+        """An unconfirmed usageLocation schedules a later attempt instead of sleeping."""
+        mock_get.return_value = MagicMock(status_code=200, json=MagicMock(return_value={"usageLocation": None}))
+        task = self.enqueue()
+        task.state = EntraIdProvisioningTask.STATE_MANAGER_SET
+        task.azure_guid = str(uuid4())
+        task.save()
+        advance_entra_id_provisioning_tasks(token=self.token)
+        task.refresh_from_db()
+        self.assertEqual(task.state, EntraIdProvisioningTask.STATE_MANAGER_SET)
+        self.assertEqual(task.attempts, 1)
+        mock_sleep.assert_not_called()
+
+    @override_settings(ASCENDER_CREATE_AZURE_AD=True, DEBUG=False)
+    def test_finished_task_does_not_prevent_manager_deletion(self):
+        """Deleting the manager, cost centre or location of a finished task doesn't raise an exception."""
+        task = self.enqueue()
+        task.state = EntraIdProvisioningTask.STATE_COMPLETE
+        task.save()
+        self.manager.delete()
+        self.cc.delete()
+        self.location.delete()
+        task.refresh_from_db()
+        self.assertIsNone(task.manager)
+        self.assertIsNone(task.cost_centre)
+        self.assertIsNone(task.location)
+
+    @override_settings(ASCENDER_CREATE_AZURE_AD=True, DEBUG=False)
+    @patch("organisation.ascender.create_entra_id_user")
+    @patch("organisation.ascender.validate_ascender_user_account_rules")
+    @patch("organisation.ascender.ascender_employee_fetch")
+    def test_manual_import_refused_while_task_in_progress(self, mock_fetch, mock_rules, mock_create):
+        """A manual import doesn't create an account for an employee with an in-progress provisioning task."""
+        task = self.enqueue()
+        mock_fetch.return_value = (self.job["employee_id"], [self.job])
+        mock_rules.return_value = (self.job, self.cc, self.next_week, "On-premise", self.manager, self.location)
+        self.assertIsNone(ascender_user_import(self.job["employee_id"]))
+        mock_create.assert_not_called()
+        self.assertTrue(AscenderActionLog.objects.filter(log__contains=f"task {task.pk}").exists())
+
+    @override_settings(ASCENDER_CREATE_AZURE_AD=True, DEBUG=False)
+    @patch("itassets.graph.post")
+    def test_task_failed_after_manager_deletion(self, mock_post):
+        """An in-progress task whose manager has been deleted is failed rather than advanced."""
+        task = self.enqueue()
+        self.manager.delete()
+        advance_entra_id_provisioning_tasks(token=self.token)
+        task.refresh_from_db()
+        self.assertEqual(task.state, EntraIdProvisioningTask.STATE_FAILED)
+        mock_post.assert_not_called()
+
+
+@override_settings(FOREIGN_TABLE="ascender_table")
+class AscenderDbFetchTestCase(TestCase):
+    """Tests for reading and parsing rows from the Ascender database."""
+
+    def setUp(self):
+        self.row = ["123456" if i == 0 else None for i in range(len(FOREIGN_TABLE_FIELDS))]
+
+    def test_row_to_python(self):
+        """Column names are renamed and transforms are applied."""
+        record = row_to_python(self.row)
+        self.assertEqual(record["employee_id"], "123456")
+        self.assertNotIn("employee_no", record)
+        self.assertEqual(len(record), len(FOREIGN_TABLE_FIELDS))
+
+    @override_settings(ASCENDER_DB_FETCH_BATCH_SIZE=2)
+    @patch("organisation.ascender.get_ascender_db_connection")
+    def test_ascender_db_fetch_server_side_cursor(self, mock_conn):
+        """Fetching the full table uses a named cursor and closes the connection."""
+        conn = mock_conn.return_value.__enter__.return_value
+        cur = conn.cursor.return_value
+        cur.fetchmany.side_effect = [[self.row, self.row], [self.row], []]
+        records = list(ascender_db_fetch())
+        self.assertEqual(len(records), 3)
+        conn.cursor.assert_called_once_with(name="ascender_db_fetch")
+        cur.fetchmany.assert_called_with(2)
+        # The connection is returned to the pool.
+        mock_conn.return_value.__exit__.assert_called_once()
+
+    @patch("organisation.ascender.get_ascender_db_connection")
+    def test_ascender_db_fetch_employee_id(self, mock_conn):
+        """Fetching a single employee uses a client-side cursor."""
+        conn = mock_conn.return_value.__enter__.return_value
+        cur = conn.cursor.return_value
+        cur.fetchmany.side_effect = [[self.row], []]
+        records = list(ascender_db_fetch("123456"))
+        self.assertEqual(records[0]["employee_id"], "123456")
+        conn.cursor.assert_called_once_with()
+        mock_conn.return_value.__exit__.assert_called_once()
+
+    @patch("organisation.ascender.get_ascender_db_connection")
+    def test_ascender_db_health_check(self, mock_conn):
+        """The health check returns True on a successful query, False on an error."""
+        conn = mock_conn.return_value.__enter__.return_value
+        conn.execute.return_value.fetchone.return_value = (1,)
+        self.assertTrue(ascender_db_health_check())
+        conn.execute.side_effect = Exception("Connection refused")
+        self.assertFalse(ascender_db_health_check())
+
+    def test_ascender_jobs_sort(self):
+        """Current jobs are sorted ahead of jobs with no end date, then ended jobs."""
+        ended = {"job_end_date": "2000-01-01"}
+        no_end = {"job_end_date": None}
+        current = {"job_end_date": (date.today() + timedelta(days=30)).strftime("%Y-%m-%d")}
+        self.assertEqual(ascender_jobs_sort([ended, no_end, current]), [current, no_end, ended])
+
+    @patch("organisation.ascender.ascender_db_fetch")
+    def test_ascender_employees_iter(self, mock_fetch):
+        """Ordered rows are yielded as one group of sorted jobs per employee."""
+        mock_fetch.return_value = iter(
+            [
+                {"employee_id": "1", "job_end_date": "2000-01-01"},
+                {"employee_id": "1", "job_end_date": None},
+                {"employee_id": "2", "job_end_date": None},
+            ]
+        )
+        employees = list(ascender_employees_iter())
+        self.assertEqual([e[0] for e in employees], ["1", "2"])
+        self.assertIsNone(employees[0][1][0]["job_end_date"])
@@ -0,0 +1,277 @@
+import logging
+import random
+import re
+from datetime import datetime, timedelta, timezone
+from io import StringIO
+from unittest.mock import patch
+from urllib.parse import parse_qs, urlsplit
+from uuid import uuid4
+
+from django.core.management import CommandError, call_command
+from django.test import TestCase, override_settings
+from mixer.backend.django import mixer
+
+from itassets.fake_graph import FakeGraphTenant, fake_graph
+from organisation.ascender import FOREIGN_TABLE_FIELDS, row_to_python
+from organisation.management.commands.ascender_synthetic_data import Command as AscenderSyntheticDataCommand
+from organisation.models import DepartmentUser, SyncCheckpoint
+from organisation.utils import json_digest
+
+# Disable non-critical logging output.
+logging.disable(logging.CRITICAL)
+
+
+@patch("organisation.management.commands.department_users_signins.ms_graph_client_token", return_value={"access_token": "dummy-token"})
+@patch("itassets.graph.paginate")
+class DepartmentUsersSigninsTestCase(TestCase):
+    """Tests for the department_users_signins management command."""
+
+    checkpoint = "entra_id_signins"
+
+    def setUp(self):
+        self.user = mixer.blend(DepartmentUser, azure_guid=str(uuid4()), last_signin=None)
+        self.watermark = datetime(2026, 1, 1, 8, 0, tzinfo=timezone.utc)
+
+    def queried_since(self, mock_paginate):
+        """Returns the createdDateTime lower bound passed to the sign-ins query."""
+        params = mock_paginate.call_args[0][2]
+        return datetime.strptime(params["$filter"].split("createdDateTime ge ")[1].rstrip(")"), "%Y-%m-%dT%H:%M:%SZ").replace(
+            tzinfo=timezone.utc
+        )
+
+    def signin(self, user, created):
+        return {"userId": user.azure_guid, "createdDateTime": created.strftime("%Y-%m-%dT%H:%M:%SZ")}
+
+    @override_settings(SIGNIN_LOOKBACK_MINUTES=10)
+    def test_query_from_watermark(self, mock_paginate, mock_token):
+        """Sign-ins are queried from the saved watermark, overlapped by SIGNIN_LOOKBACK_MINUTES."""
+        SyncCheckpoint.set_state(self.checkpoint, {"watermark": self.watermark.isoformat()})
+        mock_paginate.return_value = []
+        call_command("department_users_signins")
+        self.assertEqual(self.queried_since(mock_paginate), self.watermark - timedelta(minutes=10))
+
+    def test_query_without_watermark(self, mock_paginate, mock_token):
+        """Without a watermark, or with --minutes, sign-ins are queried for a recent window."""
+        mock_paginate.return_value = []
+        call_command("department_users_signins")
+        since = datetime.now(timezone.utc) - self.queried_since(mock_paginate)
+        self.assertLess(abs(since - timedelta(minutes=5)), timedelta(minutes=1))
+
+        SyncCheckpoint.set_state(self.checkpoint, {"watermark": self.watermark.isoformat()})
+        call_command("department_users_signins", minutes=60)
+        since = datetime.now(timezone.utc) - self.queried_since(mock_paginate)
+        self.assertLess(abs(since - timedelta(minutes=60)), timedelta(minutes=1))
+
+    def test_latest_signin_per_user(self, mock_paginate, mock_token):
+        """Each user is updated to their latest sign-in, and the watermark is advanced to the latest sign-in."""
+        other = mixer.blend(DepartmentUser, azure_guid=str(uuid4()), last_signin=None)
+        latest = self.watermark + timedelta(minutes=30)
+        mock_paginate.return_value = [
+            self.signin(self.user, self.watermark + timedelta(minutes=5)),
+            self.signin(self.user, latest),
+            self.signin(self.user, self.watermark + timedelta(minutes=10)),
+            self.signin(other, self.watermark),
+        ]
+        call_command("department_users_signins")
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.last_signin, latest)
+        other.refresh_from_db()
+        self.assertEqual(other.last_signin, self.watermark)
+        state = SyncCheckpoint.get_state(self.checkpoint)
+        self.assertEqual(datetime.fromisoformat(state["watermark"]), latest)
+
+    def test_last_signin_only_moves_forward(self, mock_paginate, mock_token):
+        """An older sign-in (e.g. from the overlapping window) doesn't overwrite a later last_signin."""
+        self.user.last_signin = self.watermark
+        self.user.save()
+        mock_paginate.return_value = [self.signin(self.user, self.watermark - timedelta(minutes=5))]
+        with patch.object(DepartmentUser.objects, "bulk_update") as mock_bulk_update:
+            call_command("department_users_signins")
+        self.assertEqual(mock_bulk_update.call_args[0][0], [])
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.last_signin, self.watermark)
+
+
+class CheckAzureAccountsTestCase(TestCase):
+    """Tests for the check_azure_accounts management command, against a fake Graph API."""
+
+    checkpoint = "entra_id_users"
+
+    def setUp(self):
+        self.tenant = FakeGraphTenant(users=40, groups=5, signins=0, licensed_ratio=0.5)
+
+    def delta_token(self):
+        """Returns the delta token of the saved delta link."""
+        delta_link = SyncCheckpoint.get_state(self.checkpoint)["delta_link"]
+        return parse_qs(urlsplit(delta_link).query)["$deltatoken"][0]
+
+    def test_full_then_delta_sync(self):
+        """A full sync creates licensed users; a later run checks only the changed accounts, merging
+        the changes with the cached account data."""
+        licensed = {i for i, user in self.tenant.users.items() if user["assignedLicenses"]}
+        with fake_graph(self.tenant) as server:
+            call_command("check_azure_accounts")
+            self.assertEqual(set(DepartmentUser.objects.values_list("azure_guid", flat=True)), licensed)
+            self.assertEqual(self.delta_token(), str(self.tenant.version))
+            full_sync = SyncCheckpoint.get_state(self.checkpoint)["full_sync"]
+            list_users = server.requests["list_users"]
+
+            modified = self.tenant.modify_users(len(self.tenant.users))
+            call_command("check_azure_accounts")
+            self.assertEqual(server.requests["list_users"], list_users)
+
+        self.assertEqual(self.delta_token(), str(self.tenant.version))
+        self.assertEqual(SyncCheckpoint.get_state(self.checkpoint)["full_sync"], full_sync)
+        self.assertEqual(DepartmentUser.objects.count(), len(licensed))
+        for user in DepartmentUser.objects.filter(azure_guid__in=modified):
+            az = self.tenant.users[user.azure_guid]
+            self.assertEqual(user.azure_ad_data["jobTitle"], az["jobTitle"])
+            self.assertEqual(user.azure_ad_data["userPrincipalName"], az["userPrincipalName"])
+            # The cached manager email is kept, including for a manager who isn't a department user.
+            manager_id = self.tenant.managers.get(user.azure_guid)
+            if manager_id:
+                self.assertEqual(user.azure_ad_data["manager"], {"id": manager_id, "mail": self.tenant.users[manager_id]["mail"]})
+
+    def test_expired_delta_link(self):
+        """All accounts are checked if the saved delta link has expired."""
+        with fake_graph(self.tenant) as server:
+            call_command("check_azure_accounts")
+            list_users = server.requests["list_users"]
+            self.tenant.expire_delta_tokens()
+            self.tenant.modify_users(5)
+            call_command("check_azure_accounts")
+            self.assertGreater(server.requests["list_users"], list_users)
+        self.assertEqual(self.delta_token(), str(self.tenant.version))
+
+
+@patch("organisation.management.commands.check_onprem_accounts.iter_blob_json")
+class CheckOnpremAccountsTestCase(TestCase):
+    """Tests for the check_onprem_accounts management command."""
+
+    def setUp(self):
+        self.changed = mixer.blend(DepartmentUser, email="changed@dbca.wa.gov.au", ad_guid=str(uuid4()), ad_data={}, ad_data_hash=None)
+        self.unchanged_ad = {"ObjectGUID": str(uuid4()), "EmailAddress": "unchanged@dbca.wa.gov.au"}
+        self.unchanged = mixer.blend(
+            DepartmentUser,
+            email="unchanged@dbca.wa.gov.au",
+            ad_guid=self.unchanged_ad["ObjectGUID"],
+            ad_data=self.unchanged_ad,
+            ad_data_hash=json_digest(self.unchanged_ad),
+        )
+        self.unlinked = mixer.blend(DepartmentUser, email="unlinked@dbca.wa.gov.au", ad_guid=None, ad_data=None)
+        self.admin = mixer.blend(DepartmentUser, email="unlinked-admin@dbca.wa.gov.au", ad_guid=None, ad_data=None)
+        self.invalid = mixer.blend(DepartmentUser, email="invalid@dbca.wa.gov.au", ad_guid=str(uuid4()))
+        self.stream = [
+            {"ObjectGUID": self.changed.ad_guid, "EmailAddress": "changed@dbca.wa.gov.au", "Title": "Ranger"},
+            self.unchanged_ad,
+            {"ObjectGUID": str(uuid4()), "EmailAddress": "Unlinked@dbca.wa.gov.au"},
+            {"ObjectGUID": str(uuid4()), "EmailAddress": "unlinked-admin@dbca.wa.gov.au"},
+        ]
+
+    @override_settings(ONPREM_AD_WRITE_BATCH_SIZE=1)
+    def test_check_onprem_accounts(self, mock_iter_blob_json):
+        """Changed and newly linked users are written in batches, and invalid GUIDs are removed."""
+        mock_iter_blob_json.return_value = iter(self.stream)
+        with patch.object(DepartmentUser.objects, "bulk_update", wraps=DepartmentUser.objects.bulk_update) as mock_bulk_update:
+            call_command("check_onprem_accounts", container="container", path="adusers.json")
+        mock_iter_blob_json.assert_called_once_with(container="container", blob="adusers.json")
+        # One batch each for the changed and the newly linked user; the unchanged user isn't written.
+        self.assertEqual([len(c[0][0]) for c in mock_bulk_update.call_args_list], [1, 1])
+
+        self.changed.refresh_from_db()
+        self.assertEqual(self.changed.ad_data, self.stream[0])
+        self.assertEqual(self.changed.ad_data_hash, json_digest(self.stream[0]))
+        self.unlinked.refresh_from_db()
+        self.assertEqual(self.unlinked.ad_guid, self.stream[2]["ObjectGUID"])
+        self.admin.refresh_from_db()
+        self.assertIsNone(self.admin.ad_guid)
+        self.invalid.refresh_from_db()
+        self.assertIsNone(self.invalid.ad_guid)
+
+    @override_settings(ONPREM_AD_WRITE_BATCH_SIZE=1)
+    def test_failed_download_applies_no_changes(self, mock_iter_blob_json):
+        """An error partway through the AD export leaves no changes applied."""
+        invalid_guid = self.invalid.ad_guid
+
+        def stream():
+            yield from self.stream[:3]
+            raise ValueError("Truncated JSON data")
+
+        mock_iter_blob_json.return_value = stream()
+        with self.assertRaises(ValueError):
+            call_command("check_onprem_accounts", container="container", path="adusers.json")
+
+        self.changed.refresh_from_db()
+        self.assertEqual(self.changed.ad_data, {})
+        self.unlinked.refresh_from_db()
+        self.assertIsNone(self.unlinked.ad_guid)
+        self.invalid.refresh_from_db()
+        self.assertEqual(self.invalid.ad_guid, invalid_guid)
+
+
+class AscenderSyntheticDataTestCase(TestCase):
+    """Tests for the ascender_synthetic_data management command."""
+
+    def employee_jobs(self, i, seed=0, max_jobs=3):
+        rng = random.Random(seed)
+        return AscenderSyntheticDataCommand().employee_jobs(rng, i, max_jobs, ["101", "102"], ["1 Smith Street, JONESVILLE"])
+
+    def test_employee_jobs(self):
+        """Generated job records have every Ascender column and are repeatable for a given seed."""
+        columns = {f[0] if isinstance(f, (list, tuple)) else f for f in FOREIGN_TABLE_FIELDS}
+        for i in range(50):
+            jobs = self.employee_jobs(i, max_jobs=2)
+            self.assertTrue(1 <= len(jobs) <= 2)
+            for job_no, job in enumerate(jobs, start=1):
+                self.assertTrue(set(job).issubset(columns))
+                self.assertEqual(job["employee_no"], str(100000 + i))
+                self.assertEqual(job["job_no"], str(job_no))
+                self.assertIn(job["paypoint"], ["101", "102"])
+            self.assertEqual(jobs, self.employee_jobs(i, max_jobs=2))
+
+    def test_employee_jobs_manager_hierarchy(self):
+        """Each employee reports to an employee with a lower number, apart from the first employee."""
+        self.assertIsNone(self.employee_jobs(0)[0]["manager_emp_no"])
+        for i in range(1, 200):
+            self.assertLess(int(self.employee_jobs(i)[0]["manager_emp_no"]), 100000 + i)
+
+    @override_settings(FOREIGN_DB_HOST="ascender.example.com", FOREIGN_TABLE="ascender", FOREIGN_TABLE_CC_MANAGER="cc_manager")
+    @patch("organisation.management.commands.ascender_synthetic_data.get_ascender_db_connection")
+    def test_remote_host_refused(self, mock_conn):
+        """Synthetic data isn't written to a remote database host unless --allow-remote is passed."""
+        with self.assertRaises(CommandError):
+            call_command("ascender_synthetic_data", employees=10)
+        mock_conn.assert_not_called()
+
+
+class AscenderBenchmarkTestCase(TestCase):
+    """Tests for the ascender_benchmark management command."""
+
+    def setUp(self):
+        command = AscenderSyntheticDataCommand()
+        rng = random.Random(0)
+        columns = [f[0] if isinstance(f, (list, tuple)) else f for f in FOREIGN_TABLE_FIELDS]
+        self.rows = [
+            row_to_python([job.get(col) for col in columns])
+            for i in range(20)
+            for job in command.employee_jobs(rng, i, 3, ["101"], ["1 Smith Street, JONESVILLE"])
+        ]
+
+    def fetch(self, *args, **kwargs):
+        return iter(self.rows)
+
+    def test_benchmark(self):
+        """Each phase is reported and database changes are rolled back."""
+        out = StringIO()
+        with (
+            patch("organisation.management.commands.ascender_benchmark.ascender_db_fetch", side_effect=self.fetch),
+            patch("organisation.ascender.ascender_db_fetch", side_effect=self.fetch),
+        ):
+            call_command("ascender_benchmark", match_ratio=0.5, stdout=out)
+        output = out.getvalue()
+        for phase in ["fetch", "fetch+group", "index", "validate", "write"]:
+            self.assertRegex(output, rf"(?m)^{re.escape(phase)}\s")
+        fetch = next(line for line in output.splitlines() if line.startswith("fetch "))
+        self.assertEqual(int(fetch.split()[1]), len(self.rows))
+        self.assertIn("Database changes rolled back", output)
+        self.assertFalse(DepartmentUser.objects.filter(email__endswith="@benchmark.invalid").exists())
@@ -0,0 +1,154 @@
+import logging
+from datetime import timedelta
+from uuid import uuid4
+
+from django.core import mail
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from mixer.backend.django import mixer
+
+from organisation.entra_id import EntraIdReconciler
+from organisation.microsoft_products import MS_PRODUCTS
+from organisation.models import CostCentre, DepartmentUser
+from organisation.utils import json_digest, ms_graph_user_transform, parse_ad_pwd_last_set
+
+# Disable non-critical logging output.
+logging.disable(logging.CRITICAL)
+
+
+def make_azure_user(**overrides):
+    """Return an Entra ID user dict, as returned by ms_graph_user_transform."""
+    user = {
+        "id": str(uuid4()),
+        "mail": "jane.smith@dbca.wa.gov.au",
+        "userPrincipalName": "jane.smith@dbca.wa.gov.au",
+        "displayName": "Jane Smith",
+        "givenName": "Jane",
+        "surname": "Smith",
+        "employeeId": None,
+        "employeeType": None,
+        "jobTitle": None,
+        "businessPhones": [],
+        "mobilePhone": None,
+        "department": None,
+        "companyName": None,
+        "officeLocation": None,
+        "proxyAddresses": [],
+        "accountEnabled": True,
+        "onPremisesSyncEnabled": True,
+        "onPremisesSamAccountName": None,
+        "lastPasswordChangeDateTime": None,
+        "createdDateTime": "2024-01-01T00:00:00Z",
+        "assignedLicenses": [{"skuId": MS_PRODUCTS["MICROSOFT 365 E5"]}],
+    }
+    user.update(overrides)
+    return ms_graph_user_transform(user)
+
+
+class EntraIdReconcilerTestCase(TestCase):
+    def setUp(self):
+        self.linked = mixer.blend(DepartmentUser, email="linked@dbca.wa.gov.au", azure_guid=str(uuid4()), employee_id=None)
+        self.unlinked = mixer.blend(DepartmentUser, email="unlinked@dbca.wa.gov.au", azure_guid=None, employee_id=None)
+        self.employee = mixer.blend(DepartmentUser, email="employee@dbca.wa.gov.au", azure_guid=None, employee_id="000123")
+
+    def test_classify(self):
+        reconciler = EntraIdReconciler()
+        cases = [
+            (make_azure_user(id=self.linked.azure_guid, userPrincipalName=self.linked.email), EntraIdReconciler.UPDATE),
+            (make_azure_user(userPrincipalName=self.unlinked.email), EntraIdReconciler.LINK),
+            (make_azure_user(userPrincipalName=self.linked.email), EntraIdReconciler.CONFLICT),
+            (make_azure_user(employeeId=self.employee.employee_id), EntraIdReconciler.CONFLICT),
+            (make_azure_user(), EntraIdReconciler.CREATE),
+            (make_azure_user(assignedLicenses=[]), EntraIdReconciler.SKIP),
+        ]
+        for az, action in cases:
+            self.assertEqual(reconciler.classify(az)[0], action)
+
+    def test_conflict_emails_admins(self):
+        reconciler = EntraIdReconciler()
+        self.assertEqual(reconciler.reconcile(make_azure_user(userPrincipalName=self.linked.email)), EntraIdReconciler.CONFLICT)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn("duplicate email", mail.outbox[0].subject)
+
+    def test_reconcile_and_flush(self):
+        cc = mixer.blend(CostCentre, code="001")
+        link = make_azure_user(userPrincipalName=self.unlinked.email, mail=self.unlinked.email)
+        update = make_azure_user(
+            id=self.linked.azure_guid, userPrincipalName=self.linked.email, mail=self.linked.email, accountEnabled=False
+        )
+        create = make_azure_user(userPrincipalName="new.user@dbca.wa.gov.au", mail="new.user@dbca.wa.gov.au", companyName="001")
+        reconciler = EntraIdReconciler()
+        for az in [link, update, create]:
+            reconciler.reconcile(az, member_groups={self.linked.azure_guid: ["group-1"]})
+
+        # Savepoint, one UPDATE for the changed users, one INSERT for the new user, release savepoint.
+        with self.assertNumQueries(4):
+            reconciler.flush()
+
+        self.unlinked.refresh_from_db()
+        self.assertEqual(self.unlinked.azure_guid, link["objectId"])
+        self.linked.refresh_from_db()
+        self.assertFalse(self.linked.active)
+        self.assertEqual(self.linked.assigned_groups, ["group-1"])
+        new_user = DepartmentUser.objects.get(azure_guid=create["objectId"])
+        self.assertEqual(new_user.cost_centre, cc)
+        self.assertEqual(new_user.assigned_licences, ["MICROSOFT 365 E5"])
+
+    def test_flush_only_writes_entra_id_fields(self):
+        """Fields which aren't sourced from Entra ID, edited elsewhere during the sync, aren't overwritten."""
+        az = make_azure_user(id=self.linked.azure_guid, userPrincipalName=self.linked.email, mail=self.linked.email)
+        reconciler = EntraIdReconciler()
+        DepartmentUser.objects.filter(pk=self.linked.pk).update(title="Edited title", telephone="08 9219 9000")
+        reconciler.reconcile(az)
+        reconciler.flush()
+        self.linked.refresh_from_db()
+        self.assertEqual(self.linked.azure_ad_data_hash, json_digest(az))
+        self.assertEqual(self.linked.title, "Edited title")
+        self.assertEqual(self.linked.telephone, "08 9219 9000")
+
+    def test_unchanged_account_skipped(self):
+        az = make_azure_user(id=self.linked.azure_guid, userPrincipalName=self.linked.email, mail=self.linked.email)
+        reconciler = EntraIdReconciler()
+        self.assertEqual(reconciler.reconcile(az), EntraIdReconciler.UPDATE)
+        reconciler.flush()
+
+        reconciler = EntraIdReconciler()
+        self.assertEqual(reconciler.reconcile(az), EntraIdReconciler.UNCHANGED)
+        # A change to group membership is written, even if the account data is unchanged.
+        self.assertEqual(reconciler.reconcile(az, member_groups={self.linked.azure_guid: ["group-2"]}), EntraIdReconciler.UPDATE)
+        self.assertEqual(reconciler.reconcile(dict(az, jobTitle="Ranger")), EntraIdReconciler.UPDATE)
+
+    def test_changed_onprem_data_applied(self):
+        """A change to the user's onprem AD data (e.g. pwdLastSet) is applied, even if the account data is unchanged."""
+        az = make_azure_user(id=self.linked.azure_guid, userPrincipalName=self.linked.email, mail=self.linked.email)
+        reconciler = EntraIdReconciler()
+        reconciler.reconcile(az)
+        reconciler.flush()
+        DepartmentUser.objects.filter(pk=self.linked.pk).update(
+            ad_data={"pwdLastSet": 133500000000000000}, ad_data_updated=timezone.now() + timedelta(seconds=1)
+        )
+
+        reconciler = EntraIdReconciler()
+        self.assertEqual(reconciler.reconcile(az), EntraIdReconciler.UPDATE)
+        reconciler.flush()
+        self.linked.refresh_from_db()
+        self.assertEqual(self.linked.last_password_change, parse_ad_pwd_last_set(133500000000000000))
+
+    @override_settings(ENTRA_ID_DATA_MAX_AGE_HOURS=24)
+    def test_outdated_account_data_refreshed(self):
+        az = make_azure_user(id=self.linked.azure_guid, userPrincipalName=self.linked.email, mail=self.linked.email)
+        reconciler = EntraIdReconciler()
+        reconciler.reconcile(az)
+        reconciler.flush()
+        DepartmentUser.objects.filter(pk=self.linked.pk).update(azure_ad_data_updated=timezone.now() - timedelta(hours=25))
+
+        reconciler = EntraIdReconciler()
+        self.assertEqual(reconciler.reconcile(az), EntraIdReconciler.UPDATE)
+
+    def test_unlink(self):
+        reconciler = EntraIdReconciler()
+        reconciler.unlink([self.linked.azure_guid, str(uuid4())])
+        reconciler.flush()
+        self.linked.refresh_from_db()
+        self.assertIsNone(self.linked.azure_guid)
+        self.assertEqual(reconciler.counts[EntraIdReconciler.UNLINK], 1)
@@ -2,13 +2,14 @@ import logging
 import random
 import string
 from datetime import date, timedelta
-from unittest.mock import patch
+from unittest.mock import MagicMock, patch
 from uuid import uuid1
 
 from django.test import TestCase
 from django.utils import timezone
 from mixer.backend.django import mixer
 
+from itassets import graph
 from itassets.test_api import random_dbca_email
 from organisation.microsoft_products import MS_PRODUCTS
 from organisation.models import AscenderActionLog, CostCentre, DepartmentUser, DepartmentUserLog, Location
@@ -565,6 +566,54 @@ class UpdateFromAscenderDataTestCase(TestCase):
         user.refresh_from_db()
         self.assertEqual(user.cost_centre, cc)
 
+    def test_update_with_writer_is_batched(self):
+        from organisation.ascender import AscenderSyncWriter
+
+        user = self._make_user({"first_name": "IVAN", "preferred_name": None, "surname": "HALL", "emp_status": "PFT"})
+        user.save()
+        stored_surname = DepartmentUser.objects.get(pk=user.pk).surname
+        user.surname = "Hill"  # differs
+        writer = AscenderSyncWriter()
+        log_count = AscenderActionLog.objects.count()
+        changed = user.update_from_ascender_data(writer=writer)
+        self.assertIn("surname", changed)
+        # Nothing is written until the writer is flushed.
+        self.assertEqual(DepartmentUser.objects.get(pk=user.pk).surname, stored_surname)
+        self.assertEqual(AscenderActionLog.objects.count(), log_count)
+        writer.add_user(user, changed | {"ascender_data"})
+        user.account_type = None
+        writer.flush()
+        user.refresh_from_db()
+        self.assertEqual(user.surname, "Hall")
+        self.assertEqual(user.account_type, 2)  # Derived from emp_status.
+        self.assertTrue(AscenderActionLog.objects.count() > log_count)
+
+    def test_writer_only_writes_changed_fields(self):
+        from organisation.ascender import AscenderSyncWriter
+
+        user = self._make_user({"first_name": "JANE", "preferred_name": None, "surname": "IRWIN", "emp_status": "PFT"})
+        user.save()
+        other = self._make_user({"first_name": "KATE", "preferred_name": None, "surname": "JONES", "emp_status": "PFT"})
+        other.save()
+        # Fields edited elsewhere (e.g. in the admin) after the users were loaded.
+        DepartmentUser.objects.filter(pk=user.pk).update(title="Edited title")
+        DepartmentUser.objects.filter(pk=other.pk).update(surname="Edited surname")
+        user.surname = "Irwin"
+        other.title = "Ranger"
+        writer = AscenderSyncWriter()
+        writer.add_user(user, {"surname"})
+        writer.add_user(other, {"title"})
+        with patch.object(DepartmentUser.objects, "bulk_update", wraps=DepartmentUser.objects.bulk_update) as mock_bulk_update:
+            writer.flush()
+        # One bulk_update per set of changed fields.
+        self.assertEqual(mock_bulk_update.call_count, 2)
+        user.refresh_from_db()
+        self.assertEqual(user.surname, "Irwin")
+        self.assertEqual(user.title, "Edited title")
+        other.refresh_from_db()
+        self.assertEqual(other.title, "Ranger")
+        self.assertEqual(other.surname, "Edited surname")
+
 
 # ---------------------------------------------------------------------------
 # DepartmentUser.get_graph_user() with mocked Graph API
@@ -585,6 +634,68 @@ class GetGraphUserTestCase(TestCase):
         self.assertIsNone(user.get_graph_user())
 
 
+# ---------------------------------------------------------------------------
+# DepartmentUser.sync_ad_data() with mocked Graph API
+# ---------------------------------------------------------------------------
+
+
+class SyncAdDataTestCase(TestCase):
+    def setUp(self):
+        self.token = {"token_type": "Bearer", "access_token": "dummy"}
+
+    def cloud_user(self):
+        return mixer.blend(
+            DepartmentUser,
+            active=True,
+            email=random_dbca_email,
+            name="Jane Doe",
+            title="Ranger",
+            employee_id=None,
+            assigned_licences=[],
+            dir_sync_enabled=False,
+            azure_guid=str(uuid1()),
+            azure_ad_data={"displayName": "Jane Smith", "jobTitle": "Senior Ranger"},
+            ad_guid=None,
+            ad_data={},
+            ascender_data={},
+        )
+
+    def batch_response(self, ids):
+        resp = MagicMock()
+        resp.json.return_value = {"responses": [{"id": i, "status": 204, "body": {}} for i in ids]}
+        return resp
+
+    @patch("itassets.graph.post")
+    def test_changes_merged_into_one_request(self, mock_post):
+        user = self.cloud_user()
+        mock_post.return_value = self.batch_response(["1-patch"])
+        user.sync_ad_data(token=self.token)
+
+        mock_post.assert_called_once()
+        requests = mock_post.call_args[1]["json"]["requests"]
+        self.assertEqual(len(requests), 1)
+        self.assertEqual(requests[0]["method"], "PATCH")
+        self.assertEqual(requests[0]["body"], {"displayName": "Jane Doe", "jobTitle": "Ranger"})
+
+    @patch("itassets.graph.post")
+    def test_changes_batched_across_users(self, mock_post):
+        batch = graph.GraphBatch(self.token)
+        for user in (self.cloud_user(), self.cloud_user()):
+            user.sync_ad_data(token=self.token, batch=batch)
+        mock_post.assert_not_called()
+
+        mock_post.return_value = self.batch_response(["1-patch", "2-patch"])
+        batch.flush()
+        mock_post.assert_called_once()
+        self.assertEqual(len(mock_post.call_args[1]["json"]["requests"]), 2)
+
+    @patch("itassets.graph.post")
+    def test_log_only(self, mock_post):
+        user = self.cloud_user()
+        user.sync_ad_data(token=self.token, log_only=True)
+        mock_post.assert_not_called()
+
+
 # ---------------------------------------------------------------------------
 # Model __str__ representations
 # ---------------------------------------------------------------------------
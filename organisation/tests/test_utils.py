@@ -1,18 +1,29 @@
+import json
 import os
 import re
 from datetime import datetime, timedelta, timezone
 from unittest.mock import MagicMock, patch
 
-from django.test import TestCase
+from django.test import TestCase, override_settings
 
 from organisation.utils import (
+    DeltaLinkExpired,
+    FreshserviceMirror,
+    OnpremChangeManifest,
+    SubscribedSkuCache,
     compare_values,
     generate_password,
+    get_freshservice_objects,
+    get_freshservice_session,
     ms_graph_get_subscribed_sku,
     ms_graph_get_user,
+    ms_graph_iter_users,
     ms_graph_list_signins_user,
+    ms_graph_list_member_groups_many,
     ms_graph_list_subscribed_skus,
     ms_graph_list_users,
+    ms_graph_site_storage_summary,
+    ms_graph_users_delta,
     ms_graph_validate_password,
     parse_ad_pwd_last_set,
     parse_windows_ts,
@@ -144,7 +155,7 @@ class ParseAdPwdLastSetTestCase(TestCase):
 
 
 class MsGraphListSubscribedSkusTestCase(TestCase):
-    @patch("organisation.utils.requests.get")
+    @patch("itassets.graph.get")
     def test_single_page(self, mock_get):
         skus = [{"skuId": "sku-001", "skuPartNumber": "M365_E5"}]
         mock_get.return_value = mock_response({"value": skus})
@@ -154,7 +165,7 @@ class MsGraphListSubscribedSkusTestCase(TestCase):
         self.assertEqual(result, skus)
         mock_get.assert_called_once()
 
-    @patch("organisation.utils.requests.get")
+    @patch("itassets.graph.get")
     def test_paginated_results(self, mock_get):
         page1 = {"value": [{"skuId": "sku-001"}], "@odata.nextLink": "https://graph.microsoft.com/next"}
         page2 = {"value": [{"skuId": "sku-002"}]}
@@ -178,7 +189,7 @@ class MsGraphListSubscribedSkusTestCase(TestCase):
 
 class MsGraphGetSubscribedSkuTestCase(TestCase):
     @patch.dict(os.environ, AZURE_TENANT_ENV)
-    @patch("organisation.utils.requests.get")
+    @patch("itassets.graph.get")
     def test_returns_sku_data(self, mock_get):
         sku_data = {"skuId": "sku-001", "consumedUnits": 10, "prepaidUnits": {"enabled": 100, "warning": 0}}
         mock_get.return_value = mock_response(sku_data)
@@ -199,7 +210,7 @@ class MsGraphGetSubscribedSkuTestCase(TestCase):
 
 
 class MsGraphListUsersTestCase(TestCase):
-    @patch("organisation.utils.requests.get")
+    @patch("itassets.graph.get")
     def test_returns_transformed_users(self, mock_get):
         user = make_graph_user()
         mock_get.return_value = mock_response({"value": [user]})
@@ -217,7 +228,7 @@ class MsGraphListUsersTestCase(TestCase):
         # assignedLicenses maps to skuId list.
         self.assertEqual(u["assignedLicenses"], ["sku-abc-123"])
 
-    @patch("organisation.utils.requests.get")
+    @patch("itassets.graph.get")
     def test_user_without_manager(self, mock_get):
         user = make_graph_user()
         # Graph API omits the "manager" key when not set.
@@ -227,7 +238,7 @@ class MsGraphListUsersTestCase(TestCase):
 
         self.assertIsNone(result[0]["manager"])
 
-    @patch("organisation.utils.requests.get")
+    @patch("itassets.graph.get")
     def test_user_with_manager(self, mock_get):
         user = make_graph_user()
         user["manager"] = {"id": "mgr-guid", "mail": "manager@example.com"}
@@ -237,7 +248,7 @@ class MsGraphListUsersTestCase(TestCase):
 
         self.assertEqual(result[0]["manager"], {"id": "mgr-guid", "mail": "manager@example.com"})
 
-    @patch("organisation.utils.requests.get")
+    @patch("itassets.graph.get")
     def test_paginated_results(self, mock_get):
         user1 = make_graph_user(id="guid-001", mail="a@example.com", userPrincipalName="a@example.com")
         user2 = make_graph_user(id="guid-002", mail="b@example.com", userPrincipalName="b@example.com")
@@ -249,7 +260,7 @@ class MsGraphListUsersTestCase(TestCase):
 
         self.assertEqual(len(result), 2)
 
-    @patch("organisation.utils.requests.get")
+    @patch("itassets.graph.get")
     def test_licensed_filter(self, mock_get):
         licensed_user = make_graph_user(
             id="guid-001", mail="a@example.com", userPrincipalName="a@example.com", assignedLicenses=[{"skuId": "sku-1"}]
@@ -262,7 +273,7 @@ class MsGraphListUsersTestCase(TestCase):
         self.assertEqual(len(result), 1)
         self.assertEqual(result[0]["objectId"], "guid-001")
 
-    @patch("organisation.utils.requests.get")
+    @patch("itassets.graph.get")
     def test_no_filter_returns_all(self, mock_get):
         licensed_user = make_graph_user(
             id="guid-001", mail="a@example.com", userPrincipalName="a@example.com", assignedLicenses=[{"skuId": "sku-1"}]
@@ -282,7 +293,7 @@ class MsGraphListUsersTestCase(TestCase):
 
         self.assertIsNone(result)
 
-    @patch("organisation.utils.requests.get")
+    @patch("itassets.graph.get")
     def test_null_fields_become_none(self, mock_get):
         user = make_graph_user(
             mail=None,
@@ -308,8 +319,84 @@ class MsGraphListUsersTestCase(TestCase):
         self.assertIsNone(u["telephoneNumber"])
 
 
+class MsGraphIterUsersTestCase(TestCase):
+    @patch("itassets.graph.get")
+    def test_yields_users_per_page(self, mock_get):
+        page1 = {"value": [make_graph_user()], "@odata.nextLink": "https://graph.microsoft.com/next"}
+        page2 = {"value": [make_graph_user(id="guid-2")]}
+        mock_get.side_effect = [mock_response(page1), mock_response(page2)]
+
+        users = ms_graph_iter_users(top=1, token=FAKE_TOKEN)
+
+        self.assertEqual(next(users)["userPrincipalName"], "jane.smith@example.com")
+        # The second page is not requested until it is consumed.
+        self.assertEqual(mock_get.call_count, 1)
+        self.assertEqual(mock_get.call_args[1]["params"]["$top"], 1)
+        self.assertEqual(next(users)["objectId"], "guid-2")
+
+    @patch("itassets.graph.get")
+    def test_select_properties(self, mock_get):
+        mock_get.return_value = mock_response({"value": [{"id": "guid-1", "mail": "Jane.Smith@example.com"}]})
+
+        result = list(ms_graph_iter_users(select="id,mail", token=FAKE_TOKEN))
+
+        self.assertEqual(result, [{"objectId": "guid-1", "mail": "jane.smith@example.com"}])
+        params = mock_get.call_args[1]["params"]
+        self.assertEqual(params["$select"], "id,mail")
+        self.assertNotIn("$expand", params)
+
+    @patch("itassets.graph.get")
+    def test_licensed_users(self, mock_get):
+        mock_get.return_value = mock_response({"value": [make_graph_user(), make_graph_user(id="guid-2", assignedLicenses=[])]})
+
+        result = list(ms_graph_iter_users(licensed=True, token=FAKE_TOKEN))
+
+        self.assertEqual(len(result), 1)
+
+
+class MsGraphUsersDeltaTestCase(TestCase):
+    @patch("itassets.graph.get")
+    def test_returns_changes_and_delta_link(self, mock_get):
+        page1 = {
+            "value": [make_graph_user()],
+            "@odata.nextLink": "https://graph.microsoft.com/v1.0/users/delta?$skiptoken=abc",
+        }
+        page2 = {
+            "value": [
+                {"id": "changed-guid", "jobTitle": "Ranger", "manager@delta": [{"id": "mgr-guid"}]},
+                {"id": "deleted-guid", "@removed": {"reason": "deleted"}},
+            ],
+            "@odata.deltaLink": "https://graph.microsoft.com/v1.0/users/delta?$deltatoken=xyz",
+        }
+        mock_get.side_effect = [mock_response(page1), mock_response(page2)]
+
+        users, delta_link = ms_graph_users_delta("https://graph.microsoft.com/v1.0/users/delta?$deltatoken=abc", token=FAKE_TOKEN)
+
+        self.assertEqual(delta_link, "https://graph.microsoft.com/v1.0/users/delta?$deltatoken=xyz")
+        self.assertEqual(users[0]["userPrincipalName"], "jane.smith@example.com")
+        # Changed users include only the changed properties.
+        self.assertEqual(users[1], {"objectId": "changed-guid", "jobTitle": "Ranger", "manager": {"id": "mgr-guid", "mail": None}})
+        self.assertEqual(users[2], {"objectId": "deleted-guid", "@removed": {"reason": "deleted"}})
+
+    @patch("itassets.graph.get")
+    def test_latest_delta_link(self, mock_get):
+        mock_get.return_value = mock_response({"value": [], "@odata.deltaLink": "https://graph.microsoft.com/next"})
+
+        users, delta_link = ms_graph_users_delta(latest=True, token=FAKE_TOKEN)
+
+        self.assertEqual(users, [])
+        self.assertEqual(mock_get.call_args[1]["params"]["$deltaToken"], "latest")
+
+    @patch("itassets.graph.get")
+    def test_expired_delta_link(self, mock_get):
+        mock_get.return_value = mock_response({"error": {"code": "syncStateNotFound"}}, status_code=410)
+
+        with self.assertRaises(DeltaLinkExpired):
+            ms_graph_users_delta("https://graph.microsoft.com/v1.0/users/delta?$deltatoken=abc", token=FAKE_TOKEN)
+
+
 class MsGraphGetUserTestCase(TestCase):
-    @patch("organisation.utils.requests.get")
+    @patch("itassets.graph.get")
     def test_returns_user_data(self, mock_get):
         user_data = make_graph_user()
         mock_get.return_value = mock_response(user_data)
@@ -329,8 +416,126 @@ class MsGraphGetUserTestCase(TestCase):
         self.assertIsNone(result)
 
 
+class MsGraphListMemberGroupsManyTestCase(TestCase):
+    @patch("organisation.utils.ms_graph_list_member_groups")
+    def test_returns_groups_by_guid(self, mock_list):
+        mock_list.side_effect = lambda azure_guid, token: [f"{azure_guid}-group"]
+
+        result = ms_graph_list_member_groups_many(["guid-1", "guid-2", "guid-3"], token=FAKE_TOKEN, max_workers=2)
+
+        self.assertEqual(result, {"guid-1": ["guid-1-group"], "guid-2": ["guid-2-group"], "guid-3": ["guid-3-group"]})
+        self.assertEqual(mock_list.call_count, 3)
+
+    @patch("organisation.utils.ms_graph_list_member_groups")
+    def test_failed_queries_omitted(self, mock_list):
+        def list_groups(azure_guid, token):
+            if azure_guid == "guid-2":
+                raise Exception("Too many requests")
+            return ["group"]
+
+        mock_list.side_effect = list_groups
+
+        result = ms_graph_list_member_groups_many(["guid-1", "guid-2"], token=FAKE_TOKEN)
+
+        self.assertEqual(result, {"guid-1": ["group"]})
+
+    @patch("organisation.utils.ms_graph_client_token")
+    def test_returns_empty_when_token_fails(self, mock_token):
+        mock_token.return_value = None
+
+        self.assertEqual(ms_graph_list_member_groups_many(["guid-1"]), {})
+
+
+class MsGraphSiteStorageSummaryTestCase(TestCase):
+    REPORT = (
+        "\ufeffReport Refresh Date,Site Id,Site URL,Owner Display Name,Is Deleted,Last Activity Date,File Count,"
+        "Active File Count,Page View Count,Visited Page Count,Storage Used (Byte),Storage Allocated (Byte)\r\n"
+        "2026-10-16,site-1,,,False,2026-10-15,100,1,1,1,2147483648,27487790694400\r\n"
+        "2026-10-16,site-2,,,False,2026-10-15,200,1,1,1,1073741824,27487790694400\r\n"
+        "2026-10-16,site-3,,,False,2026-10-15,5,1,1,1,1024,27487790694400\r\n"
+    ).encode("utf-8")
+
+    @patch("organisation.utils.upload_blob")
+    @patch("organisation.utils.ms_graph_get_site")
+    @patch("organisation.utils.ms_graph_site_storage_usage")
+    def test_resolves_new_sites_only(self, mock_usage, mock_get_site, mock_upload):
+        mock_usage.return_value = self.REPORT
+        mock_get_site.side_effect = lambda site_id, token: {"webUrl": f"https://dpaw.sharepoint.com/sites/{site_id}"}
+
+        site_urls = ms_graph_site_storage_summary(
+            ds="2026-10-16",
+            token=FAKE_TOKEN,
+            site_urls={"site-1": "https://dpaw.sharepoint.com/sites/one", "site-9": "https://dpaw.sharepoint.com/sites/nine"},
+        )
+
+        # Only the uncached site >= 1 GB is queried, and sites not in the report are dropped.
+        mock_get_site.assert_called_once_with("site-2", FAKE_TOKEN)
+        self.assertEqual(
+            site_urls, {"site-1": "https://dpaw.sharepoint.com/sites/one", "site-2": "https://dpaw.sharepoint.com/sites/site-2"}
+        )
+        csv_lines = mock_upload.call_args[1]["in_file"].read().decode().splitlines()
+        self.assertEqual(csv_lines[0], "Report Refresh Date,Site URL,Last Activity Date,File Count,Storage Used (Byte)")
+        self.assertEqual(csv_lines[1], "2026-10-16,/sites/one,2026-10-15,100,2147483648")
+        self.assertEqual(len(csv_lines), 3)
+
+
+class OnpremChangeManifestTestCase(TestCase):
+    def setUp(self):
+        self.manifest = OnpremChangeManifest(container="azuread", run_id="run-1")
+
+    @override_settings(ONPREM_CHANGES_PER_PROPERTY=False)
+    @patch("organisation.utils.upload_blob")
+    def test_changes_uploaded_as_ndjson(self, mock_upload):
+        self.manifest.add({"identity": "guid-1", "property": "DisplayName", "value": "Jane Smith"})
+        self.manifest.add({"identity": "guid-1", "property": "Company", "value": "001"})
+        mock_upload.assert_not_called()
+        self.manifest.flush()
+
+        in_file, container, blob = mock_upload.call_args[0]
+        self.assertEqual((container, blob), ("azuread", "onprem_changes/run-1_0001.ndjson"))
+        changes = [json.loads(line) for line in in_file.read().decode().splitlines()]
+        self.assertEqual(
+            [(i["run_id"], i["sequence"], i["property"]) for i in changes], [("run-1", 1, "DisplayName"), ("run-1", 2, "Company")]
+        )
+
+    @override_settings(ONPREM_CHANGES_PER_PROPERTY=False, ONPREM_CHANGE_MANIFEST_SIZE=2)
+    @patch("organisation.utils.upload_blob")
+    def test_manifest_uploaded_in_parts(self, mock_upload):
+        for i in range(3):
+            self.manifest.add({"identity": f"guid-{i}", "property": "Enabled", "value": False})
+        self.manifest.flush()
+        self.manifest.flush()  # No further changes to upload.
+
+        self.assertEqual(
+            [i[0][2] for i in mock_upload.call_args_list], ["onprem_changes/run-1_0001.ndjson", "onprem_changes/run-1_0002.ndjson"]
+        )
+
+    @override_settings(ONPREM_CHANGES_PER_PROPERTY=False)
+    @patch("organisation.utils.LOGGER")
+    @patch("organisation.utils.upload_blob")
+    def test_upload_failure_logged(self, mock_upload, mock_logger):
+        mock_upload.side_effect = Exception("Upload failed")
+        self.manifest.add({"identity": "guid-1", "property": "Enabled", "value": False})
+        self.manifest.flush()
+        mock_logger.error.assert_called_once()
+
+    @override_settings(ONPREM_CHANGES_PER_PROPERTY=True)
+    @patch("organisation.utils.upload_blobs")
+    def test_per_property_layout(self, mock_upload_blobs):
+        mock_upload_blobs.return_value = {}
+        self.manifest.add({"identity": "guid-1", "property": "Surname", "value": "Smith"})
+        self.manifest.add({"identity": "guid-1", "property": "Surname", "value": "Smyth"})
+        self.manifest.flush()
+
+        blobs = dict(mock_upload_blobs.call_args[0][0])
+        self.assertEqual(list(blobs.keys()), ["onprem_changes/guid-1_Surname.json"])
+        self.assertEqual(
+            json.loads(blobs["onprem_changes/guid-1_Surname.json"]), {"identity": "guid-1", "property": "Surname", "value": "Smyth"}
+        )
+
+
 class MsGraphValidatePasswordTestCase(TestCase):
-    @patch("organisation.utils.requests.post")
+    @patch("itassets.graph.post")
     def test_valid_password(self, mock_post):
         mock_post.return_value = mock_response({"isValid": True})
 
@@ -340,7 +545,7 @@ class MsGraphValidatePasswordTestCase(TestCase):
         called_url = mock_post.call_args[0][0]
         self.assertIn("validatePassword", called_url)
 
-    @patch("organisation.utils.requests.post")
+    @patch("itassets.graph.post")
     def test_invalid_password(self, mock_post):
         mock_post.return_value = mock_response({"isValid": False})
 
@@ -358,7 +563,7 @@ class MsGraphValidatePasswordTestCase(TestCase):
 
 
 class MsGraphListSigninsUserTestCase(TestCase):
-    @patch("organisation.utils.requests.get")
+    @patch("itassets.graph.get")
     def test_returns_signins(self, mock_get):
         signins = [
             {"id": "signin-001", "createdDateTime": "2024-06-01T10:00:00Z", "isInteractive": True},
@@ -372,7 +577,7 @@ class MsGraphListSigninsUserTestCase(TestCase):
         called_url = mock_get.call_args[0][0]
         self.assertIn("signIns", called_url)
 
-    @patch("organisation.utils.requests.get")
+    @patch("itassets.graph.get")
     def test_passes_top_parameter(self, mock_get):
         mock_get.return_value = mock_response({"value": []})
 
@@ -381,7 +586,7 @@ class MsGraphListSigninsUserTestCase(TestCase):
         params = mock_get.call_args[1]["params"]
         self.assertEqual(params["$top"], 10)
 
-    @patch("organisation.utils.requests.get")
+    @patch("itassets.graph.get")
     def test_filters_by_user_guid(self, mock_get):
         mock_get.return_value = mock_response({"value": []})
 
@@ -397,3 +602,122 @@ class MsGraphListSigninsUserTestCase(TestCase):
         result = ms_graph_list_signins_user("user-guid-001")
 
         self.assertIsNone(result)
+
+
+class SubscribedSkuCacheTestCase(TestCase):
+    def setUp(self):
+        self.skus = [
+            {"skuId": "sku-001", "consumedUnits": 9, "prepaidUnits": {"enabled": 8, "warning": 2}},
+            {"skuId": "sku-002", "consumedUnits": 5, "prepaidUnits": {"enabled": 5, "warning": 0}},
+        ]
+
+    @patch("organisation.utils.ms_graph_list_subscribed_skus")
+    def test_single_query_for_all_skus(self, mock_list):
+        mock_list.return_value = self.skus
+        cache = SubscribedSkuCache(ttl=300)
+
+        self.assertEqual(cache.available("sku-001", FAKE_TOKEN), 1)
+        self.assertEqual(cache.available("sku-002", FAKE_TOKEN), 0)
+        self.assertIsNone(cache.available("sku-003", FAKE_TOKEN))
+        mock_list.assert_called_once()
+
+    @patch("organisation.utils.ms_graph_list_subscribed_skus")
+    def test_refreshes_after_ttl(self, mock_list):
+        mock_list.return_value = self.skus
+        cache = SubscribedSkuCache(ttl=0)
+
+        cache.get("sku-001", FAKE_TOKEN)
+        cache.get("sku-001", FAKE_TOKEN)
+        self.assertEqual(mock_list.call_count, 2)
+
+    @patch("organisation.utils.ms_graph_list_subscribed_skus")
+    def test_consume_decrements_availability(self, mock_list):
+        mock_list.return_value = self.skus
+        cache = SubscribedSkuCache(ttl=300)
+
+        cache.get("sku-001", FAKE_TOKEN)
+        cache.consume(["sku-001", "sku-003"])
+        self.assertEqual(cache.available("sku-001", FAKE_TOKEN), 0)
+        mock_list.assert_called_once()
+
+    @patch("organisation.utils.ms_graph_list_subscribed_skus")
+    def test_failed_query_is_not_cached(self, mock_list):
+        mock_list.return_value = None
+        cache = SubscribedSkuCache(ttl=300)
+
+        self.assertIsNone(cache.get("sku-001", FAKE_TOKEN))
+        mock_list.return_value = self.skus
+        self.assertIsNotNone(cache.get("sku-001", FAKE_TOKEN))
+        self.assertEqual(mock_list.call_count, 2)
+
+
+class GetFreshserviceSessionTestCase(TestCase):
+    def setUp(self):
+        patcher = patch("organisation.utils.FRESHSERVICE_SESSION", None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @override_settings(FRESHSERVICE_TIMEOUT=15, FRESHSERVICE_MAX_RETRIES=2)
+    def test_session_uses_freshservice_settings(self):
+        session = get_freshservice_session()
+        self.assertIs(get_freshservice_session(), session)
+        self.assertEqual(session.timeout, 15)
+        self.assertEqual(session.get_adapter("https://example.freshservice.com").max_retries.total, 2)
+
+
+class GetFreshserviceObjectsTestCase(TestCase):
+    @patch("organisation.utils.get_freshservice_session")
+    def test_pages_until_final_page(self, mock_session):
+        def get(url, params):
+            resp = MagicMock()
+            resp.json.return_value = {"requesters": [{"id": params["page"]}] if params["page"] <= 5 else []}
+            # The final page (5) has no link header.
+            resp.headers = {"link": "next"} if params["page"] < 5 else {}
+            return resp
+
+        mock_session.return_value.get.side_effect = get
+
+        result = get_freshservice_objects("requesters", max_workers=3)
+
+        self.assertEqual([i["id"] for i in result], [1, 2, 3, 4, 5])
+
+
+class FreshserviceMirrorTestCase(TestCase):
+    def setUp(self):
+        self.objects = [
+            {"id": 1, "primary_email": "jane@example.com"},
+            {"id": 2, "primary_email": "john@example.com"},
+        ]
+
+    @patch("organisation.utils.get_freshservice_objects")
+    def test_indexed_lookup(self, mock_get):
+        mock_get.return_value = self.objects
+        mirror = FreshserviceMirror("requesters", ttl=300)
+
+        self.assertEqual(mirror.get("primary_email", "john@example.com")["id"], 2)
+        self.assertEqual(mirror.get("id", 1)["primary_email"], "jane@example.com")
+        self.assertIsNone(mirror.get("primary_email", "nobody@example.com"))
+        # All objects are downloaded once, for any number of lookups.
+        mock_get.assert_called_once_with("requesters")
+
+    @patch("organisation.utils.get_freshservice_objects")
+    def test_incremental_refresh(self, mock_get):
+        mock_get.return_value = self.objects
+        mirror = FreshserviceMirror("tickets", incremental=True, ttl=0)
+        mirror.get("id", 1)
+
+        mock_get.return_value = [{"id": 2, "primary_email": "john.smith@example.com"}]
+        self.assertEqual(mirror.get("primary_email", "john.smith@example.com")["id"], 2)
+        self.assertIsNone(mirror.get("primary_email", "john@example.com"))
+        self.assertIn("updated_since", mock_get.call_args[1]["params"])
+
+    @patch("organisation.utils.get_freshservice_objects")
+    def test_add(self, mock_get):
+        mock_get.return_value = self.objects
+        mirror = FreshserviceMirror("requesters", ttl=300)
+        mirror.get("primary_email", "jane@example.com")
+
+        mirror.add({"id": 3, "primary_email": "new@example.com"})
+
+        self.assertEqual(mirror.get("primary_email", "new@example.com")["id"], 3)
+        mock_get.assert_called_once()
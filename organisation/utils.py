@@ -1,18 +1,34 @@
+import hashlib
+import json
+import logging
 import os
 import random
 import re
 import string
-from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
 from io import BytesIO
-from typing import Dict, Iterable, List, Optional
+from threading import Lock
+from time import monotonic
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+from uuid import uuid4
 
 import requests
 import unicodecsv as csv
 from django.conf import settings
+from requests.adapters import HTTPAdapter, Retry
 
-from itassets.utils import ms_graph_client_token, upload_blob
+from itassets import graph
+from itassets.utils import TimeoutSession, ms_graph_client_token, upload_blob, upload_blobs
 
 FRESHSERVICE_AUTH = (settings.FRESHSERVICE_API_KEY, "X")
+FRESHSERVICE_SESSION = None
+FRESHSERVICE_SESSION_LOCK = Lock()
+# Local mirrors of Freshservice objects, by object type (see get_freshservice_mirror).
+FRESHSERVICE_MIRRORS = {}
+# Freshservice object types which may be listed using the updated_since filter.
+FRESHSERVICE_UPDATED_SINCE_TYPES = ("tickets",)
+LOGGER = logging.getLogger("organisation")
 
 
 def title_except(s: str, exceptions: Optional[Iterable[str]] = None, acronyms: Optional[Iterable[str]] = None) -> str:
@@ -124,19 +140,7 @@ def ms_graph_list_subscribed_skus(token: Optional[dict] = None) -> List[Dict] |
 
     headers = {"Authorization": f"{token['token_type']} {token['access_token']}"}
     url = "https://graph.microsoft.com/v1.0/subscribedSkus"
-    skus = []
-    resp = requests.get(url, headers=headers)
-    resp.raise_for_status()
-    j = resp.json()
-
-    while "@odata.nextLink" in j:
-        skus = skus + j["value"]
-        resp = requests.get(j["@odata.nextLink"], headers=headers)
-        resp.raise_for_status()
-        j = resp.json()
-
-    skus = skus + j["value"]  # Final page.
-    return skus
+    return list(graph.paginate(url, headers))
 
 
 def ms_graph_get_subscribed_sku(sku_id: str, token: Optional[dict] = None) -> Dict | None:
@@ -152,79 +156,217 @@ def ms_graph_get_subscribed_sku(sku_id: str, token: Optional[dict] = None) -> Di
     azure_tenant_id = os.environ["AZURE_TENANT_ID"]
     url = f"https://graph.microsoft.com/v1.0/subscribedSkus/{azure_tenant_id}_{sku_id}"
     try:
-        resp = requests.get(url, headers=headers)
+        resp = graph.get(url, headers=headers)
         resp.raise_for_status()
     except (requests.exceptions.HTTPError, requests.exceptions.RequestException, Exception):
         return None
     return resp.json()
 
 
-def ms_graph_list_users(licensed: bool = False, token: Optional[dict] = None) -> List[Dict] | None:
-    """Query the Microsoft Graph API for Entra ID user accounts in our tenancy.
-    Passing `licensed=True` will return only those users having >0 licenses assigned.
+class SubscribedSkuCache:
+    """A cache of the subscribed licence SKUs in our tenant, keyed by skuId.
+    All SKUs are fetched in a single subscribedSkus query and kept for `ttl` seconds (default
+    M365_SKU_CACHE_SECONDS). Licences assigned by this process are recorded against the cached
+    consumedUnits values, so that availability remains approximately correct until the next refresh.
+    """
+
+    def __init__(self, ttl: Optional[int] = None):
+        self.ttl = ttl
+        self.skus = {}
+        self.fetched = None
+        self.lock = Lock()
+
+    def expired(self) -> bool:
+        ttl = self.ttl if self.ttl is not None else settings.M365_SKU_CACHE_SECONDS
+        return self.fetched is None or monotonic() - self.fetched >= ttl
+
+    def refresh(self, token: Optional[dict] = None) -> None:
+        """Replace the cached SKUs with the current list from the Graph API."""
+        try:
+            skus = ms_graph_list_subscribed_skus(token)
+        except (requests.exceptions.HTTPError, requests.exceptions.RequestException, Exception):
+            skus = None
+        if skus is None:  # Leave the cache expired, so that the next query retries.
+            self.skus = {}
+            self.fetched = None
+            return
+        self.skus = {sku["skuId"]: sku for sku in skus}
+        self.fetched = monotonic()
+
+    def get(self, sku_id: str, token: Optional[dict] = None) -> Dict | None:
+        """Returns the cached subscribedSku object for `sku_id`, refreshing the cache if required."""
+        with self.lock:
+            if self.expired():
+                self.refresh(token)
+            return self.skus.get(sku_id)
+
+    def available(self, sku_id: str, token: Optional[dict] = None) -> int | None:
+        """Returns the number of assignable licences for `sku_id` (prepaidUnits enabled + warning,
+        less consumedUnits), or None if the SKU is unknown.
+        """
+        sku = self.get(sku_id, token)
+        if not sku:
+            return None
+        return sku["prepaidUnits"]["enabled"] + sku["prepaidUnits"]["warning"] - sku["consumedUnits"]
+
+    def consume(self, sku_ids: Iterable[str]) -> None:
+        """Record that one licence of each of `sku_ids` has been assigned."""
+        with self.lock:
+            for sku_id in sku_ids:
+                if sku_id in self.skus:
+                    self.skus[sku_id]["consumedUnits"] += 1
+
+    def clear(self) -> None:
+        with self.lock:
+            self.skus = {}
+            self.fetched = None
+
+
+SUBSCRIBED_SKU_CACHE = SubscribedSkuCache()
+
+
+# Microsoft Graph user properties requested for Entra ID user accounts.
+MS_GRAPH_USER_SELECT = "id,mail,userPrincipalName,displayName,givenName,surname,employeeId,employeeType,jobTitle,businessPhones,mobilePhone,department,companyName,officeLocation,proxyAddresses,accountEnabled,onPremisesSyncEnabled,onPremisesSamAccountName,lastPasswordChangeDateTime,assignedLicenses,createdDateTime"
+
+
+def ms_graph_user_transform(user: Dict, partial: bool = False) -> Dict:
+    """Transform a Microsoft Graph user object into the format which we cache on DepartmentUser.azure_ad_data.
+    Passing `partial=True` will return only those keys for which the source property is present
+    (a delta query returns only the changed properties of an updated user).
+    """
+    fields = {
+        "objectId": ("id", lambda v: v),
+        "userPrincipalName": ("userPrincipalName", lambda v: v.lower()),
+        "mail": ("mail", lambda v: v.lower() if v else None),
+        "displayName": ("displayName", lambda v: v if v else None),
+        "givenName": ("givenName", lambda v: v if v else None),
+        "surname": ("surname", lambda v: v if v else None),
+        "employeeId": ("employeeId", lambda v: v if v else None),
+        "employeeType": ("employeeType", lambda v: v if v else None),
+        "jobTitle": ("jobTitle", lambda v: v if v else None),
+        "telephoneNumber": ("businessPhones", lambda v: v[0] if v else None),
+        "mobilePhone": ("mobilePhone", lambda v: v if v else None),
+        "department": ("department", lambda v: v if v else None),
+        "companyName": ("companyName", lambda v: v if v else None),
+        "officeLocation": ("officeLocation", lambda v: v if v else None),
+        "proxyAddresses": ("proxyAddresses", lambda v: [i.lower().replace("smtp:", "") for i in v if i.lower().startswith("smtp")]),
+        "accountEnabled": ("accountEnabled", lambda v: v),
+        "onPremisesSyncEnabled": ("onPremisesSyncEnabled", lambda v: v),
+        "onPremisesSamAccountName": ("onPremisesSamAccountName", lambda v: v),
+        "lastPasswordChangeDateTime": ("lastPasswordChangeDateTime", lambda v: v),
+        "createdDateTime": ("createdDateTime", lambda v: v),
+        "assignedLicenses": ("assignedLicenses", lambda v: [i["skuId"] for i in v]),
+    }
+    user_data = {key: transform(user[prop]) for key, (prop, transform) in fields.items() if not partial or prop in user}
+
+    if "manager" in user:
+        user_data["manager"] = {"id": user["manager"]["id"], "mail": user["manager"]["mail"]}
+    elif "manager@delta" in user:
+        # A delta query returns only the ID of a changed manager, or a removed manager.
+        manager = [i for i in user["manager@delta"] if "@removed" not in i]
+        user_data["manager"] = {"id": manager[0]["id"], "mail": None} if manager else None
+    elif not partial:
+        user_data["manager"] = None
+
+    return user_data
+
+
+def ms_graph_iter_users(
+    licensed: bool = False, select: Optional[str] = None, top: Optional[int] = None, token: Optional[dict] = None
+) -> Iterator[Dict]:
+    """Query the Microsoft Graph API for Entra ID user accounts in our tenancy, yielding each transformed
+    user as each page of results is returned (pages of `top` users, default settings.MS_GRAPH_PAGE_SIZE).
+    Passing `licensed=True` will yield only those users having >0 licenses assigned.
+    Pass a comma-separated list of properties as `select` to query only those properties (users are
+    then transformed as partial data, and the manager is not expanded).
+    Yields nothing if the access token could not be obtained.
     Reference: https://learn.microsoft.com/en-us/graph/api/user-list
     """
     if not token:
         token = ms_graph_client_token()
     if not token:  # The call to the MS API occasionally fails.
-        return None
+        return
 
     headers = {
         "Authorization": f"Bearer {token['access_token']}",
         "ConsistencyLevel": "eventual",
     }
     params = {
-        "$select": "id,mail,userPrincipalName,displayName,givenName,surname,employeeId,employeeType,jobTitle,businessPhones,mobilePhone,department,companyName,officeLocation,proxyAddresses,accountEnabled,onPremisesSyncEnabled,onPremisesSamAccountName,lastPasswordChangeDateTime,assignedLicenses,createdDateTime",
-        "$expand": "manager($select=id,mail)",
+        "$select": select or MS_GRAPH_USER_SELECT,
+        "$top": top or settings.MS_GRAPH_PAGE_SIZE,
     }
+    if not select:
+        params["$expand"] = "manager($select=id,mail)"
+    if licensed and select and "assignedLicenses" not in select.split(","):
+        params["$select"] = f"{select},assignedLicenses"
     url = "https://graph.microsoft.com/v1.0/users"
-    resp = requests.get(url, headers=headers, params=params)
-    resp.raise_for_status()
-    j = resp.json()
+
+    # Transform the returned data.
+    for user in graph.paginate(url, headers, params):
+        user = ms_graph_user_transform(user, partial=bool(select))
+        if not licensed or user["assignedLicenses"]:
+            yield user
+
+
+def ms_graph_list_users(licensed: bool = False, token: Optional[dict] = None) -> List[Dict] | None:
+    """Query the Microsoft Graph API for Entra ID user accounts in our tenancy.
+    Passing `licensed=True` will return only those users having >0 licenses assigned.
+    Consider using ms_graph_iter_users to process users as they are returned.
+    """
+    if not token:
+        token = ms_graph_client_token()
+    if not token:  # The call to the MS API occasionally fails.
+        return None
+
+    return list(ms_graph_iter_users(licensed=licensed, token=token))
+
+
+class DeltaLinkExpired(Exception):
+    """Raised when a Microsoft Graph delta link is no longer valid, and a full synchronisation is required."""
+
+
+def ms_graph_users_delta(delta_link: Optional[str] = None, latest: bool = False, token: Optional[dict] = None) -> tuple | None:
+    """Query the Microsoft Graph API for changes to Entra ID user accounts since the passed-in `delta_link`
+    (from a previous query). Without a `delta_link`, returns all user accounts. Passing `latest=True`
+    will return no users, only a delta link to track changes from this point in time.
+    Returns a tuple of (users, delta link). Each user is transformed as partial data (changed properties
+    only), or is a dict of {"objectId", "@removed"} for a deleted user.
+    Raises DeltaLinkExpired if the service requires a full synchronisation.
+    Reference: https://learn.microsoft.com/en-us/graph/api/user-delta
+    """
+    if not token:
+        token = ms_graph_client_token()
+    if not token:  # The call to the MS API occasionally fails.
+        return None
+
+    headers = {
+        "Authorization": f"Bearer {token['access_token']}",
+    }
+    if delta_link:
+        # The delta link already includes the original query parameters.
+        url, params = delta_link, None
+    else:
+        url, params = "https://graph.microsoft.com/v1.0/users/delta", {"$select": f"{MS_GRAPH_USER_SELECT},manager"}
+        if latest:
+            params["$deltaToken"] = "latest"
     users = []
 
-    while "@odata.nextLink" in j:
-        users = users + j["value"]
-        resp = requests.get(j["@odata.nextLink"], headers=headers)
+    while url:
+        resp = graph.get(url, headers=headers, params=params)
+        if delta_link and resp.status_code in (400, 410):
+            # An expired or invalid delta token returns 410 Gone, or an error code e.g. syncStateNotFound.
+            raise DeltaLinkExpired(f"Delta link is no longer valid ({resp.status_code}): {resp.text}")
         resp.raise_for_status()
         j = resp.json()
+        for user in j["value"]:
+            if "@removed" in user:
+                users.append({"objectId": user["id"], "@removed": user["@removed"]})
+            else:
+                users.append(ms_graph_user_transform(user, partial=True))
+        # The next link (and delta link) already include the original query parameters.
+        url, params = j.get("@odata.nextLink"), None
 
-    users = users + j["value"]  # Final page
-    entra_users = []
-
-    # Transform the returned data.
-    for user in users:
-        user_data = {
-            "objectId": user["id"],
-            "userPrincipalName": user["userPrincipalName"].lower(),
-            "mail": user["mail"].lower() if user["mail"] else None,
-            "displayName": user["displayName"] if user["displayName"] else None,
-            "givenName": user["givenName"] if user["givenName"] else None,
-            "surname": user["surname"] if user["surname"] else None,
-            "employeeId": user["employeeId"] if user["employeeId"] else None,
-            "employeeType": user["employeeType"] if user["employeeType"] else None,
-            "jobTitle": user["jobTitle"] if user["jobTitle"] else None,
-            "telephoneNumber": user["businessPhones"][0] if user["businessPhones"] else None,
-            "mobilePhone": user["mobilePhone"] if user["mobilePhone"] else None,
-            "department": user["department"] if user["department"] else None,
-            "companyName": user["companyName"] if user["companyName"] else None,
-            "officeLocation": user["officeLocation"] if user["officeLocation"] else None,
-            "proxyAddresses": [i.lower().replace("smtp:", "") for i in user["proxyAddresses"] if i.lower().startswith("smtp")],
-            "accountEnabled": user["accountEnabled"],
-            "onPremisesSyncEnabled": user["onPremisesSyncEnabled"],
-            "onPremisesSamAccountName": user["onPremisesSamAccountName"],
-            "lastPasswordChangeDateTime": user["lastPasswordChangeDateTime"],
-            "createdDateTime": user["createdDateTime"],
-            "assignedLicenses": [i["skuId"] for i in user["assignedLicenses"]],
-            "manager": {"id": user["manager"]["id"], "mail": user["manager"]["mail"]} if "manager" in user else None,
-        }
-
-        entra_users.append(user_data)
-
-    if licensed:
-        return [u for u in entra_users if u["assignedLicenses"]]
-    else:
-        return entra_users
+    return users, j["@odata.deltaLink"]
 
 
 def ms_graph_get_user(azure_guid: str, token: Optional[dict] = None) -> Dict | None:
@@ -242,7 +384,7 @@ def ms_graph_get_user(azure_guid: str, token: Optional[dict] = None) -> Dict | N
         "$expand": "manager($select=id,mail)",
     }
     url = f"https://graph.microsoft.com/v1.0/users/{azure_guid}"
-    resp = requests.get(url, headers=headers, params=params)
+    resp = graph.get(url, headers=headers, params=params)
     resp.raise_for_status()
     return resp.json()
 
@@ -261,7 +403,7 @@ def ms_graph_get_group(azure_guid: str, token: Optional[dict] = None) -> Dict |
         "$select": "id,displayName,description,mail,securityEnabled,assignedLicenses",
     }
     url = f"https://graph.microsoft.com/v1.0/groups/{azure_guid}"
-    resp = requests.get(url, headers=headers, params=params)
+    resp = graph.get(url, headers=headers, params=params)
     resp.raise_for_status()
     return resp.json()
 
@@ -277,19 +419,43 @@ def ms_graph_list_member_groups(azure_guid: str, token: Optional[dict] = None) -
     }
     payload = {"securityEnabledOnly": False}
     url = f"https://graph.microsoft.com/v1.0/users/{azure_guid}/getMemberGroups"
-    resp = requests.post(url, headers=headers, json=payload)
+    resp = graph.post(url, headers=headers, json=payload)
     resp.raise_for_status()
-    j = resp.json()
-    groups = []
+    return list(graph.paginate(url, headers, first_page=resp.json()))
 
-    while "@odata.nextLink" in j:
-        groups = groups + j["value"]
-        resp = requests.get(j["@odata.nextLink"], headers=headers)
-        resp.raise_for_status()
-        j = resp.json()
 
-    groups = groups + j["value"]  # Final page.
-    return groups
+def ms_graph_query_many(query: Callable, keys: Iterable[str], token: Dict, max_workers: Optional[int] = None) -> Dict:
+    """Call `query(key, token)` for each of `keys` concurrently, using a bounded pool of worker threads
+    (defaults to settings.MS_GRAPH_MAX_WORKERS). Throttled requests are retried by the shared Graph
+    session, honouring the Retry-After header.
+    Returns a dict of {key: result}; keys whose query raised an exception are omitted.
+    """
+    # Don't run more workers than the session has pooled connections.
+    max_workers = min(max_workers or settings.MS_GRAPH_MAX_WORKERS, settings.MS_GRAPH_POOL_SIZE)
+    results = {}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(query, key, token): key for key in keys}
+        for future in as_completed(futures):
+            key = futures[future]
+            try:
+                results[key] = future.result()
+            except Exception as e:
+                LOGGER.warning(f"Call to {getattr(query, '__name__', query)} for {key} raised exception: {e}")
+
+    return results
+
+
+def ms_graph_list_member_groups_many(azure_guids: Iterable[str], token: Optional[dict] = None, max_workers: Optional[int] = None) -> Dict:
+    """Query the Microsoft Graph API for the group membership of many Entra ID users concurrently.
+    Returns a dict of {azure_guid: [group IDs]}; users whose query failed are omitted.
+    """
+    if not token:
+        token = ms_graph_client_token()
+    if not token:  # The call to the MS API occasionally fails and returns None.
+        return {}
+
+    return ms_graph_query_many(ms_graph_list_member_groups, azure_guids, token, max_workers)
 
 
 def ms_graph_validate_password(password: str, token: Optional[dict] = None) -> bool | None:
@@ -302,40 +468,50 @@ def ms_graph_validate_password(password: str, token: Optional[dict] = None) -> b
         "Authorization": f"Bearer {token['access_token']}",
     }
     url = "https://graph.microsoft.com/beta/users/validatePassword"
-    resp = requests.post(url, headers=headers, json={"password": password})
+    resp = graph.post(url, headers=headers, json={"password": password})
     res = resp.json()
     return res["isValid"]
 
 
-def ms_graph_list_sites(team_sites: bool = True, token: Optional[dict] = None) -> List[Dict] | None:
-    """Query the Microsoft Graph API for details about SharePoint Sites.
+def ms_graph_iter_sites(
+    team_sites: bool = True, select: Optional[str] = None, top: Optional[int] = None, token: Optional[dict] = None
+) -> Iterator[Dict]:
+    """Query the Microsoft Graph API for details about SharePoint Sites, yielding each site as each page
+    of results is returned. Optionally pass a comma-separated list of properties as `select`, and a
+    page size as `top`. Yields nothing if the access token could not be obtained.
     Reference: https://learn.microsoft.com/en-us/graph/api/site-list
     """
     if not token:
         token = ms_graph_client_token()
     if not token:  # The call to the MS API occasionally fails and returns None.
-        return None
+        return
     headers = {
         "Authorization": f"Bearer {token['access_token']}",
         "ConsistencyLevel": "eventual",
     }
+    params = {}
+    if select:
+        # webUrl is required to filter team sites.
+        params["$select"] = select if not team_sites or "webUrl" in select.split(",") else f"{select},webUrl"
+    if top:
+        params["$top"] = top
     url = "https://graph.microsoft.com/v1.0/sites"
-    resp = requests.get(url, headers=headers)
-    resp.raise_for_status()
-    j = resp.json()
 
-    sites = []
-    while "@odata.nextLink" in j:
-        sites = sites + j["value"]
-        resp = requests.get(j["@odata.nextLink"], headers=headers)
-        resp.raise_for_status()
-        j = resp.json()
+    for site in graph.paginate(url, headers, params or None):
+        if not team_sites or "teams" in site["webUrl"]:
+            yield site
 
-    sites = sites + j["value"]  # Final page.
-    if team_sites:
-        sites = [site for site in sites if "teams" in site["webUrl"]]
 
-    return sites
+def ms_graph_list_sites(team_sites: bool = True, token: Optional[dict] = None) -> List[Dict] | None:
+    """Query the Microsoft Graph API for details about SharePoint Sites.
+    Reference: https://learn.microsoft.com/en-us/graph/api/site-list
+    """
+    if not token:
+        token = ms_graph_client_token()
+    if not token:  # The call to the MS API occasionally fails and returns None.
+        return None
+
+    return list(ms_graph_iter_sites(team_sites=team_sites, token=token))
 
 
 def ms_graph_get_site(site_id: str, token: Optional[Dict] = None) -> Dict | None:
@@ -350,7 +526,7 @@ def ms_graph_get_site(site_id: str, token: Optional[Dict] = None) -> Dict | None
         "Authorization": f"Bearer {token['access_token']}",
     }
     url = f"https://graph.microsoft.com/v1.0/sites/{site_id}"
-    resp = requests.get(url, headers=headers)
+    resp = graph.get(url, headers=headers)
     resp.raise_for_status()
 
     return resp.json()
@@ -372,14 +548,17 @@ def ms_graph_site_storage_usage(period_value: str = "D7", token: Optional[Dict]
         "ConsistencyLevel": "eventual",
     }
     url = f"https://graph.microsoft.com/v1.0/reports/getSharePointSiteUsageDetail(period='{period_value}')"
-    resp = requests.get(url, headers=headers)
+    resp = graph.get(url, headers=headers)
     resp.raise_for_status()
 
     return resp.content
 
 
-def ms_graph_site_storage_summary(ds: Optional[str] = None, token: Optional[Dict] = None):
-    """Parses the current SharePoint site usage report, and returns a subset of storage usage data."""
+def ms_graph_site_storage_summary(ds: Optional[str] = None, token: Optional[Dict] = None, site_urls: Optional[Dict] = None) -> Dict | None:
+    """Parses the current SharePoint site usage report, and uploads a subset of storage usage data.
+    `site_urls` is an optional dict of {site ID: web URL} resolved previously; other sites are queried
+    (concurrently). Returns the dict of {site ID: web URL} for sites in the summary, to pass in next time.
+    """
     if not token:
         token = ms_graph_client_token()
     if not token:  # The call to the MS API occasionally fails and returns None.
@@ -387,37 +566,37 @@ def ms_graph_site_storage_summary(ds: Optional[str] = None, token: Optional[Dict
 
     storage_usage = ms_graph_site_storage_usage(token=token)
     if not storage_usage:
-        return
-    storage_csv = storage_usage.splitlines()
-    header_row = storage_csv[0].split(b",")
-    header_row = [h.decode("utf-8-sig") for h in header_row]  # Decode without byte order mark.
+        return None
+    reader = csv.reader(BytesIO(storage_usage), encoding="utf-8-sig")  # Decode without byte order mark.
+    header_row = next(reader)
     if not ds:  # Default to today's date.
         ds = datetime.today().strftime("%Y-%m-%d")
 
+    # We're only interested in some of the report output.
+    rows = [row for row in reader if int(row[10]) >= 1024 * 1024 * 1024]  # Only return rows >= 1 GB.
+
+    # TEMP FIX: Microsoft reported an issue where usage reports are incomplete for Sharepoint.
+    # Query each site ID to get the site URL (for sites not already resolved).
+    # Ref: https://stackoverflow.com/a/77550299/14508
+    site_ids = set(row[1] for row in rows)
+    # Retain only the resolved sites which are in this report.
+    site_urls = {site_id: url for site_id, url in (site_urls or {}).items() if site_id in site_ids}
+    sites = ms_graph_query_many(ms_graph_get_site, site_ids - set(site_urls.keys()), token)
+    site_urls.update({site_id: site["webUrl"] for site_id, site in sites.items() if site and site.get("webUrl")})
+
     f = BytesIO()
     writer = csv.writer(f, quoting=csv.QUOTE_MINIMAL)
     writer.writerow([header_row[0], header_row[2], header_row[5], header_row[6], header_row[10]])
-
-    for row in storage_csv[1:]:
-        row = row.decode()
-        row = row.split(",")
-        # We're only interested in some of the report output.
-        if int(row[10]) >= 1024 * 1024 * 1024:  # Only return rows >= 1 GB.
-            # TEMP FIX: Microsoft reported an issue where usage reports are incomplete for Sharepoint.
-            # Query each site ID to get the site URL.
-            # Ref: https://stackoverflow.com/a/77550299/14508
-            site_id = row[1]
-            try:
-                site_json = ms_graph_get_site(site_id, token)
-                site_url = site_json["webUrl"].replace("https://dpaw.sharepoint.com", "")
-            except:
-                site_url = ""
-            writer.writerow([row[0], site_url, row[5], int(row[6]), int(row[10])])
+    for row in rows:
+        site_url = site_urls.get(row[1], "").replace("https://dpaw.sharepoint.com", "")
+        writer.writerow([row[0], site_url, row[5], int(row[6]), int(row[10])])
 
     f.seek(0)
     blob_name = f"storage/site_storage_usage_{ds}.csv"
     upload_blob(in_file=f, container="analytics", blob=blob_name)
 
+    return site_urls
+
 
 def ms_graph_list_signins_user(azure_guid: str, top: int = 5, token: dict | None = None) -> List[Dict] | None:
     """Query the Microsoft Graph API for most-recent interactive, successful sign-in events for an Entra ID user account.
@@ -436,7 +615,7 @@ def ms_graph_list_signins_user(azure_guid: str, top: int = 5, token: dict | None
         "$filter": f"(userId eq '{azure_guid}' and isInteractive eq true and status/errorCode eq 0)",
     }
     url = "https://graph.microsoft.com/v1.0/auditLogs/signIns"
-    resp = requests.get(url, headers=headers, params=params)
+    resp = graph.get(url, headers=headers, params=params)
     resp.raise_for_status()
     j = resp.json()
     return j["value"]
@@ -453,6 +632,11 @@ def compare_values(a, b) -> bool:
     return a == b
 
 
+def json_digest(data) -> str:
+    """Returns a SHA-256 hex digest of the passed-in JSON-serialisable data, used to detect changes."""
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
 def parse_windows_ts(ts: str) -> datetime | None:
     """Parse the string repr of Windows timestamp output, a 64-bit value representing the number of
     100-nanoseconds elapsed since January 1, 1601 (UTC).
@@ -476,40 +660,210 @@ def parse_ad_pwd_last_set(pwd_last_set: int) -> datetime:
     return (datetime(1601, 1, 1) + timedelta(microseconds=pwd_last_set / 10)).astimezone(settings.TZ)
 
 
-def get_freshservice_objects(obj_type) -> List[Dict]:
-    """Query the Freshservice v2 API for objects of a defined type."""
+class OnpremChangeManifest:
+    """Collects the onprem AD property changes from a sync run (see DepartmentUser.sync_ad_data) and
+    uploads them to blob storage together, as newline-delimited JSON blobs named
+    `onprem_changes/{run_id}_{part}.ndjson`. Each change is tagged with the run ID and a sequence
+    number, which orders the changes within the run (and across the parts of its manifest).
+    Queued changes are uploaded by flush(), or once ONPREM_CHANGE_MANIFEST_SIZE changes are queued.
+    If ONPREM_CHANGES_PER_PROPERTY is True (the default, until the onprem sync process reads manifests),
+    each change is instead uploaded as its own JSON blob named `onprem_changes/{identity}_{property}.json`.
+    Upload failures are logged, rather than raised.
+    """
+
+    def __init__(self, container: str = "azuread", run_id: Optional[str] = None):
+        self.container = container
+        self.run_id = run_id or f"{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')}_{uuid4().hex[:8]}"
+        self.changes = []
+        self.sequence = 0
+        self.part = 0
+
+    def add(self, change: Dict):
+        """Queue a change, a dict of {identity, property, value}."""
+        self.sequence += 1
+        self.changes.append({"run_id": self.run_id, "sequence": self.sequence, **change})
+        if len(self.changes) >= settings.ONPREM_CHANGE_MANIFEST_SIZE:
+            self.flush()
+
+    def flush(self):
+        """Upload all queued changes to blob storage."""
+        changes, self.changes = self.changes, []
+        if not changes:
+            return
+
+        if settings.ONPREM_CHANGES_PER_PROPERTY:
+            # A later change to the same property of an account replaces any earlier change.
+            blobs = {
+                f"onprem_changes/{i['identity']}_{i['property']}.json": json.dumps(
+                    {"identity": i["identity"], "property": i["property"], "value": i["value"]}, indent=2
+                ).encode("utf-8")
+                for i in changes
+            }
+            failed = upload_blobs(blobs.items(), self.container)
+            for blob, e in failed.items():
+                LOGGER.error(f"AD SYNC: upload of onprem AD change diff {blob} to blob storage failed: {e}")
+            LOGGER.info(f"AD SYNC: uploaded {len(blobs) - len(failed)} onprem AD change diff(s) to blob storage")
+        else:
+            self.part += 1
+            blob = f"onprem_changes/{self.run_id}_{self.part:04d}.ndjson"
+            f = BytesIO("".join(json.dumps(i) + "\n" for i in changes).encode("utf-8"))
+            try:
+                upload_blob(f, self.container, blob)
+                LOGGER.info(f"AD SYNC: uploaded {len(changes)} onprem AD change(s) to blob storage ({blob})")
+            except Exception as e:
+                LOGGER.error(f"AD SYNC: upload of onprem AD change manifest {blob} to blob storage failed: {e}")
+
+
+def get_freshservice_session() -> requests.Session:
+    """Returns the shared Freshservice API session (creating it on first use), which pools connections
+    and retries rate-limited or failed idempotent requests, waiting for the interval in the Retry-After
+    response header if present.
+    """
+    global FRESHSERVICE_SESSION
+    with FRESHSERVICE_SESSION_LOCK:
+        if FRESHSERVICE_SESSION is None:
+            retry = Retry(
+                total=settings.FRESHSERVICE_MAX_RETRIES,
+                backoff_factor=settings.FRESHSERVICE_RETRY_BACKOFF,
+                backoff_max=settings.FRESHSERVICE_RETRY_BACKOFF_MAX,
+                status_forcelist=[429, 500, 502, 503, 504],
+                respect_retry_after_header=True,
+                raise_on_status=False,
+            )
+            session = TimeoutSession(timeout=settings.FRESHSERVICE_TIMEOUT)
+            session.auth = FRESHSERVICE_AUTH
+            session.mount("https://", HTTPAdapter(max_retries=retry, pool_maxsize=settings.FRESHSERVICE_MAX_WORKERS))
+            FRESHSERVICE_SESSION = session
+        return FRESHSERVICE_SESSION
+
+
+def get_freshservice_objects(obj_type, params: Optional[Dict] = None, max_workers: Optional[int] = None) -> List[Dict]:
+    """Query the Freshservice v2 API for objects of a defined type, with optional query `params`.
+    The API doesn't return the number of pages, so pages are requested concurrently in windows of
+    `max_workers` (default settings.FRESHSERVICE_MAX_WORKERS) pages, until the final page.
+    """
     url = f"{settings.FRESHSERVICE_ENDPOINT}/{obj_type}"
-    params = {
-        "page": 1,
-        "per_page": 100,
-    }
-    objects = []
-    further_results = True
+    params = dict(params or {}, per_page=100)
+    session = get_freshservice_session()
+    max_workers = max_workers or settings.FRESHSERVICE_MAX_WORKERS
 
-    while further_results:
-        print(f"Downloading page {params['page']}")
-        resp = requests.get(url, auth=FRESHSERVICE_AUTH, params=params)
+    def fetch_page(page):
+        resp = session.get(url, params=dict(params, page=page))
         resp.raise_for_status()
-        if "link" not in resp.headers:  # No further paginated results.
-            further_results = False
-        else:
-            print(resp.headers["link"])
+        # The link header is absent from the final page of results.
+        return resp.json()[obj_type], "link" in resp.headers
+
+    objects, further_results = fetch_page(1)
+    page = 2
 
-        objects.extend(resp.json()[obj_type])
-        params["page"] += 1
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while further_results:
+            for page_objects, further_results in executor.map(fetch_page, range(page, page + max_workers)):
+                objects.extend(page_objects)
+                if not further_results:  # Discard any pages requested past the final page.
+                    break
+            page += max_workers
 
-    # Return the list of objects returned.
+    LOGGER.info(f"Downloaded {len(objects)} Freshservice {obj_type}")
     return objects
 
 
+class FreshserviceMirror:
+    """An in-memory mirror of the Freshservice objects of one type, with dict indexes on lookup keys
+    (an index is built for a key on first lookup). The mirror is refreshed on lookup after `ttl`
+    seconds (default FRESHSERVICE_MIRROR_SECONDS). For object types which support it (`incremental`),
+    refreshes request only objects updated since the previous refresh; otherwise all objects are
+    downloaded again.
+    """
+
+    def __init__(self, obj_type: str, incremental: bool = False, ttl: Optional[int] = None):
+        self.obj_type = obj_type
+        self.incremental = incremental
+        self.ttl = ttl
+        self.objects = {}  # {id: object}
+        self.indexes = {}  # {key: {value: object}}
+        self.fetched = None
+        self.updated_since = None
+        self.lock = Lock()
+
+    def expired(self) -> bool:
+        ttl = self.ttl if self.ttl is not None else settings.FRESHSERVICE_MIRROR_SECONDS
+        return self.fetched is None or monotonic() - self.fetched >= ttl
+
+    def refresh(self, full: bool = False) -> None:
+        """Download objects changed since the previous refresh (or all objects), and update the indexes."""
+        started = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        if self.incremental and self.updated_since and not full:
+            for obj in get_freshservice_objects(self.obj_type, params={"updated_since": self.updated_since}):
+                self.add(obj)
+        else:
+            self.objects = {obj["id"]: obj for obj in get_freshservice_objects(self.obj_type)}
+            self.indexes = {key: self.build_index(key) for key in self.indexes}
+        self.updated_since = started
+        self.fetched = monotonic()
+
+    def build_index(self, key: str) -> Dict:
+        index = {}
+        # Retain the first object for each value, as a sequential search would.
+        for obj in self.objects.values():
+            index.setdefault(obj.get(key), obj)
+        return index
+
+    def add(self, obj: Dict) -> None:
+        """Add or replace an object in the mirror (e.g. after it is created or updated)."""
+        previous = self.objects.get(obj["id"])
+        self.objects[obj["id"]] = obj
+        for key, index in self.indexes.items():
+            if previous and index.get(previous.get(key)) is previous:
+                del index[previous.get(key)]
+            index.setdefault(obj.get(key), obj)
+
+    def get(self, key: str, value) -> Dict | None:
+        """Returns the first object having `key` equal to `value`, refreshing the mirror if required."""
+        with self.lock:
+            if self.expired():
+                self.refresh()
+            if key not in self.indexes:
+                self.indexes[key] = self.build_index(key)
+            return self.indexes[key].get(value)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.objects = {}
+            self.indexes = {}
+            self.fetched = None
+            self.updated_since = None
+
+
+def get_freshservice_mirror(obj_type: str) -> FreshserviceMirror:
+    """Returns the shared mirror of Freshservice objects of the passed-in type."""
+    with FRESHSERVICE_SESSION_LOCK:
+        if obj_type not in FRESHSERVICE_MIRRORS:
+            FRESHSERVICE_MIRRORS[obj_type] = FreshserviceMirror(obj_type, incremental=obj_type in FRESHSERVICE_UPDATED_SINCE_TYPES)
+        return FRESHSERVICE_MIRRORS[obj_type]
+
+
 def get_freshservice_object(obj_type, key, value):
     """Use the Freshservice v2 API to retrieve a single object.
     Accepts an object type, object attribute to use, and a value to filter on.
-    Returns the first object found, or None.
+    Returns the first object found, or None. Objects are looked up from a local mirror.
+    Nothing in this project calls this function; it is kept for ad hoc use (e.g. from the Django
+    shell), along with the create and update functions below which keep the mirror current.
     """
+    return get_freshservice_mirror(obj_type).get(key, value)
 
-    objects = get_freshservice_objects(obj_type)
-    return next((obj for obj in objects if obj[key] == value), None)
+
+def freshservice_mirror_update(obj_type, resp):
+    """Update the mirror of Freshservice objects of the passed-in type (if present) from a successful
+    create or update API response, which contains the object (e.g. {"requester": {...}}).
+    """
+    if obj_type not in FRESHSERVICE_MIRRORS or not resp.ok:
+        return
+    objects = [i for i in resp.json().values() if isinstance(i, dict) and "id" in i]
+    if objects:
+        mirror = FRESHSERVICE_MIRRORS[obj_type]
+        with mirror.lock:
+            mirror.add(objects[0])
 
 
 def create_freshservice_object(obj_type, data):
@@ -518,7 +872,8 @@ def create_freshservice_object(obj_type, data):
     """
 
     url = f"{settings.FRESHSERVICE_ENDPOINT}/{obj_type}"
-    resp = requests.post(url, auth=FRESHSERVICE_AUTH, json=data)
+    resp = get_freshservice_session().post(url, json=data)
+    freshservice_mirror_update(obj_type, resp)
 
     return resp
 
@@ -529,6 +884,7 @@ def update_freshservice_object(obj_type, id, data):
     """
 
     url = f"{settings.FRESHSERVICE_ENDPOINT}/{obj_type}/{id}"
-    resp = requests.put(url, auth=FRESHSERVICE_AUTH, json=data)
+    resp = get_freshservice_session().put(url, json=data)
+    freshservice_mirror_update(obj_type, resp)
 
     return resp
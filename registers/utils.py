@@ -1,7 +1,8 @@
+from django.conf import settings
 from django.db.models import Q
 from django.utils.text import smart_split
 from functools import reduce
-import requests
+from itassets import graph
 from itassets.utils import ms_graph_client_token
 
 
@@ -33,49 +34,38 @@ def search_filter(search_fields, query_string):
     return reduce(Q.__and__, filters) if len(filters) else null_filter
 
 
-def ms_graph_sharepoint_users():
+def ms_graph_sharepoint_iter_items(url, select=None, top=None):
+    """Query the Microsoft Graph API for the items in a SharePoint list, yielding the fields of each item
+    as each page of results is returned. Optionally pass a comma-separated list of fields as `select`,
+    and a page size as `top` (default settings.MS_GRAPH_PAGE_SIZE).
+    Yields nothing if the access token could not be obtained.
+    Reference: https://learn.microsoft.com/en-us/graph/api/listitem-list
+    """
     token = ms_graph_client_token()
     if not token:
-        return None
+        return
 
     headers = {
         "Authorization": "Bearer {}".format(token["access_token"]),
         "ConsistencyLevel": "eventual",
     }
-    url = "https://graph.microsoft.com/v1.0/sites/dpaw.sharepoint.com/lists/a9a3eaf6-6580-4506-b7ac-73b621b5ab7a/items?expand=fields"
-    sharepoint_users = []
-    resp = requests.get(url, headers=headers)
-    j = resp.json()
+    params = {
+        "$expand": "fields($select={})".format(select) if select else "fields",
+        "$top": top or settings.MS_GRAPH_PAGE_SIZE,
+    }
+    for item in graph.paginate(url, headers, params):
+        yield item["fields"]
 
-    while "@odata.nextLink" in j:
-        sharepoint_users = sharepoint_users + j["value"]
-        resp = requests.get(j["@odata.nextLink"], headers=headers)
-        resp.raise_for_status()
-        j = resp.json()
 
-    sharepoint_users = sharepoint_users + j["value"]  # Final page
-    return [user["fields"] for user in sharepoint_users]
+def ms_graph_sharepoint_users():
+    url = "https://graph.microsoft.com/v1.0/sites/dpaw.sharepoint.com/lists/a9a3eaf6-6580-4506-b7ac-73b621b5ab7a/items"
+    if not ms_graph_client_token():
+        return None
+    return list(ms_graph_sharepoint_iter_items(url))
 
 
 def ms_graph_sharepoint_it_systems():
-    token = ms_graph_client_token()
-    if not token:
+    url = "https://graph.microsoft.com/v1.0/sites/dpaw.sharepoint.com,485537cf-e72c-431d-9d71-f5101df1f274,2091d73c-5d12-4d02-ac11-fdbe889a6d95/lists/65703834-92c6-4de6-9d10-83862730115f/items"
+    if not ms_graph_client_token():
         return None
-
-    headers = {
-        "Authorization": "Bearer {}".format(token["access_token"]),
-        "ConsistencyLevel": "eventual",
-    }
-    url = "https://graph.microsoft.com/v1.0/sites/dpaw.sharepoint.com,485537cf-e72c-431d-9d71-f5101df1f274,2091d73c-5d12-4d02-ac11-fdbe889a6d95/lists/65703834-92c6-4de6-9d10-83862730115f/items?expand=fields"
-    it_systems = []
-    resp = requests.get(url, headers=headers)
-    j = resp.json()
-
-    while "@odata.nextLink" in j:
-        it_systems = it_systems + j["value"]
-        resp = requests.get(j["@odata.nextLink"], headers=headers)
-        resp.raise_for_status()
-        j = resp.json()
-
-    it_systems = it_systems + j["value"]
-    return [system["fields"] for system in it_systems]
+    return list(ms_graph_sharepoint_iter_items(url))